@@ -0,0 +1,83 @@
+import argparse
+import time
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+
+from core.GenerationEngine import GenerationEngine
+
+
+def time_per_call(function, repeats):
+    """
+    Times a function over several calls.
+
+    Args:
+        function (callable): The function to time.
+        repeats (int): Number of calls.
+
+    Returns:
+        float: Average seconds per call.
+    """
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats
+
+
+if __name__ == "__main__":
+    # Run from the repository root: python -m benchmarks.generation_engine --model_id <model_id>
+    # Compares building a transformers pipeline for every attempt with a persistent GenerationEngine
+    parser = argparse.ArgumentParser(description="Generation engine micro-benchmark")
+    parser.add_argument(
+        "--model_id",
+        type=str,
+        help="The hugging face repository id or local path of the LLM model",
+        required=True,
+    )
+    parser.add_argument(
+        "--repeats", type=int, help="Number of timed generations", default=20
+    )
+    parser.add_argument(
+        "--max_new_tokens", type=int, help="Tokens generated per call", default=8
+    )
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    tokenizer = AutoTokenizer.from_pretrained(args.model_id)
+    tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    model = AutoModelForCausalLM.from_pretrained(args.model_id).to(device)
+    prompt = "CREATE TABLE singer (Singer_ID int, Name text, Country text)\nQuestion: How many singers do we have?\nSQL:"
+
+    def build_pipeline():
+        return pipeline(
+            "text-generation",
+            model=model,
+            tokenizer=tokenizer,
+            device_map="auto",
+            max_new_tokens=args.max_new_tokens,
+        )
+
+    def pipeline_per_attempt():
+        build_pipeline()([prompt], do_sample=False, temperature=None, top_p=None)
+
+    engine = GenerationEngine(model, tokenizer)
+
+    def persistent_engine():
+        engine.generate([prompt], args.max_new_tokens)
+
+    # warm up both paths once
+    pipeline_per_attempt()
+    persistent_engine()
+
+    construction = time_per_call(build_pipeline, args.repeats)
+    per_attempt = time_per_call(pipeline_per_attempt, args.repeats)
+    persistent = time_per_call(persistent_engine, args.repeats)
+
+    print("\n\n\n****************** RESULTS ******************\n")
+    print(f"Pipeline construction: {construction * 1000:.2f} ms per call")
+    print(f"Pipeline built per attempt: {per_attempt * 1000:.2f} ms per generation")
+    print(f"Persistent engine: {persistent * 1000:.2f} ms per generation")
+    print(
+        f"Overhead removed: {(per_attempt - persistent) * 1000:.2f} ms per generation"
+    )
@@ -0,0 +1,175 @@
+import sqlite3
+
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+
+from core.TokenMaskCache import TokenMaskCache, initial_state
+
+
+def statement_complete(text):
+    """
+    Checks whether a completion contains a complete SQL statement after its first SELECT.
+
+    A statement is complete once it is terminated by a semicolon outside string literals and
+    comments, as decided by SQLite itself.
+
+    Args:
+        text (str): The generated text.
+
+    Returns:
+        bool: True if the text from its first "SELECT" forms a complete statement.
+    """
+    start = text.find("SELECT")
+    return start != -1 and sqlite3.complete_statement(text[start:])
+
+
+class BatchGrammarLogitsProcessor(LogitsProcessor):
+    """
+    Applies a (possibly different) grammar constraint to every row of a padded batch.
+
+    Every row keeps its own parsing state, advanced by the token generated for it at the
+    previous step, so every sequence follows its own grammar. The allowed tokens of the parsing
+    states come from a TokenMaskCache and are applied to the whole batch at once.
+    Rows without a grammar are left unconstrained.
+
+    Args:
+        row_constraints (list): One entry per batch row, either a grammar constraint
+            (e.g. IncrementalGrammarConstraint) or None for an unconstrained row.
+        mask_cache (TokenMaskCache, optional): Cache of the allowed-token masks, shared across
+            generations to reuse the masks of recurring parsing states. By default the masks
+            are only reused within this generation.
+    """
+
+    def __init__(self, row_constraints, mask_cache=None):
+        """
+        Initializes the BatchGrammarLogitsProcessor object.
+        """
+        self.row_constraints = row_constraints
+        self.mask_cache = mask_cache or TokenMaskCache()
+        self.states = None
+        # length of the sequences the parsing states correspond to
+        self.length = None
+
+    def advance(self, input_ids):
+        """
+        Advances the parsing state of every row over the tokens appended since the last call.
+
+        The first call starts every row at the beginning of its grammar. Calling it again with
+        the same sequences does nothing, so the stopping criterion can advance the states
+        before the next step of the processor.
+
+        Args:
+            input_ids (torch.LongTensor): Token ids of the batch so far.
+        """
+        if self.states is None:
+            # first step: nothing has been generated yet
+            self.states = [
+                initial_state(constraint) if constraint is not None else None
+                for constraint in self.row_constraints
+            ]
+            self.length = input_ids.shape[1]
+            return
+        for position in range(self.length, input_ids.shape[1]):
+            tokens = input_ids[:, position].tolist()
+            for row, constraint in enumerate(self.row_constraints):
+                if constraint is not None:
+                    self.states[row] = constraint._update_state_with_token_id(
+                        tokens[row], self.states[row]
+                    )
+        self.length = input_ids.shape[1]
+
+    def accepted(self, row):
+        """
+        Checks whether the grammar of a row has reached its accept state.
+
+        Args:
+            row (int): The batch row.
+
+        Returns:
+            bool: True if the grammar allows nothing but the end of the sequence.
+        """
+        return self.row_constraints[row] is not None and self.states[row].must_stop()
+
+    def __call__(self, input_ids, scores):
+        """
+        Masks the logits of each row with the tokens allowed by its grammar.
+
+        Args:
+            input_ids (torch.LongTensor): Token ids of the batch so far.
+            scores (torch.FloatTensor): Next-token logits of the batch.
+
+        Returns:
+            torch.FloatTensor: The masked logits.
+        """
+        self.advance(input_ids)
+        return self.mask_cache.apply(scores, self.row_constraints, self.states)
+
+
+class StatementStoppingCriteria(StoppingCriteria):
+    """
+    Stops every row of a batch as soon as its SQL query is complete.
+
+    A constrained row stops when its grammar reaches the accept state (for the SQL grammars,
+    after the final ";"), instead of spending one more step on the end-of-sequence token.
+    An unconstrained row stops at the end of the first complete statement of its completion
+    (see statement_complete), instead of generating trailing text up to the token limit.
+
+    Args:
+        tokenizer (PreTrainedTokenizer): The tokenizer of the model.
+        prompt_length (int): Length of the (padded) prompts, where the completions start.
+        grammar_processor (BatchGrammarLogitsProcessor, optional): The processor holding the
+            parsing states of the constrained rows.
+    """
+
+    def __init__(self, tokenizer, prompt_length, grammar_processor=None):
+        """
+        Initializes the StatementStoppingCriteria object.
+        """
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.grammar_processor = grammar_processor
+        self.stopped = None
+
+    def constrained(self, row):
+        """
+        Checks whether a row is decoded under a grammar constraint.
+
+        Args:
+            row (int): The batch row.
+
+        Returns:
+            bool: True if the grammar processor constrains the row.
+        """
+        return (
+            self.grammar_processor is not None
+            and self.grammar_processor.row_constraints[row] is not None
+        )
+
+    def __call__(self, input_ids, scores, **kwargs):
+        """
+        Checks which rows have completed their query with the last generated token.
+
+        Args:
+            input_ids (torch.LongTensor): Token ids of the batch so far.
+            scores (torch.FloatTensor): Next-token logits of the batch.
+
+        Returns:
+            torch.BoolTensor: True for every row whose query is complete.
+        """
+        if self.stopped is None:
+            self.stopped = [False] * len(input_ids)
+        if self.grammar_processor is not None:
+            self.grammar_processor.advance(input_ids)
+        for row in range(len(input_ids)):
+            if self.stopped[row]:
+                continue
+            if self.constrained(row):
+                self.stopped[row] = self.grammar_processor.accepted(row)
+            elif ";" in self.tokenizer.decode(input_ids[row, -1:]):
+                # only a token with a semicolon can complete a statement
+                self.stopped[row] = statement_complete(
+                    self.tokenizer.decode(
+                        input_ids[row, self.prompt_length :], skip_special_tokens=True
+                    )
+                )
+        return torch.tensor(self.stopped, device=input_ids.device)
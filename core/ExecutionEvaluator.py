@@ -0,0 +1,653 @@
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+from core.PredictionWriter import ordered_predictions
+from core.SQLiteAccess import ROUTING_POLICIES, SQLiteAccess
+from core.SQLiteExec import QueryLimits, QueryTimeout, execute_with_limits
+from core.SQLValidator import COMPOUND_OPERATORS, tokenize
+
+# database access layer of the current worker process, pooling one connection per database
+_worker_access = None
+_worker_db_base_path = None
+_worker_limits = None
+_worker_immutable = False
+
+# difficulty levels of the Spider benchmark, as columns of the results table
+HARDNESS_LEVELS = ("easy", "medium", "hard", "extra")
+AGGREGATES = ("COUNT", "SUM", "AVG", "MIN", "MAX")
+# row hashes are added modulo 2**128, so the digest does not depend on the row order
+HASH_MODULUS = 1 << 128
+
+
+def normalize_sql(query):
+    """
+    Collapses the whitespace of a query, so that reformatted copies share one cache entry.
+
+    Args:
+        query (str): The SQL query.
+
+    Returns:
+        str: The query with single spaces and no trailing semicolon.
+    """
+    return " ".join(query.split()).rstrip(";").rstrip()
+
+
+def normalize_value(value):
+    """
+    Normalizes a value of a result row before it is hashed.
+
+    Integral floats are hashed as integers, so that 1 and 1.0 are the same value, as they are
+    when rows are compared as Python tuples.
+
+    Args:
+        value (object): A value returned by SQLite.
+
+    Returns:
+        object: The normalized value.
+    """
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+class ResultHash:
+    """
+    Order-insensitive hash of the multiset of rows of a query result.
+
+    Every row is hashed on its own and the row hashes are added modulo 2**128: the digest of
+    two results is the same if they hold the same rows the same number of times, whatever
+    their order, and results are compared without keeping their rows.
+    """
+
+    def __init__(self):
+        """
+        Initializes the ResultHash object.
+        """
+        self.rows = 0
+        self.total = 0
+
+    def update(self, rows):
+        """
+        Adds rows to the hashed multiset.
+
+        Args:
+            rows (list): Rows (tuples) of the result.
+        """
+        for row in rows:
+            encoded = repr(tuple(normalize_value(value) for value in row)).encode()
+            row_hash = hashlib.blake2b(encoded, digest_size=16).digest()
+            self.total = (self.total + int.from_bytes(row_hash, "big")) % HASH_MODULUS
+        self.rows += len(rows)
+
+    def digest(self):
+        """
+        Returns the digest of the hashed rows.
+
+        Returns:
+            str: The number of rows and the sum of the row hashes.
+        """
+        return f"{self.rows}:{self.total:032x}"
+
+
+def spider_hardness(query):
+    """
+    Classifies the difficulty of a query with the hardness rules of the Spider evaluation.
+
+    The Spider rules count the clauses of the outermost query (WHERE, GROUP BY, ORDER BY,
+    LIMIT, joins, OR and LIKE conditions), its nested queries (subqueries in conditions and
+    compound selects) and its other components (several aggregates, selected columns, WHERE
+    conditions or GROUP BY columns). The components are counted on the tokens of the query
+    instead of the parsed SQL of the Spider evaluator.
+
+    Args:
+        query (str): The SQL query, usually the gold query.
+
+    Returns:
+        str: One of HARDNESS_LEVELS.
+    """
+    tokens, _ = tokenize(query)
+    # tokens of the outermost query, subqueries reduced to their parentheses
+    outer = []
+    depth = 0
+    for position, token in enumerate(tokens):
+        if token.text == ")":
+            depth -= 1
+        if depth == 0:
+            subquery = (
+                token.text == "("
+                and position + 1 < len(tokens)
+                and tokens[position + 1].is_keyword("SELECT", "WITH")
+            )
+            outer.append((token, subquery))
+        if token.text == "(":
+            depth += 1
+
+    compound = 0
+    for position, (token, _) in enumerate(outer):
+        if token.is_keyword(*COMPOUND_OPERATORS):
+            compound = 1
+            outer = outer[:position]
+            break
+
+    clauses = set()
+    clause = None
+    tables = 1
+    conditions = 0
+    columns = {"SELECT": 1, "GROUP": 1}
+    component1 = 0
+    nested = compound
+    aggregates = 0
+    between = False
+    for position, (token, subquery) in enumerate(outer):
+        if token.is_keyword(
+            "SELECT", "FROM", "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT"
+        ):
+            clause = token.upper
+            clauses.add(clause)
+            if clause == "WHERE":
+                conditions = 1
+        elif token.text == ",":
+            if clause in columns:
+                columns[clause] += 1
+            elif clause == "FROM":
+                tables += 1
+        elif clause == "FROM" and token.is_keyword("JOIN"):
+            tables += 1
+        elif clause == "WHERE" and token.is_keyword("OR", "LIKE"):
+            component1 += 1
+        if clause == "WHERE" and token.is_keyword("BETWEEN"):
+            between = True
+        elif clause == "WHERE" and token.is_keyword("AND", "OR"):
+            # the AND of a BETWEEN is not a condition separator
+            if between and token.is_keyword("AND"):
+                between = False
+            else:
+                conditions += 1
+        if subquery and clause in ("WHERE", "HAVING"):
+            nested += 1
+        if (
+            token.upper in AGGREGATES
+            and position + 1 < len(outer)
+            and outer[position + 1][0].text == "("
+        ):
+            aggregates += 1
+
+    component1 += sum(
+        clause in clauses for clause in ("WHERE", "GROUP", "ORDER", "LIMIT")
+    )
+    component1 += tables - 1
+    others = (
+        (aggregates > 1)
+        + (columns["SELECT"] > 1)
+        + (conditions > 1)
+        + (columns["GROUP"] > 1)
+    )
+
+    if component1 <= 1 and others == 0 and nested == 0:
+        return "easy"
+    if (others <= 2 and component1 <= 1 and nested == 0) or (
+        component1 <= 2 and others < 2 and nested == 0
+    ):
+        return "medium"
+    if (
+        (others > 2 and component1 <= 2 and nested == 0)
+        or (2 < component1 <= 3 and others <= 2 and nested == 0)
+        or (component1 <= 1 and others == 0 and nested <= 1)
+    ):
+        return "hard"
+    return "extra"
+
+
+def load_gold(gold_path):
+    """
+    Reads the gold queries of a benchmark split.
+
+    Two formats are accepted: the JSON questions file of the split (a list of objects with
+    "query" and "db_id" keys, as passed to sql_inference.py), or a gold SQL file with one
+    "query<TAB>db_id" line per question, as distributed with Spider. An explicit "hardness"
+    key of a JSON entry is used as is, otherwise the hardness is derived from the query.
+
+    Args:
+        gold_path (str): Path to the gold file.
+
+    Returns:
+        list: Gold dictionaries with "query", "db_id" and "hardness" keys, in question order.
+    """
+    gold = []
+    if gold_path.endswith(".json"):
+        with open(gold_path, "r") as file:
+            for entry in json.load(file):
+                gold.append(
+                    {
+                        "query": entry["query"],
+                        "db_id": entry["db_id"],
+                        "hardness": entry.get("hardness")
+                        or spider_hardness(entry["query"]),
+                    }
+                )
+        return gold
+    with open(gold_path, "r") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            query, db_id = line.rstrip("\n").rsplit("\t", 1)
+            gold.append(
+                {
+                    "query": query,
+                    "db_id": db_id.strip(),
+                    "hardness": spider_hardness(query),
+                }
+            )
+    return gold
+
+
+def load_predictions(predictions_path):
+    """
+    Reads the predicted queries of a run.
+
+    Accepts the output.txt of a run (one query per line), or its output.json or output.jsonl
+    (answer records in question id order), which also give the number of attempts.
+
+    Args:
+        predictions_path (str): Path to the predictions file.
+
+    Returns:
+        list: Prediction dictionaries with "answer" and "attempts" keys (attempts is None for
+            a TXT file), in question order.
+    """
+    if predictions_path.endswith(".jsonl"):
+        records = ordered_predictions(predictions_path)
+    elif predictions_path.endswith(".json"):
+        with open(predictions_path, "r") as file:
+            records = sorted(json.load(file), key=lambda record: record["id"])
+    else:
+        with open(predictions_path, "r") as file:
+            return [
+                {"answer": line.strip(), "attempts": None}
+                for line in file.read().splitlines()
+            ]
+    return [
+        {"answer": record["answer"] or "", "attempts": record.get("attempts")}
+        for record in records
+    ]
+
+
+def _init_worker(db_base_path, limits, immutable, routing):
+    """
+    Sets the database base path, query budget and mirror routing policy of a worker process.
+
+    This is a private helper function.
+    """
+    global _worker_access, _worker_db_base_path, _worker_limits, _worker_immutable
+    _worker_access = SQLiteAccess(routing=routing)
+    _worker_db_base_path = db_base_path
+    _worker_limits = limits
+    _worker_immutable = immutable
+
+
+def _hash_result(connection, query):
+    """
+    Executes a query within the budget of the worker and hashes its result.
+
+    This is a private helper function. A fresh hash is used on every call, so a read retried
+    on a mirror does not count the rows twice.
+    """
+    result = ResultHash()
+    execute_with_limits(connection, query, _worker_limits, result.update)
+    return result.digest()
+
+
+def _hash_shard(shard):
+    """
+    Executes a shard of queries and hashes their results, reusing pooled connections.
+
+    This is a private helper function.
+
+    Args:
+        shard (list): (key, query, db_id) tuples.
+
+    Returns:
+        list: (key, outcome, digest, error) tuples, where outcome is "ok", "error" or
+            "timeout" and digest is the result hash of an "ok" query.
+    """
+    results = []
+    for key, query, db_id in shard:
+        try:
+            db_path = os.path.join(_worker_db_base_path, db_id, f"{db_id}.sqlite")
+            digest = _worker_access.run(
+                db_path,
+                lambda conn, path: _hash_result(conn, query),
+                _worker_immutable,
+            )
+            results.append((key, "ok", digest, None))
+        except QueryTimeout as e:
+            results.append((key, "timeout", None, str(e)))
+        except sqlite3.Error as e:
+            results.append((key, "error", None, str(e)))
+    return results
+
+
+class ExecutionEvaluator:
+    """
+    Measures the execution accuracy of predicted queries against the gold queries.
+
+    This class handles:
+        * Executing the gold and predicted queries in a process pool, grouped by database,
+          within a per-query execution budget.
+        * Comparing results through order-insensitive multiset hashes (see ResultHash): a
+          prediction is correct when its result has the same rows as the gold result, the
+          same number of times, in any order.
+        * Caching the gold results on disk, keyed by database id and hash of the gold query,
+          so that evaluating several runs (or the same run again) executes each gold query
+          once. An entry is recomputed when its database file changes; timeouts are not cached.
+        * Executing a predicted query shared by several runs only once.
+        * Reporting Count, Attempts, Execution Accuracy and % of executable queries per Spider
+          hardness level, as in evaluation/results.csv.
+
+    Args:
+        db_base_path (str): The base directory where database folders are located.
+        cache_path (str, optional): Path to the JSON file of the gold result cache, None to
+            keep the gold results in memory only.
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs;
+            1 executes the queries in the current process.
+        shard_size (int, optional): Maximum number of queries sent to a worker at once.
+        limits (QueryLimits, optional): Execution budget of every query.
+        immutable (bool, optional): Whether databases are opened with immutable=1.
+        routing (str, optional): Routing policy of reads across the database mirrors.
+    """
+
+    def __init__(
+        self,
+        db_base_path,
+        cache_path=None,
+        workers=None,
+        shard_size=64,
+        limits=None,
+        immutable=False,
+        routing="failover",
+    ):
+        """
+        Initializes the ExecutionEvaluator object.
+        """
+        if routing not in ROUTING_POLICIES:
+            raise ValueError(f"Unknown routing policy: {routing}")
+        self.db_base_path = db_base_path
+        self.cache_path = cache_path
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_size = shard_size
+        self.limits = limits or QueryLimits()
+        self.immutable = immutable
+        self.routing = routing
+        # "db_id/sha256 of the gold query" -> {"outcome", "digest", "error", "version"}
+        self.cache = {}
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, "r") as file:
+                self.cache = json.load(file)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.executed = 0
+
+    def cache_key(self, db_id, query):
+        """
+        Builds the cache key of a gold query.
+
+        Args:
+            db_id (str): The database identifier.
+            query (str): The gold query.
+
+        Returns:
+            str: The database id and the SHA-256 of the normalized query.
+        """
+        query_hash = hashlib.sha256(normalize_sql(query).encode("utf-8")).hexdigest()
+        return f"{db_id}/{query_hash}"
+
+    def database_version(self, db_id):
+        """
+        Identifies the current version of a database file.
+
+        Args:
+            db_id (str): The database identifier.
+
+        Returns:
+            list: The modification time (ns) and size of the file, or None if it is missing.
+        """
+        db_path = os.path.join(self.db_base_path, db_id, f"{db_id}.sqlite")
+        try:
+            stat = os.stat(db_path)
+        except OSError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def execute(self, items):
+        """
+        Executes queries and hashes their results in the process pool.
+
+        Args:
+            items (dict): Queries to execute, as key -> (query, db_id).
+
+        Returns:
+            dict: key -> (outcome, digest, error), outcome being "ok", "error" or "timeout".
+        """
+        by_database = {}
+        for key, (query, db_id) in items.items():
+            by_database.setdefault(db_id, []).append((key, query, db_id))
+        shards = []
+        for shard_items in by_database.values():
+            for start in range(0, len(shard_items), self.shard_size):
+                shards.append(shard_items[start : start + self.shard_size])
+        self.executed += len(items)
+
+        if self.workers == 1 or len(shards) <= 1:
+            _init_worker(self.db_base_path, self.limits, self.immutable, self.routing)
+            shard_results = [_hash_shard(shard) for shard in shards]
+            _worker_access.close()
+        else:
+            with ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(
+                    self.db_base_path,
+                    self.limits,
+                    self.immutable,
+                    self.routing,
+                ),
+            ) as executor:
+                shard_results = list(executor.map(_hash_shard, shards))
+
+        results = {}
+        for shard_result in shard_results:
+            for key, outcome, digest, error in shard_result:
+                results[key] = (outcome, digest, error)
+        return results
+
+    def gold_results(self, gold):
+        """
+        Retrieves the results of the gold queries, executing the ones missing from the cache.
+
+        Args:
+            gold (list): Gold dictionaries with "query" and "db_id" keys.
+
+        Returns:
+            list: One cache entry per gold query, with "outcome", "digest" and "error" keys.
+        """
+        keys = [self.cache_key(entry["db_id"], entry["query"]) for entry in gold]
+        missing = {}
+        for key, entry in zip(keys, gold):
+            cached = self.cache.get(key)
+            if cached is not None and cached["version"] == self.database_version(
+                entry["db_id"]
+            ):
+                self.cache_hits += 1
+            elif key not in missing:
+                self.cache_misses += 1
+                missing[key] = (entry["query"], entry["db_id"])
+
+        if missing:
+            print(f"Executing {len(missing)} gold queries missing from the cache")
+            for key, (outcome, digest, error) in self.execute(missing).items():
+                db_id = missing[key][1]
+                if outcome == "timeout":
+                    # a timeout depends on the budget and the machine: retried on the next run
+                    self.cache.pop(key, None)
+                    uncached = {"outcome": outcome, "digest": None, "error": error}
+                    missing[key] = uncached
+                    continue
+                self.cache[key] = {
+                    "outcome": outcome,
+                    "digest": digest,
+                    "error": error,
+                    "version": self.database_version(db_id),
+                }
+            self.save_cache()
+
+        results = [
+            self.cache[key] if key in self.cache else missing[key] for key in keys
+        ]
+        failed = sum(result["outcome"] != "ok" for result in results)
+        if failed:
+            print(
+                f"Warning: {failed} gold queries failed, their questions count as incorrect"
+            )
+        return results
+
+    def save_cache(self):
+        """
+        Atomically writes the gold result cache to its file, if it has one.
+        """
+        if not self.cache_path:
+            return
+        temp_path = f"{self.cache_path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self.cache, file)
+        os.replace(temp_path, self.cache_path)
+
+    def evaluate(self, gold, runs):
+        """
+        Evaluates the predictions of one or more runs against the gold queries.
+
+        The gold queries are executed once (or taken from the cache), and a predicted query
+        appearing in several runs is executed once.
+
+        Args:
+            gold (list): Gold dictionaries with "query", "db_id" and "hardness" keys.
+            runs (dict): Run name -> list of prediction dictionaries with "answer" and
+                "attempts" keys, aligned with the gold list.
+
+        Returns:
+            dict: Run name -> list of per-question dictionaries with "hardness", "executable",
+                "correct" and "attempts" keys.
+
+        Raises:
+            ValueError: If a run does not have one prediction per gold query.
+        """
+        for name, predictions in runs.items():
+            if len(predictions) != len(gold):
+                raise ValueError(
+                    f"{name} has {len(predictions)} predictions for {len(gold)} gold queries"
+                )
+
+        gold_results = self.gold_results(gold)
+        pending = {}
+        for predictions in runs.values():
+            for prediction, entry in zip(predictions, gold):
+                query = normalize_sql(prediction["answer"])
+                if query:
+                    pending[(entry["db_id"], query)] = (query, entry["db_id"])
+        print(
+            f"Executing {len(pending)} distinct predicted queries of {len(runs)} runs"
+        )
+        predicted_results = self.execute(pending)
+
+        evaluation = {}
+        for name, predictions in runs.items():
+            questions = []
+            for prediction, entry, gold_result in zip(predictions, gold, gold_results):
+                query = normalize_sql(prediction["answer"])
+                outcome, digest, _ = predicted_results.get(
+                    (entry["db_id"], query), ("error", None, None)
+                )
+                questions.append(
+                    {
+                        "hardness": entry["hardness"],
+                        "executable": outcome == "ok",
+                        "correct": outcome == "ok"
+                        and gold_result["outcome"] == "ok"
+                        and digest == gold_result["digest"],
+                        "attempts": prediction["attempts"],
+                    }
+                )
+            evaluation[name] = questions
+        return evaluation
+
+    def breakdown(self, questions):
+        """
+        Summarizes the evaluation of a run per hardness level.
+
+        Args:
+            questions (list): Per-question dictionaries, as returned by evaluate.
+
+        Returns:
+            dict: Metric -> values of the "Easy", "Medium", "Hard", "Extra" and "All" columns.
+                Count and Execution Accuracy are given per level; Attempts (when the
+                predictions record them) and % of executable queries only for All.
+        """
+        columns = [level.capitalize() for level in HARDNESS_LEVELS] + ["All"]
+        counts = dict.fromkeys(columns, 0)
+        correct = dict.fromkeys(columns, 0)
+        for question in questions:
+            for column in (question["hardness"].capitalize(), "All"):
+                counts[column] += 1
+                correct[column] += question["correct"]
+
+        metrics = {"Count": counts}
+        attempts = [question["attempts"] for question in questions]
+        if attempts and None not in attempts:
+            metrics["Attempts"] = {"All": sum(attempts)}
+        metrics["Execution Accuracy"] = {
+            column: round(correct[column] / counts[column], 3)
+            for column in columns
+            if counts[column]
+        }
+        executable = sum(question["executable"] for question in questions)
+        metrics["% of executable queries"] = {
+            "All": round(executable / len(questions) * 100, 2) if questions else 0.0
+        }
+        return metrics
+
+    def write_results(self, breakdowns, results_path):
+        """
+        Writes the breakdowns of several runs as a CSV file in the format of
+        evaluation/results.csv.
+
+        Args:
+            breakdowns (dict): Run name (the Type column) -> breakdown, as returned by
+                breakdown.
+            results_path (str): Path to the CSV output file.
+        """
+        columns = [level.capitalize() for level in HARDNESS_LEVELS] + ["All"]
+        with open(results_path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["Type", "Metric"] + columns)
+            for name, metrics in breakdowns.items():
+                for metric, values in metrics.items():
+                    writer.writerow(
+                        [name, metric] + [values.get(column, "") for column in columns]
+                    )
+
+    def stats(self):
+        """
+        Reports the evaluator counters.
+
+        Returns:
+            dict: Gold cache hits and misses, cached gold results and executed queries.
+        """
+        return {
+            "gold_cache_hits": self.cache_hits,
+            "gold_cache_misses": self.cache_misses,
+            "gold_cache_size": len(self.cache),
+            "executed_queries": self.executed,
+        }
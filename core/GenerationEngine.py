@@ -0,0 +1,492 @@
+from collections import OrderedDict
+
+import torch
+from transformers import DynamicCache, StoppingCriteriaList
+
+from core.ConstrainedDecoding import (
+    BatchGrammarLogitsProcessor,
+    StatementStoppingCriteria,
+    statement_complete,
+)
+from core.TokenMaskCache import TokenMaskCache, initial_state
+
+# placeholder used to locate the end of a prefix in its rendered text
+PREFIX_MARKER = "<<<PREFIX_END>>>"
+
+
+def common_prefix_length(first, second):
+    """
+    Computes the length of the common prefix of two token id sequences.
+
+    Args:
+        first (list): Token ids.
+        second (list): Token ids.
+
+    Returns:
+        int: The number of leading token ids the sequences share.
+    """
+    length = 0
+    for first_id, second_id in zip(first, second):
+        if first_id != second_id:
+            break
+        length += 1
+    return length
+
+
+class GenerationEngine:
+    """
+    Persistent text-generation engine around a loaded causal LM and its tokenizer.
+
+    The engine is built once and reused for every generation, replacing the per-attempt
+    construction of a transformers pipeline. It handles:
+        * Rendering prompts (plain text or chat template in instruction mode)
+        * Counting prompt tokens to derive per-call length limits
+        * Greedy generation of a padded batch of prompts
+        * Caching the KV states of shared prompt prefixes (system prompt and schema), so that
+          prompts starting with a cached prefix only prefill their suffix
+        * Jump-forward decoding: tokens forced by the grammar of a row are appended without
+          a forward pass of their own
+        * Stopping every row as soon as its SQL query is complete (see
+          StatementStoppingCriteria), instead of generating up to the token limit
+
+    Args:
+        model (PreTrainedModel): The causal language model.
+        tokenizer (PreTrainedTokenizer): The tokenizer of the model, padded on the left.
+        instruct (bool, optional): Whether prompts are wrapped in the model chat template.
+        system_prompt (str, optional): System message used in instruction mode.
+        max_cached_prefixes (int, optional): Maximum number of prefix KV states kept in memory.
+        jump_forward (bool, optional): Whether constrained batches are decoded with
+            jump-forward decoding (see decode_jump_forward).
+        mask_cache (TokenMaskCache, optional): Cache of the allowed-token masks of grammar
+            parsing states used by jump-forward decoding.
+        stop_at_statement_end (bool, optional): Whether rows stop at the accept state of their
+            grammar, or at the end of their first complete statement when unconstrained.
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        instruct=False,
+        system_prompt=None,
+        max_cached_prefixes=16,
+        jump_forward=False,
+        mask_cache=None,
+        stop_at_statement_end=True,
+    ):
+        """
+        Initializes the GenerationEngine object.
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.instruct = instruct
+        self.system_prompt = system_prompt
+        self.max_cached_prefixes = max_cached_prefixes
+        # prefix key -> (rendered prefix, prefix token ids, legacy KV cache of the prefix)
+        self.prefix_cache = OrderedDict()
+        self.prefix_hits = 0
+        self.prefix_misses = 0
+        self.reused_tokens = 0
+        self.prefilled_tokens = 0
+        self.jump_forward = jump_forward
+        self.mask_cache = mask_cache or TokenMaskCache()
+        self.stop_at_statement_end = stop_at_statement_end
+        # per row of the last batch: generated tokens, forward passes (jump-forward decoding
+        # only, None otherwise) and whether the row stopped at the end of its query
+        self.last_decode_stats = None
+        self.generated_tokens = 0
+        self.forward_passes = 0
+
+    def render(self, prompt):
+        """
+        Renders a prompt into the exact text fed to the model.
+
+        Args:
+            prompt (str): The user prompt.
+
+        Returns:
+            str: The prompt itself, or the chat template applied to it in instruction mode.
+        """
+        if not self.instruct:
+            return prompt
+        messages = [{"role": "user", "content": prompt}]
+        if self.system_prompt:
+            messages.insert(0, {"role": "system", "content": self.system_prompt})
+        return self.tokenizer.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=True
+        )
+
+    def encode(self, texts):
+        """
+        Tokenizes rendered prompts into a left-padded batch.
+
+        Args:
+            texts (list): Rendered prompts.
+
+        Returns:
+            BatchEncoding: input_ids and attention_mask on the model device.
+        """
+        # the chat template already contains the special tokens
+        return self.tokenizer(
+            texts,
+            return_tensors="pt",
+            padding=True,
+            add_special_tokens=not self.instruct,
+        ).to(self.model.device)
+
+    def count_tokens(self, prompt):
+        """
+        Counts the tokens of a prompt as it will be fed to the model.
+
+        Args:
+            prompt (str): The user prompt.
+
+        Returns:
+            int: The number of prompt tokens.
+        """
+        return len(self.encode([self.render(prompt)])["input_ids"][0])
+
+    def render_prefix(self, prefix):
+        """
+        Renders a prompt prefix into the text that starts every rendered prompt beginning with it.
+
+        Args:
+            prefix (str): The start of user prompts.
+
+        Returns:
+            str: The rendered prefix, including the chat template header in instruction mode.
+        """
+        if not self.instruct:
+            return prefix
+        return self.render(prefix + PREFIX_MARKER).split(PREFIX_MARKER)[0]
+
+    @torch.no_grad()
+    def get_prefix_state(self, key, prefix):
+        """
+        Retrieves the token ids and KV states of a prompt prefix, prefilling it on a miss.
+
+        Args:
+            key (hashable): Cache key of the prefix.
+            prefix (str): The start of user prompts.
+
+        Returns:
+            tuple: The prefix token ids and its KV states in the legacy cache format.
+        """
+        rendered = self.render_prefix(prefix)
+        entry = self.prefix_cache.get(key)
+        if entry is not None and entry[0] == rendered:
+            self.prefix_hits += 1
+            self.prefix_cache.move_to_end(key)
+            return entry[1], entry[2]
+
+        self.prefix_misses += 1
+        prefix_ids = self.encode([rendered])["input_ids"]
+        past_key_values = self.model(
+            input_ids=prefix_ids, past_key_values=DynamicCache(), use_cache=True
+        ).past_key_values.to_legacy_cache()
+        self.prefix_cache[key] = (rendered, prefix_ids[0].tolist(), past_key_values)
+        if len(self.prefix_cache) > self.max_cached_prefixes:
+            self.prefix_cache.popitem(last=False)
+        return self.prefix_cache[key][1], past_key_values
+
+    def encode_with_prefixes(self, texts, prefixes):
+        """
+        Tokenizes rendered prompts into a batch that reuses the KV states of cached prefixes.
+
+        Every row is laid out as [left padding][reused prefix][padding][suffix]: the reused
+        prefix tokens are covered by the merged KV cache and only the suffix is prefilled.
+        Position ids follow the attention mask, so the padding in the middle does not shift
+        the positions of the suffix.
+
+        Args:
+            texts (list): Rendered prompts.
+            prefixes (list): (key, prefix) pairs, or None for rows without a cached prefix.
+
+        Returns:
+            dict: input_ids, attention_mask and past_key_values on the model device, or None if
+                no row reuses a prefix.
+        """
+        rows = []
+        for text, prefix in zip(texts, prefixes):
+            ids = self.encode([text])["input_ids"][0].tolist()
+            reused, past_key_values = 0, None
+            if prefix is not None:
+                prefix_ids, past_key_values = self.get_prefix_state(*prefix)
+                # tokens merged across the prefix boundary are prefilled again, and at least
+                # one token is left to prefill
+                reused = min(common_prefix_length(ids, prefix_ids), len(ids) - 1)
+            rows.append((ids, reused, past_key_values))
+
+        prefix_length = max(reused for _, reused, _ in rows)
+        if prefix_length == 0:
+            return None
+        suffix_length = max(len(ids) - reused for ids, reused, _ in rows)
+        reference = next(past for _, reused, past in rows if reused)
+
+        pad_token_id = self.tokenizer.pad_token_id
+        input_ids, attention_mask = [], []
+        layers = [([], []) for _ in reference]
+        for ids, reused, past_key_values in rows:
+            suffix = ids[reused:]
+            left, middle = prefix_length - reused, suffix_length - len(suffix)
+            input_ids.append(
+                [pad_token_id] * left + ids[:reused] + [pad_token_id] * middle + suffix
+            )
+            attention_mask.append(
+                [0] * left + [1] * reused + [0] * middle + [1] * len(suffix)
+            )
+            # rows without a reused prefix only contribute padding
+            source = past_key_values if reused else reference
+            for layer, layer_states in enumerate(source):
+                for states, cached in zip(layers[layer], layer_states):
+                    cached = cached[:, :, :reused]
+                    padding = cached.new_zeros(
+                        cached.shape[:2] + (left,) + cached.shape[3:]
+                    )
+                    states.append(torch.cat([padding, cached], dim=2))
+            self.reused_tokens += reused
+            self.prefilled_tokens += len(suffix)
+
+        device = self.model.device
+        return {
+            "input_ids": torch.tensor(input_ids, device=device),
+            "attention_mask": torch.tensor(attention_mask, device=device),
+            "past_key_values": tuple(
+                (torch.cat(keys, dim=0), torch.cat(values, dim=0))
+                for keys, values in layers
+            ),
+        }
+
+    @torch.no_grad()
+    def decode_jump_forward(self, inputs, row_constraints, max_new_tokens):
+        """
+        Greedily decodes a batch under per-row grammar constraints, jumping over forced tokens.
+
+        After every sampled token, the tokens the grammar of a row allows as the only
+        continuation (e.g. the rest of a keyword or of the single table name matching the
+        prefix) are appended at once. They are fed to the model together with the sampled
+        token in the next forward pass, instead of one forward pass each. Greedy decoding
+        would pick these tokens anyway, so the output is the one of constrained generation.
+        With stop_at_statement_end, rows stop as StatementStoppingCriteria stops them.
+
+        Args:
+            inputs (dict): input_ids, attention_mask and optionally past_key_values (legacy
+                cache of the leading input positions), as returned by encode or
+                encode_with_prefixes.
+            row_constraints (list): The grammar constraint of every row, or None for an
+                unconstrained row.
+            max_new_tokens (int): Maximum number of tokens generated per row.
+
+        Returns:
+            list: The generated token ids of each row, without the prompt.
+        """
+        eos_token_id = self.tokenizer.eos_token_id
+        pad_token_id = self.tokenizer.pad_token_id
+        attention_mask = inputs["attention_mask"]
+        past_key_values = DynamicCache()
+        cached = 0
+        if inputs.get("past_key_values") is not None:
+            past_key_values = DynamicCache.from_legacy_cache(inputs["past_key_values"])
+            cached = past_key_values.get_seq_length()
+        new_tokens = inputs["input_ids"][:, cached:]
+
+        rows = len(row_constraints)
+        states = [
+            initial_state(constraint) if constraint is not None else None
+            for constraint in row_constraints
+        ]
+        generated = [[] for _ in range(rows)]
+        passes = [0] * rows
+        finished = [False] * rows
+        stopped = [False] * rows
+
+        def append(row, token):
+            generated[row].append(token)
+            if token == eos_token_id or len(generated[row]) >= max_new_tokens:
+                finished[row] = True
+            elif row_constraints[row] is not None:
+                states[row] = row_constraints[row]._update_state_with_token_id(
+                    token, states[row]
+                )
+                stopped[row] = self.stop_at_statement_end and states[row].must_stop()
+            elif self.stop_at_statement_end and ";" in self.tokenizer.decode([token]):
+                stopped[row] = statement_complete(
+                    self.tokenizer.decode(generated[row], skip_special_tokens=True)
+                )
+            finished[row] = finished[row] or stopped[row]
+
+        while True:
+            positions = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+            outputs = self.model(
+                input_ids=new_tokens,
+                attention_mask=attention_mask,
+                position_ids=positions[:, -new_tokens.shape[1] :],
+                past_key_values=past_key_values,
+                use_cache=True,
+            )
+            past_key_values = outputs.past_key_values
+            # finished rows are left unconstrained, their scores are not used
+            active_constraints = [
+                None if done else constraint
+                for constraint, done in zip(row_constraints, finished)
+            ]
+            scores = self.mask_cache.apply(
+                outputs.logits[:, -1, :], active_constraints, states
+            )
+            next_tokens = scores.argmax(dim=-1).tolist()
+
+            pending = [[] for _ in range(rows)]
+            for row in range(rows):
+                if finished[row]:
+                    continue
+                passes[row] += 1
+                start = len(generated[row])
+                append(row, next_tokens[row])
+                # jump over the tokens the grammar forces next
+                while not finished[row] and row_constraints[row] is not None:
+                    forced = self.mask_cache.forced_token(
+                        row_constraints[row], states[row]
+                    )
+                    if forced is None:
+                        break
+                    append(row, forced)
+                pending[row] = generated[row][start:]
+
+            if all(finished):
+                break
+            # rows feed chunks of different lengths, padded on the left within the chunk
+            width = max(len(tokens) for tokens in pending)
+            new_tokens = torch.tensor(
+                [[pad_token_id] * (width - len(tokens)) + tokens for tokens in pending],
+                device=attention_mask.device,
+            )
+            chunk_mask = torch.tensor(
+                [[0] * (width - len(tokens)) + [1] * len(tokens) for tokens in pending],
+                device=attention_mask.device,
+                dtype=attention_mask.dtype,
+            )
+            attention_mask = torch.cat([attention_mask, chunk_mask], dim=1)
+
+        self.last_decode_stats = [
+            {"tokens": len(tokens), "forward_passes": count, "stopped": stop}
+            for tokens, count, stop in zip(generated, passes, stopped)
+        ]
+        self.generated_tokens += sum(len(tokens) for tokens in generated)
+        self.forward_passes += sum(passes)
+        return generated
+
+    @torch.no_grad()
+    def generate(
+        self,
+        prompts,
+        max_new_tokens,
+        logits_processor=None,
+        prefixes=None,
+        row_constraints=None,
+    ):
+        """
+        Greedily completes a batch of prompts.
+
+        Args:
+            prompts (list): The user prompts.
+            max_new_tokens (int): Maximum number of tokens generated per prompt.
+            logits_processor (list, optional): Logits processors applied at every step.
+            prefixes (list, optional): Per prompt, a (key, prefix) pair naming the start of the
+                prompt whose KV states are cached under the key, or None.
+            row_constraints (list, optional): The grammar constraint of every prompt (or None).
+                With jump_forward, they are applied by decode_jump_forward instead of the
+                logits processors.
+
+        Returns:
+            list: The generated completion of each prompt, without the prompt.
+        """
+        texts = [self.render(prompt) for prompt in prompts]
+        inputs = None
+        if prefixes is not None and any(prefixes):
+            inputs = self.encode_with_prefixes(texts, prefixes)
+        if inputs is None:
+            inputs = self.encode(texts)
+            self.prefilled_tokens += int(inputs["attention_mask"].sum())
+        if self.jump_forward and row_constraints is not None:
+            generated = self.decode_jump_forward(
+                inputs, row_constraints, max_new_tokens
+            )
+            return self.tokenizer.batch_decode(generated, skip_special_tokens=True)
+        prompt_length = inputs["input_ids"].shape[1]
+        stopping_criteria = None
+        if self.stop_at_statement_end:
+            grammar_processor = next(
+                (
+                    processor
+                    for processor in logits_processor or []
+                    if isinstance(processor, BatchGrammarLogitsProcessor)
+                ),
+                None,
+            )
+            stopping_criteria = StoppingCriteriaList(
+                [
+                    StatementStoppingCriteria(
+                        self.tokenizer, prompt_length, grammar_processor
+                    )
+                ]
+            )
+        outputs = self.model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            temperature=None,
+            top_p=None,
+            logits_processor=logits_processor,
+            stopping_criteria=stopping_criteria,
+            pad_token_id=self.tokenizer.pad_token_id,
+        )
+        generated = outputs[:, prompt_length:].tolist()
+        stopped = [False] * len(generated)
+        if stopping_criteria is not None and stopping_criteria[0].stopped is not None:
+            stopped = stopping_criteria[0].stopped
+        # finished rows are padded, a generated end-of-sequence token is not counted either
+        ends = {self.tokenizer.pad_token_id, self.tokenizer.eos_token_id}
+        self.last_decode_stats = [
+            {
+                "tokens": next(
+                    (index for index, token in enumerate(tokens) if token in ends),
+                    len(tokens),
+                ),
+                "forward_passes": None,
+                "stopped": stop,
+            }
+            for tokens, stop in zip(generated, stopped)
+        ]
+        return self.tokenizer.batch_decode(generated, skip_special_tokens=True)
+
+    def prefix_stats(self):
+        """
+        Reports the prefix cache counters.
+
+        Returns:
+            dict: Hits, misses (prefix prefills), hit rate, number of cached prefixes, and
+                prompt tokens reused from the cache versus prefilled.
+        """
+        lookups = self.prefix_hits + self.prefix_misses
+        return {
+            "hits": self.prefix_hits,
+            "misses": self.prefix_misses,
+            "hit_rate": self.prefix_hits / lookups if lookups else 0.0,
+            "size": len(self.prefix_cache),
+            "reused_tokens": self.reused_tokens,
+            "prefilled_tokens": self.prefilled_tokens,
+        }
+
+    def jump_forward_stats(self):
+        """
+        Reports the jump-forward decoding counters.
+
+        Returns:
+            dict: Tokens generated, forward passes run and forward passes saved by jumping
+                over forced tokens.
+        """
+        return {
+            "generated_tokens": self.generated_tokens,
+            "forward_passes": self.forward_passes,
+            "saved_passes": self.generated_tokens - self.forward_passes,
+        }
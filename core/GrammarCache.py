@@ -0,0 +1,332 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import weakref
+from collections import OrderedDict
+
+from transformers_cfg.grammar_utils import IncrementalGrammarConstraint
+from transformers_cfg.tokenization.byte_trie import ByteTrie
+from transformers_cfg.tokenization.middle.TokenizerMiddleMapping import (
+    TokenizerMiddleMapping,
+)
+
+# vocab hashes are expensive for large vocabularies, so they are computed once per tokenizer
+_tokenizer_hashes = weakref.WeakKeyDictionary()
+
+ARTIFACT_MAGIC = b"SQLCFGC\x01"
+ARTIFACT_FORMAT = 1
+
+
+def grammar_hash(grammar_str):
+    """
+    Hashes the text of a grammar.
+
+    Args:
+        grammar_str (str): The grammar text.
+
+    Returns:
+        str: The hex SHA-256 digest of the grammar text.
+    """
+    return hashlib.sha256(grammar_str.encode("utf-8")).hexdigest()
+
+
+def tokenizer_hash(tokenizer):
+    """
+    Hashes the vocabulary of a tokenizer.
+
+    Two tokenizers with the same hash map token ids to the same strings, so grammar
+    constraints compiled for one can be reused with the other.
+
+    Args:
+        tokenizer (PreTrainedTokenizer): The tokenizer.
+
+    Returns:
+        str: The hex SHA-256 digest of the vocabulary and EOS token id.
+    """
+    if tokenizer not in _tokenizer_hashes:
+        digest = hashlib.sha256()
+        vocab = sorted(tokenizer.get_vocab().items(), key=lambda item: item[1])
+        for token, token_id in vocab:
+            digest.update(f"{token_id}\t{token}\n".encode("utf-8"))
+        digest.update(f"eos={tokenizer.eos_token_id}".encode("utf-8"))
+        _tokenizer_hashes[tokenizer] = digest.hexdigest()
+    return _tokenizer_hashes[tokenizer]
+
+
+def compiled_grammar_path(grammar_path):
+    """
+    Returns the path of the precompiled artifact stored next to a grammar file.
+
+    Args:
+        grammar_path (str): Path to the .ebnf grammar file.
+
+    Returns:
+        str: Path to the precompiled artifact, e.g. "db_id.ebnfc" for "db_id.ebnf".
+    """
+    return f"{grammar_path}c"
+
+
+def token_tables_path(directory, tokenizer):
+    """
+    Returns the path of the precompiled token tables of a tokenizer.
+
+    Args:
+        directory (str): Directory holding the precompiled artifacts.
+        tokenizer (PreTrainedTokenizer): The tokenizer.
+
+    Returns:
+        str: Path to the precompiled token tables.
+    """
+    return os.path.join(directory, f"tokenizer-{tokenizer_hash(tokenizer)[:16]}.tokc")
+
+
+class _ArtifactPickler(pickle.Pickler):
+    """
+    Pickler that stores shared objects (tokenizer, token tables) as named references.
+    """
+
+    def __init__(self, file, shared):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.shared = shared
+
+    def persistent_id(self, obj):
+        for name, shared_obj in self.shared.items():
+            if obj is shared_obj:
+                return name
+        return None
+
+
+class _ArtifactUnpickler(pickle.Unpickler):
+    """
+    Unpickler that resolves the named references written by _ArtifactPickler.
+    """
+
+    def __init__(self, file, shared):
+        super().__init__(file)
+        self.shared = shared
+
+    def persistent_load(self, pid):
+        return self.shared[pid]
+
+
+def write_artifact(obj, path, header, shared):
+    """
+    Atomically writes a precompiled artifact: a magic number, a JSON header and a pickle.
+
+    Args:
+        obj (object): The object to store.
+        path (str): Path to the artifact.
+        header (dict): Validity header (format, grammar and tokenizer hashes).
+        shared (dict): Objects stored as named references instead of being pickled.
+    """
+    header_bytes = json.dumps(header, sort_keys=True).encode("utf-8")
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, delete=False) as file:
+        try:
+            file.write(ARTIFACT_MAGIC)
+            file.write(len(header_bytes).to_bytes(4, "little"))
+            file.write(header_bytes)
+            _ArtifactPickler(file, shared).dump(obj)
+        except BaseException:
+            os.remove(file.name)
+            raise
+    # readers never see a partially written artifact
+    os.replace(file.name, path)
+
+
+def read_artifact(path, header, shared):
+    """
+    Reads a precompiled artifact and loads it if its header matches.
+
+    The artifact is unpickled, which can run arbitrary code: the grammar directory is trusted
+    like the code itself, and must only hold artifacts written by write_artifact.
+
+    Args:
+        path (str): Path to the artifact.
+        header (dict): Expected validity header.
+        shared (dict): Objects referenced by name in the artifact.
+
+    Returns:
+        object: The stored object, or None if the artifact is missing, corrupt or stale.
+    """
+    try:
+        with open(path, "rb") as file:
+            if file.read(len(ARTIFACT_MAGIC)) != ARTIFACT_MAGIC:
+                return None
+            header_length = int.from_bytes(file.read(4), "little")
+            if json.loads(file.read(header_length)) != header:
+                return None
+            return _ArtifactUnpickler(file, shared).load()
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def reset_constraint(constraint):
+    """
+    Resets the incremental parsing state of a grammar constraint so it can be reused.
+
+    Args:
+        constraint (IncrementalGrammarConstraint): The grammar constraint.
+    """
+    constraint.reset()
+
+
+class GrammarCache:
+    """
+    In-process LRU cache of compiled grammar constraints.
+
+    Compiling a constraint parses the grammar and builds the token trie of the tokenizer.
+    This class handles:
+        * Reusing compiled constraints keyed by (grammar hash, tokenizer hash).
+        * Sharing the tokenizer trie and token mapping across all grammars of a tokenizer.
+        * Resetting the parsing state of a constraint before it is handed out again.
+        * Loading and writing precompiled artifacts, invalidated when the grammar text or
+          the tokenizer vocabulary changes.
+        * Counting hits and misses.
+
+    Args:
+        max_size (int, optional): Maximum number of compiled constraints kept in memory.
+    """
+
+    def __init__(self, max_size=256):
+        """
+        Initializes the GrammarCache object.
+        """
+        self.max_size = max_size
+        self.constraints = OrderedDict()
+        self.token_tables = {}
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    def get_token_tables(self, tokenizer, directory=None):
+        """
+        Retrieves the token trie and token mapping of a tokenizer.
+
+        They are built once per tokenizer and, if a directory is given, stored there so that
+        later processes load them instead of rebuilding them.
+
+        Args:
+            tokenizer (PreTrainedTokenizer): The tokenizer of the model.
+            directory (str, optional): Directory holding the precompiled artifacts.
+
+        Returns:
+            tuple: The ByteTrie and TokenizerMiddleMapping of the tokenizer.
+        """
+        tokenizer_key = tokenizer_hash(tokenizer)
+        if tokenizer_key in self.token_tables:
+            return self.token_tables[tokenizer_key]
+
+        header = {"format": ARTIFACT_FORMAT, "tokenizer": tokenizer_key}
+        shared = {"tokenizer": tokenizer}
+        token_tables = None
+        if directory:
+            path = token_tables_path(directory, tokenizer)
+            token_tables = read_artifact(path, header, shared)
+        if token_tables is None:
+            token_tables = (
+                ByteTrie.from_tokenizer(tokenizer),
+                TokenizerMiddleMapping.from_hf_tokenizer(tokenizer),
+            )
+            if directory:
+                self._write(token_tables, path, header, shared)
+        self.token_tables[tokenizer_key] = token_tables
+        return token_tables
+
+    def compile(self, grammar_str, tokenizer, artifact_path=None):
+        """
+        Compiles a grammar constraint, reusing the token tables already built for the tokenizer.
+
+        If an artifact path is given, a valid precompiled artifact is loaded instead of
+        compiling, and a missing or stale one is (re)written after compiling.
+
+        Args:
+            grammar_str (str): The grammar text.
+            tokenizer (PreTrainedTokenizer): The tokenizer of the model.
+            artifact_path (str, optional): Path to the precompiled artifact of the grammar.
+
+        Returns:
+            IncrementalGrammarConstraint: The compiled grammar constraint.
+        """
+        directory = os.path.dirname(artifact_path) if artifact_path else None
+        trie, homomorphism = self.get_token_tables(tokenizer, directory)
+        if not artifact_path:
+            return IncrementalGrammarConstraint(
+                grammar_str, "root", tokenizer, trie=trie, homomorphism=homomorphism
+            )
+
+        header = {
+            "format": ARTIFACT_FORMAT,
+            "grammar": grammar_hash(grammar_str),
+            "tokenizer": tokenizer_hash(tokenizer),
+        }
+        shared = {"tokenizer": tokenizer, "trie": trie, "homomorphism": homomorphism}
+        constraint = read_artifact(artifact_path, header, shared)
+        if constraint is not None:
+            self.disk_hits += 1
+            return constraint
+
+        constraint = IncrementalGrammarConstraint(
+            grammar_str, "root", tokenizer, trie=trie, homomorphism=homomorphism
+        )
+        self._write(constraint, artifact_path, header, shared)
+        return constraint
+
+    def _write(self, obj, path, header, shared):
+        """
+        Writes a precompiled artifact, reporting instead of failing if it cannot be written.
+
+        This is a private helper method.
+        """
+        try:
+            write_artifact(obj, path, header, shared)
+        except OSError as e:
+            print(f"Error writing precompiled grammar {path}: {e}")
+
+    def get(self, grammar_str, tokenizer, artifact_path=None):
+        """
+        Retrieves the compiled constraint of a grammar, compiling (or loading) it on a miss.
+
+        The returned constraint has a fresh parsing state.
+
+        Args:
+            grammar_str (str): The grammar text.
+            tokenizer (PreTrainedTokenizer): The tokenizer of the model.
+            artifact_path (str, optional): Path to the precompiled artifact of the grammar.
+
+        Returns:
+            IncrementalGrammarConstraint: The compiled grammar constraint.
+        """
+        key = (grammar_hash(grammar_str), tokenizer_hash(tokenizer))
+        if key in self.constraints:
+            self.hits += 1
+            self.constraints.move_to_end(key)
+        else:
+            self.misses += 1
+            self.constraints[key] = self.compile(grammar_str, tokenizer, artifact_path)
+            if len(self.constraints) > self.max_size:
+                self.constraints.popitem(last=False)
+
+        constraint = self.constraints[key]
+        reset_constraint(constraint)
+        return constraint
+
+    def stats(self):
+        """
+        Reports the cache counters.
+
+        Returns:
+            dict: Hits, misses (and how many of them were loaded from disk), hit rate and
+                number of cached constraints.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.constraints),
+        }
@@ -0,0 +1,119 @@
+import os
+import sqlite3
+import threading
+
+
+class GrammarProvider:
+    """
+    Builds the embedded grammar of a database the first time it is requested.
+
+    Instead of generating the grammars of all databases before answering, only the databases
+    of the questions are processed, when their first question is answered. A grammar is
+    generated at most once per process and kept in memory; on disk, the grammar file and the
+    manifest of the SQLCFG generator let later runs reuse it while the database and template
+    are unchanged. Concurrent requests for the same database wait for a single build, while
+    different databases are built in parallel. Manifest entries are merged into the manifest
+    on disk under its file lock, so processes sharing a grammar directory keep each other's
+    entries.
+
+    Args:
+        sql_grammar (SQLCFG): The grammar generator, whose grammar directory is the disk cache.
+    """
+
+    def __init__(self, sql_grammar):
+        """
+        Initializes the GrammarProvider object.
+        """
+        self.sql_grammar = sql_grammar
+        self.grammars = {}
+        self.lock = threading.Lock()
+        self.db_locks = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.builds = 0
+        self.failures = 0
+
+    def grammar_path(self, db_id):
+        """
+        Returns the path of the grammar file of a database.
+
+        Args:
+            db_id (str): The database identifier.
+
+        Returns:
+            str: The path to the grammar file.
+        """
+        return os.path.join(self.sql_grammar.grammar_directory, f"{db_id}.ebnf")
+
+    def get(self, db_id):
+        """
+        Retrieves the embedded grammar of a database, building it on the first request.
+
+        Args:
+            db_id (str): The database identifier.
+
+        Returns:
+            str: The grammar text, or None if the schema of the database cannot be read.
+        """
+        with self.lock:
+            if db_id in self.grammars:
+                self.hits += 1
+                return self.grammars[db_id]
+            db_lock = self.db_locks.setdefault(db_id, threading.Lock())
+
+        with db_lock:
+            # another thread may have built it while this one was waiting
+            with self.lock:
+                if db_id in self.grammars:
+                    self.hits += 1
+                    return self.grammars[db_id]
+            grammar = self.build(db_id)
+            with self.lock:
+                self.grammars[db_id] = grammar
+        return grammar
+
+    def build(self, db_id):
+        """
+        Generates the grammar of a database, or reuses its grammar file if it is up to date.
+
+        This is a private helper method, called with the lock of the database held.
+        """
+        # read from disk, where another process may have built the grammar meanwhile
+        previous = self.sql_grammar.load_manifest().get(db_id)
+
+        try:
+            status, entry = self.sql_grammar.process_database(db_id, previous)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error generating the grammar of {db_id}: {e}")
+            status = "failed"
+        if status == "failed":
+            with self.lock:
+                self.failures += 1
+            return None
+
+        with self.lock:
+            if status == "skipped":
+                self.disk_hits += 1
+            else:
+                self.builds += 1
+        if status == "generated" or entry != previous:
+            self.sql_grammar.update_manifest({db_id: entry})
+        with open(self.grammar_path(db_id), "r", encoding="utf-8-sig") as file:
+            return file.read()
+
+    def stats(self):
+        """
+        Reports the provider counters.
+
+        Returns:
+            dict: Memory hits, grammars reused from disk, grammars built, failures and hit rate
+                (memory and disk hits over all requests).
+        """
+        requests = self.hits + self.disk_hits + self.builds + self.failures
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "builds": self.builds,
+            "failures": self.failures,
+            "hit_rate": (self.hits + self.disk_hits) / requests if requests else 0.0,
+        }
@@ -0,0 +1,132 @@
+import json
+import os
+
+
+class PredictionWriter:
+    """
+    Streams predictions to a JSON Lines file, one line per answered question.
+
+    Lines are only appended, so the cost of a checkpoint does not grow with the run and an
+    interrupted write can at most truncate the last line.
+
+    Args:
+        path (str): Path to the JSONL output file.
+        sync_every (int, optional): Number of records between flushes to disk (flush + fsync).
+        resume (bool, optional): Whether to keep the existing records and append after them.
+    """
+
+    def __init__(self, path, sync_every=1, resume=False):
+        """
+        Initializes the PredictionWriter object.
+
+        A fresh run truncates the output file. A resumed run keeps the complete lines of the
+        existing file and drops a truncated last line before appending.
+        """
+        self.path = path
+        self.sync_every = sync_every
+        self.pending = 0
+        if resume and os.path.exists(path):
+            with open(path, "rb+") as file:
+                content = file.read()
+                file.truncate(content.rfind(b"\n") + 1)
+            self.file = open(path, "a", encoding="utf-8")
+        else:
+            self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, record):
+        """
+        Appends one prediction record.
+
+        Args:
+            record (dict): The answer dictionary of one question.
+        """
+        self.file.write(json.dumps(record) + "\n")
+        self.pending += 1
+        if self.pending >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        """
+        Flushes the buffered records and forces them to disk.
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        """
+        Syncs the remaining records and closes the file.
+        """
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_predictions(path):
+    """
+    Reads the prediction records of a JSON Lines file.
+
+    A truncated last line, left by an interrupted write, is ignored.
+
+    Args:
+        path (str): Path to the JSONL output file.
+
+    Returns:
+        list: The prediction records, in file order.
+    """
+    records = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if not line.endswith("\n"):
+                break
+            records.append(json.loads(line))
+    return records
+
+
+def ordered_predictions(path):
+    """
+    Reads the prediction records of a JSON Lines file ordered by question id.
+
+    If a question was answered more than once, its last record is kept.
+
+    Args:
+        path (str): Path to the JSONL output file.
+
+    Returns:
+        list: One prediction record per question id, in id order.
+    """
+    records = {record["id"]: record for record in read_predictions(path)}
+    return [records[question_id] for question_id in sorted(records)]
+
+
+def write_predictions(records, path):
+    """
+    Atomically writes prediction records as a single JSON file.
+
+    Args:
+        records (list): The prediction records.
+        path (str): Path to the JSON output file.
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(records, file, indent=2)
+    os.replace(temp_path, path)
+
+
+def write_answers(records, path):
+    """
+    Writes the SQL answers of prediction records as a TXT file, one answer per line.
+
+    Args:
+        records (list): The prediction records.
+        path (str): Path to the TXT output file.
+    """
+    with open(path, "w") as file:
+        for record in records:
+            file.write(record["answer"].replace("\n", " ").replace("\r", " ") + "\n")
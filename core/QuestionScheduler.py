@@ -0,0 +1,51 @@
+SCHEDULING_POLICIES = ("original", "db_id", "db_id_length")
+
+
+class QuestionScheduler:
+    """
+    Orders the questions of a run so that work on the same database runs back to back.
+
+    Consecutive questions over the same database reuse its cached schema, grammar constraint
+    and prompt prefix instead of evicting and rebuilding them. The order only affects the
+    processing; answers are still written back in question id order. Policies:
+        * "original": the order of the questions file.
+        * "db_id": questions grouped by database, databases in order of first appearance.
+        * "db_id_length": grouped by database, shortest questions first within a database, so
+          that batched prompts have similar lengths and need little padding.
+
+    Args:
+        policy (str, optional): Scheduling policy, one of SCHEDULING_POLICIES.
+    """
+
+    def __init__(self, policy="db_id"):
+        """
+        Initializes the QuestionScheduler object.
+        """
+        if policy not in SCHEDULING_POLICIES:
+            raise ValueError(f"Unknown scheduling policy: {policy}")
+        self.policy = policy
+
+    def order(self, questions):
+        """
+        Orders questions according to the scheduling policy.
+
+        Args:
+            questions (list): Question dictionaries with "id", "db_id" and "question" keys.
+
+        Returns:
+            list: The same questions in processing order.
+        """
+        if self.policy == "original":
+            return list(questions)
+
+        first_seen = {}
+        for question in questions:
+            first_seen.setdefault(question["db_id"], len(first_seen))
+
+        # the prompts of one database only differ by their question
+        def key(question):
+            length = len(question["question"]) if self.policy == "db_id_length" else 0
+            return first_seen[question["db_id"]], length
+
+        # sorted is stable, so ties keep the original order
+        return sorted(questions, key=key)
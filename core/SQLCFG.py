@@ -1,6 +1,111 @@
+import fcntl
+import hashlib
+import json
 import os
+import re
 import sqlite3
-import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from core.SchemaCatalog import get_schema_catalog
+from core.SQLiteAccess import MirrorsExhausted, get_sqlite_access
+
+COLUMN_MODES = ("flat", "qualified")
+
+# records the inputs of every generated grammar, so unchanged databases are skipped
+MANIFEST_NAME = "manifest.json"
+# held while the manifest is read and rewritten, by every thread and process
+MANIFEST_LOCK_NAME = "manifest.json.lock"
+
+
+def schema_fingerprint(schema):
+    """
+    Hashes the tables and columns of a schema.
+
+    Args:
+        schema (dict): Table names mapped to the list of their column names.
+
+    Returns:
+        str: The hex SHA-256 digest of the schema.
+    """
+    encoded = json.dumps(list(schema.items()), separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def write_text_atomically(text, path):
+    """
+    Writes a text file through a temporary file, so readers never see a partial file.
+
+    Args:
+        text (str): The file content.
+        path (str): The path of the file.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as file:
+            file.write(text)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def quote_terminal(text):
+    """
+    Quotes a string as a grammar terminal.
+
+    Args:
+        text (str): The string.
+
+    Returns:
+        str: The quoted terminal, with quotes and backslashes escaped.
+    """
+    escaped = text.replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def trie_alternation(words):
+    """
+    Builds an alternation matching a set of words, with common prefixes factored out.
+
+    Words sharing a prefix share one branch, e.g. "Stadium_ID", "Stadium_Name" and "Singer_ID"
+    give ("S" ("tadium_" ("ID" | "Name") | "inger_ID")). The grammar parser then follows one
+    branch per prefix instead of one per word.
+
+    Args:
+        words (dict): Words mapped to the expression that follows them ("" for nothing).
+
+    Returns:
+        str: The grammar expression.
+    """
+    # character trie: node = [children, continuation or None]
+    root = [{}, None]
+    for word, continuation in words.items():
+        node = root
+        for char in word:
+            node = node[0].setdefault(char, [{}, None])
+        node[1] = continuation
+
+    def render(node):
+        parts = [] if node[1] is None else [node[1]]
+        for char, child in sorted(node[0].items()):
+            # merge chains of single-child nodes into one terminal
+            label = char
+            while len(child[0]) == 1 and child[1] is None:
+                ((next_char, child),) = child[0].items()
+                label += next_char
+            rest = render(child)
+            parts.append(
+                f"{quote_terminal(label)} {rest}" if rest else quote_terminal(label)
+            )
+        if "" in parts:
+            alternatives = [part for part in parts if part]
+            return f"({' | '.join(alternatives)})?" if alternatives else ""
+        return parts[0] if len(parts) == 1 else f"({' | '.join(parts)})"
+
+    return render(root)
 
 
 class SQLCFG:
@@ -16,9 +121,24 @@ class SQLCFG:
         grammar_template_path (str): Path to the grammar template file.
         db_base_path (str): Base directory containing database folders.
         grammar_directory (str): Directory to store generated grammar files.
+        schema_catalog (SchemaCatalog, optional): Schema cache, shared process-wide by default.
+        sqlite_access (SQLiteAccess, optional): Database access layer, shared process-wide
+            by default.
+        column_mode (str, optional): How column names are put into the grammar, one of
+            COLUMN_MODES. "flat" lists every column in one alternation. "qualified" factors
+            names into trie-shaped alternations and adds one column nonterminal per table,
+            used by the QUALIFIED_COLUMNS_PLACEHOLDER of the template for table.column names.
     """
 
-    def __init__(self, grammar_template_path, db_base_path, grammar_directory):
+    def __init__(
+        self,
+        grammar_template_path,
+        db_base_path,
+        grammar_directory,
+        schema_catalog=None,
+        sqlite_access=None,
+        column_mode="flat",
+    ):
         """
         Initializes the SQLCFG object.
 
@@ -29,91 +149,42 @@ class SQLCFG:
 
         self.db_base_path = db_base_path
         self.grammar_directory = grammar_directory
+        self.schema_catalog = schema_catalog or get_schema_catalog()
+        self.sqlite_access = sqlite_access or get_sqlite_access()
+        if column_mode not in COLUMN_MODES:
+            raise ValueError(f"Unknown column mode: {column_mode}")
+        self.column_mode = column_mode
+        self.template_hash = hashlib.sha256(
+            f"{column_mode}\n{self.grammar_template}".encode("utf-8")
+        ).hexdigest()
 
         # Ensure the grammar directory exists
         os.makedirs(grammar_directory, exist_ok=True)
 
-    def extract_schema_with_retries(self, db_path, max_retries=5, max_directories=15):
-        def extract_schema(db_path):
-            """
-            Extracts table and column information from an SQLite database.
-
-            Args:
-                db_path (str): Path to the SQLite database file.
-
-            Returns:
-                dict: A dictionary where keys are table names and values are lists of column names.
-            """
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-
-            # Extract table names
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = cursor.fetchall()
-
-            # Extract columns for each table
-            schema = {}
-            for table in tables:
-                table_name = table[0]
-                cursor.execute(f"PRAGMA table_info({table_name})")
-                columns = cursor.fetchall()
-                schema[table_name] = [
-                    col[1] for col in columns
-                ]  # Assuming col[1] is the column name
-
-            conn.close()
-            return schema
-
-        retries = 0
-        base_path, db_name = os.path.split(db_path)
-
-        while retries < max_retries:
-            try:
-                schema = extract_schema(db_path)
-                return schema
-            except sqlite3.OperationalError as e:
-                if "disk I/O error" in str(e):
-                    retries += 1
-                    time.sleep(1)
-                    continue
-                else:
-                    return (f"OperationalError: {e}",)
-            except sqlite3.DatabaseError as e:
-                if "database disk image is malformed" in str(e):
-                    retries += 1
-                    time.sleep(1)
-                    continue
-                else:
-                    return f"DatabaseError: {e}"
-
-        for i in range(2, max_directories + 1):
-            new_base_path = f"{base_path}{i}"
-            new_db_path = os.path.join(new_base_path, db_name)
-            retries = 0
-            while retries < max_retries:
-                try:
-                    schema = extract_schema(new_db_path)
-                    return schema
-                except sqlite3.OperationalError as e:
-                    if "disk I/O error" in str(e):
-                        retries += 1
-                        time.sleep(1)
-                        continue
-                    else:
-                        return f"OperationalError: {e}"
-                except sqlite3.DatabaseError as e:
-                    if "database disk image is malformed" in str(e):
-                        retries += 1
-                        time.sleep(1)
-                        continue
-                    else:
-                        return f"DatabaseError: {e}"
+    def extract_schema_with_retries(self, db_path):
+        """
+        Extracts table and column information from an SQLite database through the schema catalog.
 
-        return (
-            f"Failed after trying {max_directories} directories",
-            retries + 1,
-            new_base_path,
-        )
+        Transient errors are retried on the database mirrors by the SQLite access layer.
+
+        Args:
+            db_path (str): Path to the SQLite database file.
+
+        Returns:
+            dict: A dictionary where keys are table names and values are lists of column names,
+                or an error message.
+        """
+        try:
+            return self.sqlite_access.run(
+                db_path,
+                lambda conn, path: dict(self.schema_catalog.get(path, conn).tables),
+            )
+        except MirrorsExhausted as e:
+            return str(e)
+        except sqlite3.OperationalError as e:
+            return f"OperationalError: {e}"
+        except sqlite3.DatabaseError as e:
+            return f"DatabaseError: {e}"
 
     def get_table_names(self, schema):
         """
@@ -156,16 +227,60 @@ class SQLCFG:
         Returns:
             tuple: A tuple containing two strings:
                 - tables_placeholder: A string containing pipe-separated table names.
-                - columns_placeholder: A string containing pipe-separated column names.
+                - columns_placeholder: A string containing pipe-separated column names of all
+                  tables, each name once.
         """
         # Prepare placeholders content
 
         tables_placeholder = " | ".join(f'"{tbl}"' for tbl in table_names)
-        for table in table_names:
-            columns_placeholder = " | ".join(f'"{col}"' for col in schema[table])
+        # dict.fromkeys keeps the first occurrence of every column name
+        column_names = dict.fromkeys(self.get_column_names(schema, table_names))
+        columns_placeholder = " | ".join(f'"{col}"' for col in column_names)
 
         return tables_placeholder, columns_placeholder
 
+    def get_qualified_placeholders(self, table_names, schema):
+        """
+        Prepares trie-shaped placeholders and per-table column nonterminals.
+
+        Tables with the same columns share one nonterminal.
+
+        Args:
+            table_names (list): List of table names.
+            schema (dict): Dictionary containing table and column information.
+
+        Returns:
+            tuple: A tuple containing four strings:
+                - tables_placeholder: Alternation of the table names.
+                - columns_placeholder: Alternation of the distinct column names.
+                - qualified_placeholder: Alternation of table.column names.
+                - column_rules: One "columns-<table>" production per distinct column set.
+        """
+        rules = {}
+        qualified = {}
+        for table in table_names:
+            columns = tuple(dict.fromkeys(schema[table]))
+            if columns not in rules:
+                name = re.sub(r"[^a-zA-Z0-9-]", "-", table).lower()
+                rules[columns] = f"columns-{name}-{len(rules)}"
+            qualified[table] = f'"." {rules[columns]}'
+
+        tables_placeholder = trie_alternation(dict.fromkeys(table_names, ""))
+        columns_placeholder = trie_alternation(
+            dict.fromkeys(self.get_column_names(schema, table_names), "")
+        )
+        qualified_placeholder = trie_alternation(qualified)
+        column_rules = "\n\n".join(
+            f"{rule} ::= {trie_alternation(dict.fromkeys(columns, ''))}"
+            for columns, rule in rules.items()
+        )
+        return (
+            tables_placeholder,
+            columns_placeholder,
+            qualified_placeholder,
+            column_rules,
+        )
+
     def replace_placeholders(self, schema):
         """
         Replaces placeholders in the grammar template with the actual table and column names from the schema.
@@ -178,34 +293,222 @@ class SQLCFG:
         """
         # Replace placeholders with actual content
         table_names = self.get_table_names(schema)
-        tables_placeholder, columns_placeholder = self.get_placeholders(
-            table_names, schema
-        )
+        if self.column_mode == "qualified":
+            (
+                tables_placeholder,
+                columns_placeholder,
+                qualified_placeholder,
+                column_rules,
+            ) = self.get_qualified_placeholders(table_names, schema)
+        else:
+            tables_placeholder, columns_placeholder = self.get_placeholders(
+                table_names, schema
+            )
 
         grammar = self.grammar_template.replace(
             "TABLE_NAMES_PLACEHOLDER", tables_placeholder
         )
+        if self.column_mode == "qualified":
+            grammar = grammar.replace(
+                "QUALIFIED_COLUMNS_PLACEHOLDER", qualified_placeholder
+            )
+            grammar = f"{grammar.rstrip()}\n\n{column_rules}\n"
         grammar = grammar.replace("COLUMNS_PLACEHOLDER", columns_placeholder)
         return grammar
 
-    def process_databases(self):
+    def load_manifest(self):
+        """
+        Loads the manifest of the grammars already in the grammar directory.
+
+        Returns:
+            dict: Database names mapped to the file version, schema fingerprint, template hash
+                and grammar hash of their grammar, empty if there is no readable manifest.
+        """
+        try:
+            with open(os.path.join(self.grammar_directory, MANIFEST_NAME), "r") as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        return manifest if isinstance(manifest, dict) else {}
+
+    def save_manifest(self, manifest):
+        """
+        Saves the manifest of the grammars in the grammar directory.
+
+        Args:
+            manifest (dict): Database names mapped to their manifest entries.
+        """
+        write_text_atomically(
+            json.dumps(manifest, indent=1, sort_keys=True),
+            os.path.join(self.grammar_directory, MANIFEST_NAME),
+        )
+
+    @contextmanager
+    def manifest_lock(self):
+        """
+        Holds an exclusive lock on the manifest of the grammar directory.
+
+        The lock is a file lock, so it excludes other threads and other processes (e.g. the
+        workers of the sharded driver) updating the same manifest.
+        """
+        lock_path = os.path.join(self.grammar_directory, MANIFEST_LOCK_NAME)
+        with open(lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def update_manifest(self, entries, removed=()):
+        """
+        Merges entries into the manifest of the grammar directory.
+
+        The manifest is read again and written back under the manifest lock, so that entries
+        written meanwhile by other processes are kept.
+
+        Args:
+            entries (dict): Database names mapped to their new manifest entries.
+            removed (iterable, optional): Database names whose entries are dropped.
+        """
+        with self.manifest_lock():
+            manifest = self.load_manifest()
+            merged = {
+                db_name: entry
+                for db_name, entry in manifest.items()
+                if db_name not in removed
+            }
+            merged.update(entries)
+            if merged != manifest:
+                self.save_manifest(merged)
+
+    def process_database(self, db_name, entry):
+        """
+        Generates the grammar of one database unless it is up to date.
+
+        A grammar is up to date if it exists and was generated from the same template, and
+        either the database file is unchanged (same modification time and size) or its schema
+        has the same fingerprint. The grammar file is only rewritten if its content changes.
+
+        Args:
+            db_name (str): The database name.
+            entry (dict): The manifest entry of the database, None if there is none.
+
+        Returns:
+            tuple: The status ("generated", "skipped" or "failed") and the new manifest entry
+                (None if failed).
+        """
+        db_file = os.path.join(self.db_base_path, db_name, f"{db_name}.sqlite")
+        grammar_path = os.path.join(self.grammar_directory, f"{db_name}.ebnf")
+        stat = os.stat(db_file)
+        version = [stat.st_mtime_ns, stat.st_size]
+        current = (
+            entry is not None
+            and entry.get("template") == self.template_hash
+            and os.path.isfile(grammar_path)
+        )
+        # fast path: the database file was not touched, so it is not even opened
+        if current and entry.get("version") == version:
+            return "skipped", entry
+
+        schema = self.extract_schema_with_retries(db_file)
+        if isinstance(schema, str):
+            print(f"Error extracting schema of {db_name}: {schema}")
+            return "failed", None
+        fingerprint = schema_fingerprint(schema)
+        if current and entry.get("schema") == fingerprint:
+            return "skipped", dict(entry, version=version)
+
+        grammar = self.replace_placeholders(schema)
+        new_entry = {
+            "version": version,
+            "schema": fingerprint,
+            "template": self.template_hash,
+            "grammar": hashlib.sha256(grammar.encode("utf-8")).hexdigest(),
+        }
+        try:
+            with open(grammar_path, "r") as file:
+                if file.read() == grammar:
+                    return "skipped", new_entry
+        except OSError:
+            pass
+        self.write_grammar(grammar, grammar_path)
+        return "generated", new_entry
+
+    def process_databases(self, tokenizer=None, workers=None):
         """
         Processes all SQLite databases in the specified base path.
 
-        For each database:
-            - Extracts the schema (tables and columns).
-            - Replaces placeholders in the grammar template with the extracted schema information.
-            - Writes the generated grammar to a file in the specified grammar directory.
-        """
-        # Iterate over all directories in the base path
-        for db_name in os.listdir(self.db_base_path):
-            db_dir = os.path.join(self.db_base_path, db_name)
-            db_file = os.path.join(db_dir, f"{db_name}.sqlite")
-            if os.path.isfile(db_file):
-                schema = self.extract_schema_with_retries(db_file)
-                grammar = self.replace_placeholders(schema)
+        For each database, in a pool of worker threads:
+            - Skips the database if its grammar is up to date (see process_database).
+            - Otherwise extracts the schema (tables and columns), replaces placeholders in the
+              grammar template with the extracted schema information and writes the generated
+              grammar to a file in the specified grammar directory, if it changed.
+        The inputs of every grammar are merged into the manifest of the grammar directory
+        (see update_manifest): entries of databases that failed are kept with their grammar
+        files, and only the entries of databases missing from the base path are dropped.
+        If a tokenizer is given, the precompiled grammars and token tables are then written
+        next to the grammar files, unless they are up to date.
+
+        Args:
+            tokenizer (PreTrainedTokenizer, optional): Tokenizer to precompile the grammars for.
+            workers (int, optional): Number of worker threads, by default the number of CPUs.
+
+        Returns:
+            dict: The sorted names of the "generated", "skipped" and "failed" databases.
+        """
+        db_names = sorted(
+            db_name
+            for db_name in os.listdir(self.db_base_path)
+            if os.path.isfile(
+                os.path.join(self.db_base_path, db_name, f"{db_name}.sqlite")
+            )
+        )
+        manifest = self.load_manifest()
+
+        def process(db_name):
+            try:
+                return self.process_database(db_name, manifest.get(db_name))
+            except (OSError, sqlite3.Error) as e:
+                print(f"Error generating the grammar of {db_name}: {e}")
+                return "failed", None
+
+        summary = {"generated": [], "skipped": [], "failed": []}
+        new_manifest = {}
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            for db_name, (status, entry) in zip(
+                db_names, executor.map(process, db_names)
+            ):
+                summary[status].append(db_name)
+                if entry is not None:
+                    new_manifest[db_name] = entry
+        self.update_manifest(new_manifest, set(manifest) - set(db_names))
+
+        if tokenizer is not None:
+            # transformers_cfg is only needed to precompile grammars
+            from core.GrammarCache import GrammarCache, compiled_grammar_path
+
+            # the token tables are built once and shared by every grammar;
+            # up-to-date artifacts are only validated, not rewritten
+            grammar_cache = GrammarCache()
+            for db_name in new_manifest:
                 grammar_path = os.path.join(self.grammar_directory, f"{db_name}.ebnf")
-                self.write_grammar(grammar, grammar_path)
+                with open(grammar_path, "r") as file:
+                    grammar = file.read()
+                artifact_path = compiled_grammar_path(grammar_path)
+                grammar_cache.compile(grammar, tokenizer, artifact_path)
+            print(
+                f"Precompiled grammars: {grammar_cache.disk_hits} up to date, "
+                f"{len(new_manifest) - grammar_cache.disk_hits} written"
+            )
+
+        print(
+            f"Grammars: {len(summary['generated'])} generated, "
+            f"{len(summary['skipped'])} skipped, {len(summary['failed'])} failed"
+        )
+        if summary["failed"]:
+            print(f"Failed databases: {', '.join(summary['failed'])}")
+        print(f"SQLite access: {self.sqlite_access.stats()}")
+        return summary
 
     def write_grammar(self, grammar, grammar_path):
         """
@@ -217,7 +520,6 @@ class SQLCFG:
         """
         # Ensure the directory exists before writing the grammar file
         os.makedirs(os.path.dirname(grammar_path), exist_ok=True)
-        # Write the grammar to the specified grammar file
-        with open(grammar_path, "w") as file:
-            file.write(grammar)
+        # Write the grammar to the specified grammar file, replacing it in one step
+        write_text_atomically(grammar, grammar_path)
         print(f"Grammar saved to {grammar_path}")
@@ -0,0 +1,831 @@
+import difflib
+import re
+import weakref
+
+# as in SQLite, every non-ASCII character can be part of an unquoted identifier
+TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<name>[A-Za-z_\u0080-\U0010ffff][A-Za-z0-9_$\u0080-\U0010ffff]*)
+    |(?P<space>\s+|--[^\n]*|/\*.*?(?:\*/|\Z))
+    |(?P<string>'(?:[^']|'')*')
+    |(?P<quoted>"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\])
+    |(?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    |(?P<param>[?:@$][A-Za-z0-9_]*)
+    |(?P<op>\|\||<<|>>|<=|>=|==|!=|<>|->>|->|[-+*/%<>=~&|(),.;])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+# SQLite keywords (and boolean literals): never checked as column names
+KEYWORDS = set("""
+    ABORT ACTION ADD AFTER ALL ALTER ALWAYS ANALYZE AND AS ASC ATTACH AUTOINCREMENT BEFORE
+    BEGIN BETWEEN BY CASCADE CASE CAST CHECK COLLATE COLUMN COMMIT CONFLICT CONSTRAINT CREATE
+    CROSS CURRENT CURRENT_DATE CURRENT_TIME CURRENT_TIMESTAMP DATABASE DEFAULT DEFERRABLE
+    DEFERRED DELETE DESC DETACH DISTINCT DO DROP EACH ELSE END ESCAPE EXCEPT EXCLUDE EXCLUSIVE
+    EXISTS EXPLAIN FAIL FALSE FILTER FIRST FOLLOWING FOR FOREIGN FROM FULL GENERATED GLOB GROUP
+    GROUPS HAVING IF IGNORE IMMEDIATE IN INDEX INDEXED INITIALLY INNER INSERT INSTEAD INTERSECT
+    INTO IS ISNULL JOIN KEY LAST LEFT LIKE LIMIT MATCH MATERIALIZED NATURAL NO NOT NOTHING
+    NOTNULL NULL NULLS OF OFFSET ON OR ORDER OTHERS OUTER OVER PARTITION PLAN PRAGMA PRECEDING
+    PRIMARY QUERY RAISE RANGE RECURSIVE REFERENCES REGEXP REINDEX RELEASE RENAME REPLACE
+    RESTRICT RETURNING RIGHT ROLLBACK ROW ROWS SAVEPOINT SELECT SET TABLE TEMP TEMPORARY THEN
+    TIES TO TRANSACTION TRIGGER TRUE UNBOUNDED UNION UNIQUE UPDATE USING VACUUM VALUES VIEW
+    VIRTUAL WHEN WHERE WINDOW WITH WITHOUT
+    """.split())
+
+# clauses of a SELECT statement, in the order SQLite requires them
+CLAUSE_ORDER = (
+    "SELECT",
+    "FROM",
+    "WHERE",
+    "GROUP BY",
+    "HAVING",
+    "WINDOW",
+    "ORDER BY",
+    "LIMIT",
+)
+COMPOUND_OPERATORS = ("UNION", "INTERSECT", "EXCEPT")
+# keywords that cannot end a query: it was cut off after them
+INCOMPLETE_ENDINGS = tuple(
+    "AND OR NOT IN LIKE GLOB BETWEEN IS ON JOIN BY AS CASE WHEN THEN ELSE ESCAPE COLLATE USING "
+    "OFFSET".split()
+)
+COMPARISON_OPERATORS = ("=", "==", "!=", "<>", "<", "<=", ">", ">=")
+# implicit columns of every rowid table
+ROWID_COLUMNS = {"rowid", "oid", "_rowid_"}
+
+
+class Token:
+    """
+    Lexical token of an SQL query.
+
+    Args:
+        kind (str): One of "string", "quoted", "number", "name", "param" or "op".
+        text (str): The source text of the token.
+    """
+
+    __slots__ = ("kind", "text", "value", "upper", "keyword", "identifier")
+
+    def __init__(self, kind, text):
+        """
+        Initializes the Token object.
+        """
+        self.kind = kind
+        self.text = text
+        # identifier value: unquoted names keep their text, quoted names lose their quotes
+        if kind == "quoted":
+            self.value = text[1:-1].replace(text[0] * 2, text[0])
+        else:
+            self.value = text
+        self.upper = text.upper() if kind == "name" else None
+        self.keyword = self.upper in KEYWORDS
+        # whether the token can name a table, a column or an alias
+        self.identifier = kind == "quoted" or (kind == "name" and not self.keyword)
+
+    def is_keyword(self, *keywords):
+        """
+        Checks whether the token is an unquoted keyword.
+
+        Args:
+            *keywords (str): The keywords to match, any SQLite keyword if none are given.
+
+        Returns:
+            bool: True if the token is one of the keywords.
+        """
+        if not keywords:
+            return self.keyword
+        return self.upper is not None and self.upper in keywords
+
+
+class SQLIssue:
+    """
+    Problem found in a query before it is run.
+
+    Args:
+        kind (str): One of "syntax", "clause_order", "table" or "column".
+        message (str): What is wrong, worded like the SQLite error where there is one.
+        hint (str, optional): How to fix it, e.g. the closest names of the schema.
+    """
+
+    def __init__(self, kind, message, hint=None):
+        """
+        Initializes the SQLIssue object.
+        """
+        self.kind = kind
+        self.message = message
+        self.hint = hint
+
+    def __str__(self):
+        return f"{self.message} ({self.hint})" if self.hint else self.message
+
+
+def tokenize(query):
+    """
+    Splits an SQL query into tokens, dropping whitespace and comments.
+
+    Args:
+        query (str): The SQL query.
+
+    Returns:
+        tuple: The list of tokens, and an SQLIssue for an unrecognized token (e.g. an
+            unterminated string literal) or None.
+    """
+    tokens = []
+    position = 0
+    for match in TOKEN_PATTERN.finditer(query):
+        if match.start() != position:
+            # characters skipped by the scanner start no token
+            break
+        if match.lastgroup != "space":
+            tokens.append(Token(match.lastgroup, match.group()))
+        position = match.end()
+    if position < len(query):
+        rest = query[position:].split(None, 1)[0]
+        return tokens, SQLIssue("syntax", f'unrecognized token: "{rest}"')
+    return tokens, None
+
+
+def suggest(name, candidates):
+    """
+    Formats a hint with the candidates closest to a misspelled name.
+
+    Args:
+        name (str): The unknown name.
+        candidates (list): The known names.
+
+    Returns:
+        str: "did you mean ...?" with the closest candidates, or the list of all candidates.
+    """
+    by_lower = {candidate.lower(): candidate for candidate in candidates}
+    close = difflib.get_close_matches(name.lower(), list(by_lower), n=3, cutoff=0.6)
+    if close:
+        return "did you mean " + " or ".join(by_lower[match] for match in close) + "?"
+    return "available: " + ", ".join(candidates)
+
+
+class SQLValidator:
+    """
+    Checks generated queries against the schema of their database without running them.
+
+    The checks are lexical, take a fraction of a millisecond and never open the database:
+        * Tokens: unterminated string literals and unrecognized characters
+        * Structure: unbalanced parentheses, clauses out of order or repeated in a SELECT,
+          GROUP/ORDER without BY, empty clauses and dangling commas
+        * Schema: unknown tables, qualifiers that are neither a table nor an alias, unknown
+          columns, and unqualified columns shared by several joined tables
+
+    The validator is conservative: it only reports what SQLite would reject. Columns are not
+    checked through sources whose columns are not known statically (common table expressions,
+    subqueries in FROM, table-valued functions), and statements other than SELECT queries are
+    left to SQLite.
+    """
+
+    def __init__(self):
+        """
+        Initializes the SQLValidator object.
+        """
+        # schema -> (lowercase table name -> (name, lowercase column names, column names))
+        self.lookups = weakref.WeakKeyDictionary()
+        self.checked = 0
+        self.rejected = 0
+        self.issue_counts = {}
+
+    def lookup(self, schema):
+        """
+        Builds (once per schema) the case-insensitive lookup of the tables and their columns.
+
+        Args:
+            schema (Schema): The schema of the database, from the schema catalog.
+
+        Returns:
+            dict: Lowercase table names mapped to the table name, its lowercase column names
+                and its column names.
+        """
+        lookup = self.lookups.get(schema)
+        if lookup is None:
+            lookup = {
+                table.lower(): (
+                    table,
+                    {column.lower() for column in columns} | ROWID_COLUMNS,
+                    list(columns),
+                )
+                for table, columns in schema.tables.items()
+            }
+            self.lookups[schema] = lookup
+        return lookup
+
+    def validate(self, query, schema):
+        """
+        Checks a query against the schema of its database.
+
+        Args:
+            query (str): The SQL query.
+            schema (Schema): The schema of the database, from the schema catalog.
+
+        Returns:
+            list: The SQLIssue objects found, empty if the query may be run.
+        """
+        self.checked += 1
+        issues = self.find_issues(query, self.lookup(schema))
+        if issues:
+            self.rejected += 1
+            for issue in issues:
+                self.issue_counts[issue.kind] = self.issue_counts.get(issue.kind, 0) + 1
+        return issues
+
+    def find_issues(self, query, tables):
+        """
+        Runs the structural checks, then the schema checks if the structure is sound.
+
+        Args:
+            query (str): The SQL query.
+            tables (dict): The table lookup of the schema (see lookup).
+
+        Returns:
+            list: The SQLIssue objects found.
+        """
+        tokens, issue = tokenize(query)
+        if not tokens or not tokens[0].is_keyword("SELECT", "WITH"):
+            return []
+        end = next(
+            (position for position, token in enumerate(tokens) if token.text == ";"),
+            len(tokens),
+        )
+        if end + 1 < len(tokens) or (end < len(tokens) and issue is not None):
+            # sqlite3 refuses anything but comments after the first statement
+            return [
+                SQLIssue(
+                    "syntax",
+                    "You can only execute one statement at a time.",
+                    "remove everything after the first ';'",
+                )
+            ]
+        if issue is not None:
+            return [issue]
+        tokens = tokens[:end]
+
+        matches, issue = self.match_parentheses(tokens)
+        if issue is not None:
+            return [issue]
+        last = tokens[-1]
+        if (last.kind == "op" and last.text not in (")", "*")) or last.is_keyword(
+            *INCOMPLETE_ENDINGS
+        ):
+            return [
+                SQLIssue(
+                    "syntax",
+                    "incomplete input",
+                    f'the query stops after "{last.text}", complete it',
+                )
+            ]
+        issues, nested = self.check_clauses(tokens, matches)
+        if issues:
+            return issues
+        return self.check_references(tokens, matches, tables, nested)
+
+    def match_parentheses(self, tokens):
+        """
+        Pairs the parentheses of a query.
+
+        Args:
+            tokens (list): The tokens of the query.
+
+        Returns:
+            tuple: The positions of the opening parentheses mapped to the positions of their
+                closing parentheses, and an SQLIssue for unbalanced parentheses or None.
+        """
+        matches = {}
+        opened = []
+        for position, token in enumerate(tokens):
+            if token.text == "(":
+                opened.append(position)
+            elif token.text == ")":
+                if not opened:
+                    return matches, SQLIssue(
+                        "syntax", 'near ")": syntax error', "unbalanced parentheses"
+                    )
+                matches[opened.pop()] = position
+        if opened:
+            return matches, SQLIssue(
+                "syntax", "incomplete input", "missing closing parenthesis"
+            )
+        return matches, None
+
+    def check_clauses(self, tokens, matches):
+        """
+        Checks the order of the clauses of every SELECT, and that no clause is empty.
+
+        Every parenthesis opens a new level; a level starting with SELECT or WITH is a
+        subquery whose clauses are checked, other levels (function arguments, window
+        definitions) are not.
+
+        Args:
+            tokens (list): The tokens of the query.
+            matches (dict): The paired parentheses (see match_parentheses).
+
+        Returns:
+            tuple: The SQLIssue objects found, and whether the query has subqueries or
+                compound SELECTs.
+        """
+        issues = []
+        nested = False
+        # per level: whether it is a query, and the rank of its last clause
+        levels = [[True, -1]]
+        end = len(tokens)
+        for position, token in enumerate(tokens):
+            following = tokens[position + 1] if position + 1 < end else None
+            if token.text == "(":
+                is_query = following is not None and following.is_keyword(
+                    "SELECT", "WITH"
+                )
+                nested = nested or is_query
+                levels.append([is_query, -1])
+                continue
+            if token.text == ")":
+                levels.pop()
+                continue
+            if token.text == ",":
+                if (
+                    following is None
+                    or following.text == ")"
+                    or self.clause_at(tokens, position + 1)
+                ):
+                    near = following.text if following is not None else "end of query"
+                    issues.append(
+                        SQLIssue(
+                            "syntax",
+                            f'near "{near}": syntax error',
+                            "remove the comma before it",
+                        )
+                    )
+                continue
+
+            if (
+                token.text in COMPARISON_OPERATORS
+                and position + 2 < end
+                and tokens[position + 1].kind == "name"
+                and tokens[position + 1].upper in ("ALL", "ANY", "SOME")
+                and tokens[position + 2].text == "("
+            ):
+                quantifier = tokens[position + 1]
+                issues.append(
+                    SQLIssue(
+                        "syntax",
+                        (
+                            f'near "{quantifier.text}": syntax error'
+                            if quantifier.upper == "ALL"
+                            else f"no such function: {quantifier.text}"
+                        ),
+                        "SQLite has no ALL, ANY or SOME comparisons, compare with the MAX() "
+                        "or MIN() of the subquery instead",
+                    )
+                )
+
+            level = levels[-1]
+            if not level[0] or token.kind != "name":
+                continue
+            if token.upper in COMPOUND_OPERATORS:
+                nested = True
+                level[1] = -1
+                continue
+            if token.upper == "VALUES" and level[1] == -1:
+                # a VALUES list takes the place of a SELECT
+                level[1] = 0
+                continue
+            if token.upper in ("GROUP", "ORDER") and not (
+                following is not None and following.is_keyword("BY")
+            ):
+                near = following.text if following is not None else "end of query"
+                issues.append(
+                    SQLIssue(
+                        "syntax",
+                        f'near "{near}": syntax error',
+                        f"{token.upper} must be followed by BY",
+                    )
+                )
+                continue
+
+            clause = self.clause_at(tokens, position)
+            if clause is None:
+                continue
+            rank = CLAUSE_ORDER.index(clause)
+            if rank == 0 and level[1] == -1:
+                level[1] = 0
+            elif level[1] == -1:
+                issues.append(
+                    SQLIssue(
+                        "clause_order",
+                        f'near "{token.text}": syntax error',
+                        f"{clause} must follow a SELECT",
+                    )
+                )
+            elif rank == level[1]:
+                issues.append(
+                    SQLIssue(
+                        "clause_order",
+                        f'near "{token.text}": syntax error',
+                        f"duplicate {clause} clause, combine its conditions into one",
+                    )
+                )
+            elif rank < level[1]:
+                issues.append(
+                    SQLIssue(
+                        "clause_order",
+                        f'near "{token.text}": syntax error',
+                        f"{clause} must come before {CLAUSE_ORDER[level[1]]}, the clause "
+                        f"order is {', '.join(CLAUSE_ORDER)}",
+                    )
+                )
+            else:
+                level[1] = rank
+
+            # the clause keyword (and BY) must be followed by the content of the clause
+            start = position + (2 if " " in clause else 1)
+            while start < end and tokens[start].is_keyword("DISTINCT", "ALL"):
+                start += 1
+            if (
+                start == end
+                or tokens[start].text in (")", ",")
+                or self.clause_at(tokens, start)
+                or tokens[start].is_keyword(*COMPOUND_OPERATORS)
+            ):
+                issues.append(
+                    SQLIssue(
+                        "syntax",
+                        f"empty {clause} clause",
+                        f"complete or remove the {clause} clause",
+                    )
+                )
+        return issues, nested
+
+    def clause_at(self, tokens, position):
+        """
+        Recognizes the clause keyword at a position.
+
+        Args:
+            tokens (list): The tokens of the query.
+            position (int): The position of the token.
+
+        Returns:
+            str: The clause (one of CLAUSE_ORDER), or None if the token does not start one.
+        """
+        token = tokens[position]
+        if token.kind != "name":
+            return None
+        if token.upper in ("GROUP", "ORDER"):
+            following = tokens[position + 1] if position + 1 < len(tokens) else None
+            if following is not None and following.is_keyword("BY"):
+                return f"{token.upper} BY"
+            return None
+        if (
+            token.upper == "FROM"
+            and position > 0
+            and tokens[position - 1].is_keyword("DISTINCT")
+        ):
+            # IS [NOT] DISTINCT FROM
+            return None
+        if token.upper in CLAUSE_ORDER:
+            return token.upper
+        return None
+
+    def scope_tree(self, tokens):
+        """
+        Assigns every token to the SELECT it belongs to, where its aliases are visible.
+
+        A parenthesized subquery opens a scope nested in the scope of the parenthesis, and
+        every part of a compound SELECT has its own scope, sharing the enclosing scope of the
+        first part. Other parentheses (function arguments, lists, parenthesized joins) belong
+        to the enclosing scope.
+
+        Args:
+            tokens (list): The tokens of the query.
+
+        Returns:
+            tuple: The scope of every token, and the enclosing scope of every scope (None for
+                the outermost ones).
+        """
+        scopes = []
+        parents = [None]
+        # per parenthesis level: the scope of its tokens
+        levels = [0]
+        end = len(tokens)
+        for position, token in enumerate(tokens):
+            if token.text == ")" and len(levels) > 1:
+                levels.pop()
+            elif token.is_keyword(*COMPOUND_OPERATORS):
+                parents.append(parents[levels[-1]])
+                levels[-1] = len(parents) - 1
+            scopes.append(levels[-1])
+            if token.text == "(":
+                if position + 1 < end and tokens[position + 1].is_keyword(
+                    "SELECT", "WITH"
+                ):
+                    parents.append(levels[-1])
+                    levels.append(len(parents) - 1)
+                else:
+                    levels.append(levels[-1])
+        return scopes, parents
+
+    def check_references(self, tokens, matches, tables, nested):
+        """
+        Resolves the tables, aliases and columns referenced by a query.
+
+        Tables and aliases are bound in the scope of their SELECT (see scope_tree), so a
+        qualifier resolves to the closest enclosing binding, as in SQLite.
+
+        Args:
+            tokens (list): The tokens of the query.
+            matches (dict): The paired parentheses (see match_parentheses).
+            tables (dict): The table lookup of the schema (see lookup).
+            nested (bool): Whether the query has subqueries or compound SELECTs, whose
+                scopes make unqualified columns ambiguous only within their own SELECT.
+
+        Returns:
+            list: The SQLIssue objects found.
+        """
+        issues = []
+        end = len(tokens)
+        table_names = [table for table, _, _ in tables.values()]
+        scopes, parents = self.scope_tree(tokens)
+        # per scope: qualifier (alias or unaliased table name) -> table key, None if its
+        # columns are unknown
+        sources = [{} for _ in parents]
+        # lowercase qualifier -> qualifier as written
+        labels = {}
+        # (qualifier, table key) of every referenced table, to detect ambiguous columns
+        instances = []
+        # names that are not column references, and names defined by the query itself
+        skipped = set()
+        aliases = set()
+        # whether some columns come from sources that are not known statically
+        opaque = False
+
+        def is_name(position):
+            return position < end and tokens[position].identifier
+
+        def visible(scope):
+            # the bindings of a scope and of its enclosing scopes, the closest first
+            while scope is not None:
+                yield sources[scope]
+                scope = parents[scope]
+
+        def read_alias(position):
+            # [AS] alias after a table reference, returns the alias and the next position
+            if position < end and tokens[position].is_keyword("AS"):
+                position += 1
+            if not is_name(position):
+                return None, position
+            skipped.add(position)
+            alias = tokens[position].value
+            aliases.add(alias.lower())
+            labels[alias.lower()] = alias
+            return alias.lower(), position + 1
+
+        # common table expressions: WITH [RECURSIVE] name [(columns)] AS [NOT] [MATERIALIZED] (...)
+        ctes = set()
+        if tokens[0].is_keyword("WITH"):
+            opaque = True
+            position = 1
+            if position < end and tokens[position].is_keyword("RECURSIVE"):
+                position += 1
+            while is_name(position):
+                ctes.add(tokens[position].value.lower())
+                skipped.add(position)
+                position += 1
+                if position < end and tokens[position].text == "(":
+                    skipped.update(range(position, matches[position] + 1))
+                    position = matches[position] + 1
+                while position < end and tokens[position].is_keyword(
+                    "AS", "NOT", "MATERIALIZED"
+                ):
+                    position += 1
+                if position < end and tokens[position].text == "(":
+                    position = matches[position] + 1
+                if position >= end or tokens[position].text != ",":
+                    break
+                position += 1
+
+        # table references: after FROM, JOIN, and the commas of a FROM clause
+        levels = [None]
+        position = 0
+        while position < end:
+            token = tokens[position]
+            scope = scopes[position]
+            clause = None
+            if token.text == "(":
+                levels.append(None)
+            elif token.text == ")":
+                levels.pop()
+            else:
+                clause = self.clause_at(tokens, position)
+                if clause is not None:
+                    levels[-1] = clause
+            position += 1
+            if not (
+                clause == "FROM"
+                or token.is_keyword("JOIN")
+                or (token.text == "," and levels[-1] == "FROM")
+            ):
+                continue
+
+            if position < end and tokens[position].text == "(":
+                # subquery or parenthesized join, whose tokens are scanned as well
+                opaque = True
+                alias, _ = read_alias(matches[position] + 1)
+                if alias:
+                    sources[scope][alias] = None
+                continue
+            if position >= end or tokens[position].kind not in ("name", "quoted"):
+                continue
+            name = tokens[position].value
+            if tokens[position].is_keyword() and name.lower() not in tables:
+                continue
+            skipped.add(position)
+            position += 1
+            if (
+                position + 1 < end
+                and tokens[position].text == "."
+                and tokens[position + 1].kind in ("name", "quoted")
+            ):
+                # schema-qualified table name
+                name = tokens[position + 1].value
+                skipped.add(position + 1)
+                position += 2
+            if position < end and tokens[position].text == "(":
+                # table-valued function
+                opaque = True
+                alias, position = read_alias(matches[position] + 1)
+                if alias:
+                    sources[scope][alias] = None
+                continue
+
+            key = name.lower()
+            if key in ctes:
+                key = None
+            elif key not in tables:
+                issues.append(
+                    SQLIssue(
+                        "table", f"no such table: {name}", suggest(name, table_names)
+                    )
+                )
+                opaque = True
+                key = None
+            alias, position = read_alias(position)
+            # an aliased table can only be qualified by its alias
+            qualifier = alias or name.lower()
+            labels.setdefault(qualifier, name)
+            sources[scope][qualifier] = key
+            instances.append((qualifier, key))
+
+        # names given with AS (column aliases, CAST types), names after COLLATE, OVER and
+        # WINDOW, index names, and column aliases written without AS in a select list
+        for position, token in enumerate(tokens):
+            if position in skipped or not token.identifier:
+                continue
+            previous = tokens[position - 1] if position > 0 else None
+            following = tokens[position + 1] if position + 1 < end else None
+            if previous is None:
+                continue
+            if previous.is_keyword("AS", "COLLATE", "OVER", "WINDOW") or (
+                previous.is_keyword("BY") and tokens[position - 2].is_keyword("INDEXED")
+            ):
+                skipped.add(position)
+                aliases.add(token.value.lower())
+            elif (
+                previous.identifier
+                or previous.kind in ("number", "string")
+                or previous.text == ")"
+            ) and (
+                following is None
+                or following.text in (",", ")")
+                or following.is_keyword("FROM")
+            ):
+                skipped.add(position)
+                aliases.add(token.value.lower())
+
+        # tables of every scope, in order of appearance
+        keys = list(
+            dict.fromkeys(key for bindings in sources for key in bindings.values())
+        )
+        known = set()
+        for key in keys:
+            if key is not None:
+                known |= tables[key][1]
+        # USING and NATURAL joins merge the columns they join on
+        merged = any(token.is_keyword("USING", "NATURAL") for token in tokens)
+
+        for position, token in enumerate(tokens):
+            if position in skipped or not token.identifier:
+                continue
+            previous = tokens[position - 1] if position > 0 else None
+            following = tokens[position + 1] if position + 1 < end else None
+            if previous is not None and previous.text == ".":
+                continue
+            if following is not None and following.text == "(":
+                # function call
+                continue
+            name = token.value
+            lowered = name.lower()
+
+            if following is not None and following.text == ".":
+                # qualified column: qualifier.column or qualifier.*
+                column = tokens[position + 2] if position + 2 < end else None
+                bindings = next(
+                    (
+                        bindings
+                        for bindings in visible(scopes[position])
+                        if lowered in bindings
+                    ),
+                    None,
+                )
+                if bindings is None:
+                    shown = f"{name}.{column.value}" if column is not None else name
+                    renamed = [
+                        labels[qualifier]
+                        for qualifier, key in instances
+                        if key == lowered and qualifier != lowered
+                    ]
+                    if renamed:
+                        hint = f"{name} is aliased, qualify with {' or '.join(renamed)}"
+                    elif lowered in tables:
+                        hint = f"{name} is missing from the FROM clause"
+                    else:
+                        qualifiers = [
+                            labels[qualifier]
+                            for bindings in visible(scopes[position])
+                            for qualifier in bindings
+                        ]
+                        hint = (
+                            f"{name} is not a table or alias of the query, "
+                            + suggest(name, qualifiers or table_names)
+                        )
+                    issues.append(SQLIssue("column", f"no such column: {shown}", hint))
+                    continue
+                key = bindings[lowered]
+                if (
+                    key is None
+                    or column is None
+                    or column.text == "*"
+                    or column.value.lower() in tables[key][1]
+                ):
+                    continue
+                issues.append(
+                    SQLIssue(
+                        "column",
+                        f"no such column: {name}.{column.value}",
+                        suggest(column.value, tables[key][2]),
+                    )
+                )
+                continue
+
+            if opaque or token.text.startswith('"'):
+                # unknown double-quoted names are string literals in SQLite
+                continue
+            if lowered in aliases or any(lowered in bindings for bindings in sources):
+                continue
+            if lowered not in known:
+                owners = [
+                    table for table, columns, _ in tables.values() if lowered in columns
+                ]
+                if owners:
+                    hint = (
+                        f"{name} is a column of {' and '.join(owners)}, which the query "
+                        "does not select from"
+                    )
+                else:
+                    columns = [
+                        column
+                        for key in keys
+                        if key is not None
+                        for column in tables[key][2]
+                    ]
+                    hint = suggest(name, columns)
+                issues.append(SQLIssue("column", f"no such column: {name}", hint))
+                continue
+            owners = [
+                labels[qualifier]
+                for qualifier, key in instances
+                if key is not None and lowered in tables[key][1]
+            ]
+            if len(owners) > 1 and not nested and not merged:
+                issues.append(
+                    SQLIssue(
+                        "column",
+                        f"ambiguous column name: {name}",
+                        "qualify it with one of " + ", ".join(owners),
+                    )
+                )
+        return issues
+
+    def stats(self):
+        """
+        Reports the validation counters.
+
+        Returns:
+            dict: Checked queries, queries rejected before execution, and issues by kind.
+        """
+        return {
+            "checked": self.checked,
+            "rejected": self.rejected,
+            "passed": self.checked - self.rejected,
+            "issues": dict(self.issue_counts),
+        }
@@ -0,0 +1,510 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+# errors caused by the database file or its storage rather than by the query
+TRANSIENT_ERRORS = (
+    "disk I/O error",
+    "database disk image is malformed",
+    "unable to open database file",
+)
+# transient error showing that a copy of the database is corrupt
+CORRUPTION_ERROR = "database disk image is malformed"
+
+ROUTING_POLICIES = ("failover", "round_robin", "least_loaded")
+
+
+def is_transient_error(error):
+    """
+    Tells whether an SQLite error comes from the database file rather than from the query.
+
+    Args:
+        error (sqlite3.Error): The error.
+
+    Returns:
+        bool: True if retrying (possibly on a mirror) can succeed.
+    """
+    return any(message in str(error) for message in TRANSIENT_ERRORS)
+
+
+def connect_read_only(db_path, immutable=False, check_same_thread=True):
+    """
+    Opens a read-only connection to an SQLite database.
+
+    An immutable connection also skips file locking and change detection, so any number of
+    processes can share the file without contention. It must only be used on databases that
+    are not modified while they are open.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+        immutable (bool, optional): Whether to open the database with immutable=1.
+        check_same_thread (bool, optional): Whether only the creating thread may use the
+            connection.
+
+    Returns:
+        sqlite3.Connection: A read-only connection to the database.
+
+    Raises:
+        sqlite3.Error: If the database cannot be opened.
+    """
+    # the path is percent-encoded, so that "#", "?" and "%" are not read as URI syntax
+    uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    return sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+
+
+class MirrorsExhausted(sqlite3.OperationalError):
+    """
+    Raised when a database could not be read from any of its mirror directories.
+    """
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one mirror directory.
+
+    The breaker opens after a number of consecutive failures. While it is open, the mirror is
+    only used if no other mirror is available; after the cooldown, one trial is let through
+    and a success closes the breaker again.
+
+    Args:
+        failure_threshold (int, optional): Consecutive failures that open the breaker.
+        cooldown (float, optional): Seconds before an open breaker lets a trial through.
+    """
+
+    def __init__(self, failure_threshold=3, cooldown=30.0):
+        """
+        Initializes the CircuitBreaker object.
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    def is_open(self, now):
+        """
+        Tells whether the mirror should be avoided.
+
+        Args:
+            now (float): The current monotonic time.
+
+        Returns:
+            bool: True while the breaker is open and its cooldown has not elapsed.
+        """
+        return self.opened_at is not None and now - self.opened_at < self.cooldown
+
+    def record_success(self):
+        """
+        Closes the breaker.
+        """
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self, now):
+        """
+        Counts a failure, opening the breaker when the threshold is reached.
+
+        Args:
+            now (float): The current monotonic time.
+
+        Returns:
+            bool: True if this failure opened the breaker.
+        """
+        self.failures += 1
+        if self.failures < self.failure_threshold:
+            return False
+        was_open = self.opened_at is not None
+        self.opened_at = now
+        return not was_open
+
+
+class ConnectionPool:
+    """
+    Pool of read-only connections to one SQLite database.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+        immutable (bool, optional): Whether connections are opened with immutable=1.
+        max_idle (int, optional): Maximum number of idle connections kept open.
+    """
+
+    def __init__(self, db_path, immutable=False, max_idle=4):
+        """
+        Initializes the ConnectionPool object.
+        """
+        self.db_path = db_path
+        self.immutable = immutable
+        self.max_idle = max_idle
+        self.idle = []
+        self.lock = threading.Lock()
+        self.reused = 0
+        self.opened = 0
+
+    @contextmanager
+    def connection(self):
+        """
+        Lends a connection, opening one if none is idle.
+
+        A connection that fails with a transient error is closed instead of being returned to
+        the pool.
+
+        Yields:
+            sqlite3.Connection: A read-only connection to the database.
+        """
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+            if conn is None:
+                self.opened += 1
+            else:
+                self.reused += 1
+        if conn is None:
+            conn = connect_read_only(
+                self.db_path, self.immutable, check_same_thread=False
+            )
+        try:
+            yield conn
+        except sqlite3.Error as e:
+            if is_transient_error(e):
+                conn.close()
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                with self.lock:
+                    if len(self.idle) < self.max_idle:
+                        self.idle.append(conn)
+                        conn = None
+                if conn is not None:
+                    conn.close()
+
+    def close(self):
+        """
+        Closes the idle connections.
+        """
+        with self.lock:
+            for conn in self.idle:
+                conn.close()
+            self.idle.clear()
+
+
+class SQLiteAccess:
+    """
+    Shared access layer for reading SQLite databases and their mirror directories.
+
+    The database root "<root>" holding "<root>/<db_id>/<db_id>.sqlite" may have mirror copies
+    "<root>2", "<root>3" and so on up to max_mirrors, holding the same databases at the same
+    relative paths. This class handles:
+        * Pooling read-only connections per database file.
+        * Retrying transient errors (disk I/O errors, malformed images, unopenable files)
+          with jittered exponential backoff.
+        * Routing reads across the healthy mirrors: always the primary first ("failover"),
+          in turn ("round_robin") or to the mirror with the fewest reads in flight
+          ("least_loaded").
+        * Tracking the health of every mirror directory with a circuit breaker, and
+          remembering which mirrors hold a corrupt copy of each database so that they are
+          skipped.
+        * Counting attempts, retries, fallbacks after failures, reads per mirror and failures.
+
+    Errors caused by the query itself are raised at once without retrying.
+
+    Args:
+        max_retries (int, optional): Attempts per mirror before moving to the next one.
+        max_mirrors (int, optional): Highest mirror root suffix.
+        base_delay (float, optional): Backoff delay in seconds after the first failure.
+        max_delay (float, optional): Upper bound of the backoff delay in seconds.
+        failure_threshold (int, optional): Consecutive failures that open a mirror breaker.
+        cooldown (float, optional): Seconds before an open breaker lets a trial through.
+        max_idle (int, optional): Maximum number of idle connections kept per database.
+        routing (str, optional): Routing policy across healthy mirrors, one of
+            ROUTING_POLICIES.
+    """
+
+    def __init__(
+        self,
+        max_retries=3,
+        max_mirrors=15,
+        base_delay=0.05,
+        max_delay=2.0,
+        failure_threshold=3,
+        cooldown=30.0,
+        max_idle=4,
+        routing="failover",
+    ):
+        """
+        Initializes the SQLiteAccess object.
+        """
+        if routing not in ROUTING_POLICIES:
+            raise ValueError(f"Unknown routing policy: {routing}")
+        self.max_retries = max_retries
+        self.max_mirrors = max_mirrors
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_idle = max_idle
+        self.routing = routing
+        self.lock = threading.Lock()
+        self.pools = {}
+        self.breakers = {}
+        self.mirror_directories = {}
+        # database path relative to the root -> mirror roots holding a corrupt copy
+        self.corrupt = {}
+        self.in_flight = {}
+        self.next_mirror = {}
+        self.reads = {}
+        self.attempts = 0
+        self.retries = 0
+        self.fallbacks = 0
+        self.failures = 0
+        self.breaker_opens = 0
+
+    def get_mirror_directories(self, root):
+        """
+        Lists a database root followed by its existing mirror roots.
+
+        Args:
+            root (str): The primary database root, the parent of the database folders.
+
+        Returns:
+            list: The primary root and the mirror roots that exist.
+        """
+        with self.lock:
+            if root not in self.mirror_directories:
+                mirrors = [f"{root}{i}" for i in range(2, self.max_mirrors + 1)]
+                self.mirror_directories[root] = [root] + [
+                    mirror for mirror in mirrors if os.path.isdir(mirror)
+                ]
+            return self.mirror_directories[root]
+
+    def get_pool(self, db_path, immutable=False):
+        """
+        Retrieves the connection pool of a database file.
+
+        Args:
+            db_path (str): Path to the SQLite database file.
+            immutable (bool, optional): Whether connections are opened with immutable=1.
+
+        Returns:
+            ConnectionPool: The connection pool.
+        """
+        key = (os.path.abspath(db_path), immutable)
+        with self.lock:
+            if key not in self.pools:
+                self.pools[key] = ConnectionPool(db_path, immutable, self.max_idle)
+            return self.pools[key]
+
+    def _breaker(self, directory):
+        """
+        Retrieves the circuit breaker of a mirror directory.
+
+        This is a private helper method; the caller holds the lock.
+        """
+        if directory not in self.breakers:
+            self.breakers[directory] = CircuitBreaker(
+                self.failure_threshold, self.cooldown
+            )
+        return self.breakers[directory]
+
+    def rank_mirrors(self, directories, db_name):
+        """
+        Orders the mirror roots of a database for the next read.
+
+        Mirrors that are healthy for the database (closed breaker, not known to be corrupt) come
+        first, in the order of the routing policy. The others follow, closed breakers and fewest
+        recent failures first, and are only tried when no healthy mirror succeeds.
+
+        Args:
+            directories (list): The mirror roots, primary first.
+            db_name (str): Path of the database relative to the roots.
+
+        Returns:
+            list: The mirror roots, in the order they should be tried.
+        """
+        now = time.monotonic()
+        with self.lock:
+            corrupt = self.corrupt.get(db_name, set())
+            healthy = [
+                directory
+                for directory in directories
+                if directory not in corrupt
+                and not self._breaker(directory).is_open(now)
+            ]
+            unhealthy = sorted(
+                (directory for directory in directories if directory not in healthy),
+                key=lambda directory: (
+                    self._breaker(directory).is_open(now),
+                    self._breaker(directory).failures,
+                    directories.index(directory),
+                ),
+            )
+            if self.routing == "round_robin" and healthy:
+                key = (directories[0], db_name)
+                start = self.next_mirror.get(key, 0) % len(healthy)
+                self.next_mirror[key] = start + 1
+                healthy = healthy[start:] + healthy[:start]
+            elif self.routing == "least_loaded":
+                # stable sort: the primary wins ties
+                healthy.sort(key=lambda directory: self.in_flight.get(directory, 0))
+        return healthy + unhealthy
+
+    def mark_corrupt(self, directory, db_name, error):
+        """
+        Remembers that the copy of a database in a mirror root is corrupt.
+
+        Args:
+            directory (str): The mirror root.
+            db_name (str): Path of the database relative to the roots.
+            error (sqlite3.Error): The error showing the corruption.
+        """
+        with self.lock:
+            corrupt = self.corrupt.setdefault(db_name, set())
+            if directory in corrupt:
+                return
+            corrupt.add(directory)
+        print(f"Mirror {directory} marked corrupt for {db_name}: {error}")
+
+    def backoff(self, attempt):
+        """
+        Computes the jittered exponential backoff delay after a failed attempt.
+
+        Args:
+            attempt (int): Zero-based number of the failed attempt on the current mirror.
+
+        Returns:
+            float: The delay in seconds, between half and all of the exponential delay.
+        """
+        delay = min(self.max_delay, self.base_delay * 2**attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def run(self, db_path, operation, immutable=False):
+        """
+        Runs an operation on a database, falling back to its mirrors on transient errors.
+
+        The mirrors of "<root>/<db_id>/<db_id>.sqlite" are "<root>2/<db_id>/<db_id>.sqlite"
+        and so on.
+
+        Args:
+            db_path (str): Path to the SQLite database file in the primary root.
+            operation (callable): Called as operation(connection, path) with a pooled
+                read-only connection and the path of the mirror it is connected to.
+            immutable (bool, optional): Whether connections are opened with immutable=1.
+
+        Returns:
+            object: The return value of the operation.
+
+        Raises:
+            MirrorsExhausted: If every mirror failed with transient errors.
+            sqlite3.Error: If the operation fails with a non-transient error.
+        """
+        db_directory, file_name = os.path.split(db_path)
+        root, db_id = os.path.split(db_directory)
+        db_name = os.path.join(db_id, file_name)
+        directories = self.get_mirror_directories(root or os.curdir)
+        failed = False
+        for directory in self.rank_mirrors(directories, db_name):
+            path = os.path.join(directory, db_name)
+            pool = self.get_pool(path, immutable)
+            for attempt in range(self.max_retries):
+                with self.lock:
+                    self.attempts += 1
+                    self.in_flight[directory] = self.in_flight.get(directory, 0) + 1
+                try:
+                    with pool.connection() as conn:
+                        result = operation(conn, path)
+                except sqlite3.Error as e:
+                    if not is_transient_error(e):
+                        raise
+                    failed = True
+                    if CORRUPTION_ERROR in str(e):
+                        # a corrupt copy stays corrupt, so the next mirror is tried at once
+                        self.mark_corrupt(directory, db_name, e)
+                        break
+                    now = time.monotonic()
+                    with self.lock:
+                        self.retries += 1
+                        breaker = self._breaker(directory)
+                        if breaker.record_failure(now):
+                            self.breaker_opens += 1
+                            print(f"Mirror {directory} disabled after error: {e}")
+                        give_up = breaker.is_open(now)
+                    if give_up or attempt == self.max_retries - 1:
+                        break
+                    time.sleep(self.backoff(attempt))
+                    continue
+                finally:
+                    with self.lock:
+                        self.in_flight[directory] -= 1
+
+                with self.lock:
+                    self._breaker(directory).record_success()
+                    self.corrupt.get(db_name, set()).discard(directory)
+                    self.reads[directory] = self.reads.get(directory, 0) + 1
+                    if failed:
+                        self.fallbacks += 1
+                return result
+
+        with self.lock:
+            self.failures += 1
+        raise MirrorsExhausted(f"Failed after trying {len(directories)} directories")
+
+    def stats(self):
+        """
+        Reports the access counters.
+
+        Returns:
+            dict: Attempts, retries, fallbacks after failures, failures, breaker openings, the
+                mirror directories whose breaker is open, the corrupt mirrors per database,
+                the successful reads per mirror, the number of pools and the share of
+                connections reused from a pool.
+        """
+        now = time.monotonic()
+        with self.lock:
+            reused = sum(pool.reused for pool in self.pools.values())
+            opened = sum(pool.opened for pool in self.pools.values())
+            return {
+                "attempts": self.attempts,
+                "retries": self.retries,
+                "fallbacks": self.fallbacks,
+                "failures": self.failures,
+                "breaker_opens": self.breaker_opens,
+                "open_mirrors": sorted(
+                    directory
+                    for directory, breaker in self.breakers.items()
+                    if breaker.is_open(now)
+                ),
+                "corrupt": {
+                    db_name: sorted(directories)
+                    for db_name, directories in self.corrupt.items()
+                    if directories
+                },
+                "reads": dict(self.reads),
+                "pools": len(self.pools),
+                "pool_hit_rate": reused / (reused + opened) if reused + opened else 0.0,
+            }
+
+    def close(self):
+        """
+        Closes the idle connections of every pool.
+        """
+        with self.lock:
+            pools = list(self.pools.values())
+        for pool in pools:
+            pool.close()
+
+
+_sqlite_access = SQLiteAccess()
+
+
+def get_sqlite_access():
+    """
+    Returns the SQLite access layer shared by all components of the process.
+
+    Returns:
+        SQLiteAccess: The shared access layer.
+    """
+    return _sqlite_access
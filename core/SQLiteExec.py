@@ -1,5 +1,204 @@
 import sqlite3
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from core.SQLiteAccess import ROUTING_POLICIES, SQLiteAccess
+
+# database access layer of the current worker process, pooling one connection per database
+_worker_access = None
+_worker_db_base_path = None
+_worker_limits = None
+_worker_mode = "execute"
+_worker_immutable = False
+
+VALIDATION_MODES = ("execute", "explain")
+
+
+class QueryLimits:
+    """
+    Execution budget of a single SQL query.
+
+    Args:
+        timeout (float, optional): Wall-clock limit in seconds, None for no limit.
+        max_steps (int, optional): Limit on SQLite virtual machine steps, None for no limit.
+        max_rows (int, optional): Limit on fetched rows, None for no limit.
+        check_every (int, optional): Number of VM steps between two budget checks.
+    """
+
+    def __init__(self, timeout=None, max_steps=None, max_rows=None, check_every=1000):
+        """
+        Initializes the QueryLimits object.
+        """
+        self.timeout = timeout
+        self.max_steps = max_steps
+        self.max_rows = max_rows
+        self.check_every = check_every
+
+    def unlimited(self):
+        """
+        Checks whether the budget sets no limit at all.
+
+        Returns:
+            bool: True if there is no wall-clock, VM step or row limit.
+        """
+        return not (self.timeout or self.max_steps or self.max_rows)
+
+
+class QueryTimeout(Exception):
+    """
+    Raised when a query exceeds its wall-clock, VM step or row budget.
+    """
+
+
+def execute_with_limits(connection, query, limits, on_rows=None):
+    """
+    Executes a query and fetches its rows within an execution budget.
+
+    The wall-clock and VM step budgets are enforced through the SQLite progress handler,
+    which interrupts the query as soon as either is exceeded. The rows are fetched so that
+    the budget covers the whole query, not only its first step; this can report runtime
+    errors or timeouts that executing the query alone does not. Without any limit and without
+    on_rows, the query is only executed and its rows are not fetched.
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database.
+        query (str): The SQL query.
+        limits (QueryLimits): The execution budget.
+        on_rows (callable, optional): Called with every batch of fetched rows.
+
+    Returns:
+        int: The number of fetched rows (0 if they are not fetched).
+
+    Raises:
+        QueryTimeout: If the query exceeds its budget.
+        sqlite3.Error: If the query fails.
+    """
+    if on_rows is None and limits.unlimited():
+        cursor = connection.cursor()
+        try:
+            cursor.execute(query)
+        finally:
+            cursor.close()
+        return 0
+
+    deadline = time.monotonic() + limits.timeout if limits.timeout else None
+    budget = {"steps": 0, "exceeded": None}
+
+    def check_budget():
+        budget["steps"] += limits.check_every
+        if limits.max_steps and budget["steps"] > limits.max_steps:
+            budget["exceeded"] = f"more than {limits.max_steps} VM steps"
+        elif deadline and time.monotonic() > deadline:
+            budget["exceeded"] = f"more than {limits.timeout} seconds"
+        # a non-zero return value interrupts the query
+        return 1 if budget["exceeded"] else 0
+
+    connection.set_progress_handler(check_budget, limits.check_every)
+    cursor = connection.cursor()
+    try:
+        rows = 0
+        cursor.execute(query)
+        while True:
+            batch = cursor.fetchmany(1000)
+            if not batch:
+                return rows
+            rows += len(batch)
+            if on_rows is not None:
+                on_rows(batch)
+            if limits.max_rows and rows > limits.max_rows:
+                raise QueryTimeout(
+                    f"Query timeout: the query returned more than {limits.max_rows} rows"
+                )
+    except sqlite3.OperationalError:
+        if budget["exceeded"]:
+            raise QueryTimeout(f"Query timeout: the query took {budget['exceeded']}")
+        raise
+    finally:
+        cursor.close()
+        connection.set_progress_handler(None, 0)
+
+
+def validate_query(connection, query, limits, mode="execute"):
+    """
+    Checks a query against a database within an execution budget.
+
+    In "execute" mode the query is run and its rows are fetched. In "explain" mode it is
+    only prepared: EXPLAIN compiles the statement, which catches syntax errors and unknown
+    tables or columns, and returns its bytecode without running it.
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database.
+        query (str): The SQL query.
+        limits (QueryLimits): The execution budget.
+        mode (str, optional): Validation mode, one of VALIDATION_MODES.
+
+    Raises:
+        QueryTimeout: If the query exceeds its budget.
+        sqlite3.Error: If the query is invalid or fails.
+    """
+    if mode not in VALIDATION_MODES:
+        raise ValueError(f"Unknown validation mode: {mode}")
+    if mode == "explain":
+        query = f"EXPLAIN {query}"
+    execute_with_limits(connection, query, limits)
+
+
+def _init_worker(db_base_path, limits, mode, immutable, routing):
+    """
+    Sets the database base path, query budget, validation mode and mirror routing policy of a
+    worker process.
+
+    This is a private helper function.
+    """
+    global _worker_access, _worker_db_base_path, _worker_limits
+    global _worker_mode, _worker_immutable
+    _worker_access = SQLiteAccess(routing=routing)
+    _worker_db_base_path = db_base_path
+    _worker_limits = limits
+    _worker_mode = mode
+    _worker_immutable = immutable
+
+
+def _execute_shard(shard):
+    """
+    Executes a shard of queries, reusing pooled connections of the worker and spreading the
+    reads across the database mirrors.
+
+    This is a private helper function.
+
+    Args:
+        shard (list): (index, query, db_id) tuples.
+
+    Returns:
+        list: (index, outcome, error) tuples, where outcome is "ok", "error" or "timeout".
+    """
+    outcomes = []
+    for index, query, db_id in shard:
+        try:
+            db_path = os.path.join(_worker_db_base_path, db_id, f"{db_id}.sqlite")
+            _worker_access.run(
+                db_path,
+                lambda conn, path: validate_query(
+                    conn, query, _worker_limits, _worker_mode
+                ),
+                _worker_immutable,
+            )
+            outcomes.append((index, "ok", None))
+        except QueryTimeout as e:
+            outcomes.append((index, "timeout", str(e)))
+        except sqlite3.Error as e:
+            outcomes.append((index, "error", str(e)))
+    return outcomes
+
+
+def _close_worker_connections():
+    """
+    Closes the connections opened by _execute_shard in the current process.
+
+    This is a private helper function.
+    """
+    _worker_access.close()
 
 
 class SQLiteExec:
@@ -9,38 +208,47 @@ class SQLiteExec:
     This class provides functionality for:
         * Connecting to SQLite databases based on IDs.
         * Reading queries and corresponding database IDs from files.
-        * Executing queries against the appropriate databases.
+        * Executing queries against the appropriate databases in a process pool, within
+          a per-query execution budget.
         * Calculating the overall accuracy of query execution.
     """
-    def __init__(self, db_base_path):
+    def __init__(
+        self,
+        db_base_path,
+        workers=None,
+        shard_size=64,
+        limits=None,
+        mode="execute",
+        immutable=False,
+        routing="failover",
+    ):
         """
         Initializes the SQLiteExec object.
 
         Args:
             db_base_path (str): The base directory where database folders are located.
+            workers (int, optional): Number of worker processes. Defaults to the number of CPUs;
+                1 executes the queries in the current process.
+            shard_size (int, optional): Maximum number of queries sent to a worker at once.
+            limits (QueryLimits, optional): Execution budget of every query.
+            mode (str, optional): "execute" runs every query, "explain" only prepares it.
+            immutable (bool, optional): Whether databases are opened with immutable=1, which
+                skips file locking. Only valid if the databases do not change during the run.
+            routing (str, optional): Routing policy of reads across the database mirrors.
         """
+        if mode not in VALIDATION_MODES:
+            raise ValueError(f"Unknown validation mode: {mode}")
+        if routing not in ROUTING_POLICIES:
+            raise ValueError(f"Unknown routing policy: {routing}")
         self.db_base_path = db_base_path
-
-    def _connect_to_database(self, db_id):
-        """
-        Connects to an SQLite database based on its ID.
-
-        This is a private helper method.
-
-        Args:
-            db_id (str): The ID of the database to connect to.
-
-        Returns:
-            sqlite3.Connection: A connection object to the database, or None if connection fails.
-        """
-        db_path = os.path.join(self.db_base_path, db_id, f"{db_id}.sqlite")
-        try:
-            connection = sqlite3.connect(db_path)
-            print(f"Connected to database: {db_path}")
-            return connection
-        except sqlite3.Error as e:
-            print(f"Error connecting to database {db_path}: {e}")
-            return None
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_size = shard_size
+        self.limits = limits or QueryLimits()
+        self.mode = mode
+        self.immutable = immutable
+        self.routing = routing
+        # outcome of each query of the last execute_queries call: "ok", "error" or "timeout"
+        self.outcomes = []
 
     def read_queries_and_ids(self, query_file_path, id_file_path):
         """
@@ -80,33 +288,61 @@ class SQLiteExec:
         """
         Executes a list of SQL queries against their respective SQLite databases.
 
+        Queries are grouped by database ID and split into shards that run in a process pool.
+        Each worker keeps one read-only connection per database ID. A query exceeding its
+        execution budget is stopped and recorded with a "timeout" outcome in self.outcomes.
+
         Args:
             queries (list): A list of SQL queries as strings.
             db_ids (list): A list of database IDs corresponding to the queries.
 
         Returns:
-            list: A list of integers indicating the success of each query execution:
+            list: A list of integers indicating the success of each query execution, in input order:
                 - 1: Query executed successfully
                 - 0: Query execution failed
         """
-        results = []
-        for query, db_id in zip(queries, db_ids):
+        # group the queries by database so that workers reuse their connections
+        by_database = {}
+        for index, (query, db_id) in enumerate(zip(queries, db_ids)):
             db_id = db_id.strip()
-            connection = self._connect_to_database(db_id)
-            if connection:
-                cursor = connection.cursor()
-                try:
-                    cursor.execute(query)
-                    connection.commit()
-                    results.append(1)
-                except sqlite3.Error as e:
-                    print(f"Error executing query: {query.strip()}\nError: {e}")
-                    results.append(0)
-                finally:
-                    cursor.close()
-                    connection.close()
-            else:
-                results.append(0)
+            by_database.setdefault(db_id, []).append((index, query, db_id))
+        shards = []
+        for items in by_database.values():
+            for start in range(0, len(items), self.shard_size):
+                shards.append(items[start : start + self.shard_size])
+
+        if self.workers == 1:
+            _init_worker(
+                self.db_base_path, self.limits, self.mode, self.immutable, self.routing
+            )
+            shard_outcomes = [_execute_shard(shard) for shard in shards]
+            _close_worker_connections()
+        else:
+            with ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(
+                    self.db_base_path,
+                    self.limits,
+                    self.mode,
+                    self.immutable,
+                    self.routing,
+                ),
+            ) as executor:
+                shard_outcomes = list(executor.map(_execute_shard, shards))
+
+        self.outcomes = ["error"] * len(queries)
+        errors = {}
+        for outcomes in shard_outcomes:
+            for index, outcome, error in outcomes:
+                self.outcomes[index] = outcome
+                if error is not None:
+                    errors[index] = error
+        results = [1 if outcome == "ok" else 0 for outcome in self.outcomes]
+        for index in sorted(errors):
+            print(
+                f"Error executing query: {queries[index].strip()}\nError: {errors[index]}"
+            )
         return results
 
     def calculate_accuracy(self, results):
@@ -0,0 +1,146 @@
+import os
+import sqlite3
+import threading
+
+
+class Schema:
+    """
+    Schema metadata of one SQLite database.
+
+    Args:
+        table_ddl (dict): Table names mapped to their CREATE TABLE statements.
+        tables (dict): Table names mapped to the list of their column names.
+    """
+
+    def __init__(self, table_ddl, tables):
+        """
+        Initializes the Schema object.
+        """
+        self.table_ddl = table_ddl
+        self.tables = tables
+
+    @property
+    def ddl(self):
+        """
+        str: Concatenated DDL statements for all tables, one per line.
+        """
+        return "".join(f"{sql}\n" for sql in self.table_ddl.values())
+
+
+def load_schema(db_path, connection=None):
+    """
+    Reads the DDL statements, tables and columns of an SQLite database with one connection.
+
+    Args:
+        db_path (str): Path to the SQLite database file.
+        connection (sqlite3.Connection, optional): Open connection to the database, left open.
+            By default a connection is opened and closed.
+
+    Returns:
+        Schema: The schema metadata of the database.
+
+    Raises:
+        sqlite3.Error: If the database cannot be read.
+    """
+    conn = connection or sqlite3.connect(db_path)
+    try:
+        cursor = conn.cursor()
+
+        # Query the sqlite_master table to get the names and DDL statements for all tables
+        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table';")
+        table_ddl = dict(cursor.fetchall())
+
+        # Extract columns for each table
+        tables = {}
+        for table_name in table_ddl:
+            cursor.execute(f'PRAGMA table_info("{table_name}")')
+            tables[table_name] = [
+                col[1] for col in cursor.fetchall()
+            ]  # col[1] is the column name
+        cursor.close()
+    finally:
+        if connection is None:
+            conn.close()
+    return Schema(table_ddl, tables)
+
+
+class SchemaCatalog:
+    """
+    Process-wide cache of database schemas shared by Text2SQL and SQLCFG.
+
+    Every database is read once; later lookups are served from memory until the file
+    changes. Entries are keyed by the database path and invalidated when the file
+    modification time or size changes.
+    """
+
+    def __init__(self):
+        """
+        Initializes the SchemaCatalog object.
+        """
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, db_path, connection=None):
+        """
+        Retrieves the schema of a database, reading it only if it is not cached or changed.
+
+        Args:
+            db_path (str): Path to the SQLite database file.
+            connection (sqlite3.Connection, optional): Open connection used if the database
+                has to be read.
+
+        Returns:
+            Schema: The schema metadata of the database.
+
+        Raises:
+            sqlite3.Error: If the database has to be read and cannot be.
+        """
+        path = os.path.abspath(db_path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # let sqlite report the missing or unreadable file
+            return load_schema(db_path, connection)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+
+        schema = load_schema(db_path, connection)
+        with self.lock:
+            self.misses += 1
+            self.entries[path] = (version, schema)
+        return schema
+
+    def stats(self):
+        """
+        Reports the catalog counters.
+
+        Returns:
+            dict: Hits, misses (database reads), hit rate and number of cached schemas.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.entries),
+        }
+
+
+_schema_catalog = SchemaCatalog()
+
+
+def get_schema_catalog():
+    """
+    Returns the schema catalog shared by all components of the process.
+
+    Returns:
+        SchemaCatalog: The shared schema catalog.
+    """
+    return _schema_catalog
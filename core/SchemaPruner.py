@@ -0,0 +1,140 @@
+import re
+
+from core.SchemaCatalog import Schema
+
+# frequent question words that would match unrelated identifiers
+STOPWORDS = set(
+    "a all an and are as at by different do does each find for from give have how in is "
+    "list many me of on or show than that the their there to was were what when where "
+    "which who whose with".split()
+)
+
+
+def stem(word):
+    """
+    Reduces a lowercase word to a crude singular form.
+
+    Args:
+        word (str): The word.
+
+    Returns:
+        str: The word without a plural ending.
+    """
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def name_tokens(name):
+    """
+    Splits an identifier (snake_case, camelCase or with digits) into stemmed lowercase words.
+
+    Args:
+        name (str): The table or column name.
+
+    Returns:
+        set: The words of the identifier.
+    """
+    words = re.findall(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+", name)
+    return {stem(word.lower()) for word in words}
+
+
+def question_tokens(question):
+    """
+    Splits a question into stemmed lowercase words, without stopwords.
+
+    Args:
+        question (str): The natural language question.
+
+    Returns:
+        set: The words of the question.
+    """
+    words = re.findall(r"[a-z0-9]+", question.lower())
+    return {stem(word) for word in words if word not in STOPWORDS}
+
+
+def referenced_tables(table_sql):
+    """
+    Extracts the tables referenced by the foreign keys of a CREATE TABLE statement.
+
+    Args:
+        table_sql (str): The CREATE TABLE statement.
+
+    Returns:
+        set: The lowercase names of the referenced tables.
+    """
+    return {
+        name.lower()
+        for name in re.findall(
+            r"REFERENCES\s+[\"`\[]?(\w+)", table_sql or "", flags=re.IGNORECASE
+        )
+    }
+
+
+class SchemaPruner:
+    """
+    Selects the tables of a schema relevant to a question by lexical matching.
+
+    A table is kept if a word of the question matches a word of its name or of one of its
+    column names. Tables referenced by the foreign keys of kept tables are kept as well, so
+    that the joins between them can still be written. If nothing matches, the full schema is
+    kept. Kept tables keep all their columns, so the pruned DDL and the pruned grammar offer
+    exactly the same columns.
+
+    Args:
+        expand_foreign_keys (bool, optional): Whether tables referenced by kept tables are kept.
+    """
+
+    def __init__(self, expand_foreign_keys=True):
+        """
+        Initializes the SchemaPruner object.
+        """
+        self.expand_foreign_keys = expand_foreign_keys
+
+    def select_tables(self, question, schema):
+        """
+        Selects the tables relevant to a question.
+
+        Args:
+            question (str): The natural language question.
+            schema (Schema): The full schema of the database.
+
+        Returns:
+            list: The names of the kept tables, in schema order.
+        """
+        words = question_tokens(question)
+        selected = {
+            table
+            for table, columns in schema.tables.items()
+            if words & name_tokens(table)
+            or any(words & name_tokens(column) for column in columns)
+        }
+        if not selected:
+            return list(schema.tables)
+
+        if self.expand_foreign_keys:
+            by_name = {table.lower(): table for table in schema.tables}
+            for table in list(selected):
+                for referenced in referenced_tables(schema.table_ddl.get(table)):
+                    if referenced in by_name:
+                        selected.add(by_name[referenced])
+        return [table for table in schema.tables if table in selected]
+
+    def prune(self, question, schema):
+        """
+        Reduces a schema to the tables relevant to a question.
+
+        Args:
+            question (str): The natural language question.
+            schema (Schema): The full schema of the database.
+
+        Returns:
+            Schema: The reduced schema, whose ddl property is the reduced DDL string.
+        """
+        tables = self.select_tables(question, schema)
+        return Schema(
+            {table: schema.table_ddl[table] for table in tables},
+            {table: schema.tables[table] for table in tables},
+        )
@@ -0,0 +1,195 @@
+import math
+import multiprocessing
+import os
+import queue
+import traceback
+
+import torch
+from tqdm import tqdm
+
+from core.PredictionWriter import (
+    PredictionWriter,
+    ordered_predictions,
+    read_predictions,
+    write_answers,
+    write_predictions,
+)
+from core.Text2SQL import load_questions
+
+
+def shard_questions(questions, shards):
+    """
+    Splits questions into balanced shards, keeping the questions of a database together.
+
+    Databases are cut into chunks of at most ceil(len(questions) / shards) questions, and the
+    chunks are assigned, largest first, to the shard with the fewest questions. Most databases
+    therefore end up in a single shard, whose worker reuses their schema, grammar and prompt
+    prefix, while no shard gets more than its share.
+
+    Args:
+        questions (list): Question dictionaries with "id", "db_id" and "question" keys.
+        shards (int): Number of shards.
+
+    Returns:
+        list: One list of questions per shard, possibly empty.
+    """
+    groups = {}
+    for question in questions:
+        groups.setdefault(question["db_id"], []).append(question)
+
+    size = max(1, math.ceil(len(questions) / shards))
+    chunks = [
+        group[start : start + size]
+        for group in groups.values()
+        for start in range(0, len(group), size)
+    ]
+    result = [[] for _ in range(shards)]
+    for chunk in sorted(chunks, key=len, reverse=True):
+        min(result, key=len).extend(chunk)
+    return result
+
+
+def _run_shard(factory, shard, device, threads, questions, results):
+    """
+    Answers the questions of one shard in a worker process and streams the answers back.
+
+    This is a private helper method, the target of the worker processes.
+    """
+    # restrict the worker to its GPU (or to the CPU) before the model is loaded
+    os.environ["CUDA_VISIBLE_DEVICES"] = "" if device is None else str(device)
+    if device is None:
+        torch.set_num_threads(threads)
+    try:
+        text2sql = factory()
+        ordered = text2sql.scheduler.order(questions)
+        for start in range(0, len(ordered), text2sql.batch_size):
+            batch = ordered[start : start + text2sql.batch_size]
+            results.put(("answers", shard, text2sql.answer_batch(batch)))
+        results.put(("done", shard, text2sql.cache_stats()))
+    except Exception:
+        results.put(("error", shard, traceback.format_exc()))
+
+
+class ShardedInference:
+    """
+    Answers a question file with several worker processes, each with its own model replica.
+
+    This class handles:
+        * Splitting the questions into shards, grouped by database (see shard_questions).
+        * Starting one worker process per shard, pinned to one GPU or sharing the CPU cores.
+        * Streaming the answers of all workers back through a queue into a single JSONL output.
+        * Writing output.json and output.txt in question id order, as a single process does.
+
+    Workers are started with the "spawn" method, so the factory must be picklable, e.g. a
+    module-level function or a functools.partial of one.
+
+    Args:
+        factory (callable): Builds the Text2SQL object of a worker, called in the worker.
+        workers (int, optional): Number of worker processes on the CPU, ignored if devices
+            are given.
+        devices (list, optional): CUDA device index of every worker, one worker per entry.
+        sync_every (int, optional): Number of answers between flushes of the JSONL output.
+    """
+
+    def __init__(self, factory, workers=1, devices=None, sync_every=1):
+        """
+        Initializes the ShardedInference object.
+        """
+        self.factory = factory
+        self.devices = list(devices) if devices else [None] * workers
+        self.sync_every = sync_every
+
+    def predict(self, questions_file, predicted_path, resume=False):
+        """
+        Answers all questions of a file and writes the outputs of the run.
+
+        Args:
+            questions_file (str): Path to the JSON file containing questions.
+            predicted_path (str): Directory of the output.jsonl, output.json and output.txt files.
+            resume (bool, optional): Whether to skip the questions already answered in the JSONL
+                output of an interrupted run.
+
+        Raises:
+            RuntimeError: If a worker failed. The answers of the other workers are kept in
+                the JSONL output, so the run can be completed with resume.
+        """
+        os.makedirs(predicted_path, exist_ok=True)
+        jsonl_output = os.path.join(predicted_path, "output.jsonl")
+        json_output = os.path.join(predicted_path, "output.json")
+        txt_output = os.path.join(predicted_path, "output.txt")
+
+        questions = load_questions(questions_file)
+        if resume and os.path.exists(jsonl_output):
+            answered = {answer["id"] for answer in read_predictions(jsonl_output)}
+            print(f"Resuming: skipping {len(answered)} answered questions")
+            questions = [
+                question for question in questions if question["id"] not in answered
+            ]
+
+        shards = shard_questions(questions, len(self.devices))
+        # CPU workers split the cores instead of oversubscribing them
+        cpu_workers = sum(device is None for device in self.devices)
+        threads = max(1, (os.cpu_count() or 1) // max(1, cpu_workers))
+
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        processes = {}
+        for shard, (device, assigned) in enumerate(zip(self.devices, shards)):
+            if not assigned:
+                continue
+            process = context.Process(
+                target=_run_shard,
+                args=(self.factory, shard, device, threads, assigned, results),
+            )
+            process.start()
+            processes[shard] = process
+        print(
+            f"Answering {len(questions)} questions with {len(processes)} workers: "
+            + ", ".join(f"shard {shard} {len(shards[shard])}" for shard in processes)
+        )
+
+        pending = set(processes)
+        failures = {}
+        with PredictionWriter(
+            jsonl_output, self.sync_every, resume=resume
+        ) as writer, tqdm(
+            total=len(questions), desc=f"Answering {len(questions)} questions"
+        ) as progress:
+            while pending:
+                try:
+                    kind, shard, payload = results.get(timeout=1.0)
+                except queue.Empty:
+                    # a worker killed by the OS (e.g. out of memory) sends nothing
+                    for shard in list(pending):
+                        exitcode = processes[shard].exitcode
+                        if exitcode not in (None, 0):
+                            failures[shard] = f"exit code {exitcode}"
+                            pending.discard(shard)
+                    continue
+                if kind == "answers":
+                    for answer in payload:
+                        writer.write(answer)
+                    progress.update(len(payload))
+                elif kind == "done":
+                    print(f"Shard {shard} cache stats: {payload}")
+                    pending.discard(shard)
+                else:
+                    failures[shard] = payload
+                    pending.discard(shard)
+        for process in processes.values():
+            process.join()
+        print("Predictions streamed to ", jsonl_output)
+
+        if failures:
+            for shard, error in failures.items():
+                print(f"Shard {shard} failed: {error}")
+            raise RuntimeError(
+                f"{len(failures)} of {len(processes)} workers failed, "
+                "run again with --resume to answer their questions"
+            )
+
+        answers = ordered_predictions(jsonl_output)
+        write_predictions(answers, json_output)
+        print("Predictions saved to ", json_output)
+        write_answers(answers, txt_output)
+        print(f"Answers written to {txt_output}")
@@ -2,24 +2,38 @@ import json
 import os
 import re
 import sqlite3
-import time
 from pathlib import Path
 
 import torch
 from tqdm import tqdm
-from transformers_cfg.generation.logits_process import GrammarConstrainedLogitsProcessor
-from transformers_cfg.grammar_utils import IncrementalGrammarConstraint
 
 from transformers import (
     AutoModelForCausalLM,
     AutoTokenizer,
     BitsAndBytesConfig,
-    pipeline,
     set_seed,
 )
 
+from core.ConstrainedDecoding import BatchGrammarLogitsProcessor
+from core.GenerationEngine import PREFIX_MARKER, GenerationEngine
+from core.GrammarCache import GrammarCache, compiled_grammar_path
+from core.PredictionWriter import (
+    PredictionWriter,
+    ordered_predictions,
+    read_predictions,
+    write_answers,
+    write_predictions,
+)
+from core.QuestionScheduler import QuestionScheduler
+from core.SchemaCatalog import get_schema_catalog
+from core.SQLiteAccess import MirrorsExhausted, get_sqlite_access
+from core.SQLiteExec import QueryLimits, QueryTimeout, validate_query
+from core.TokenMaskCache import TokenMaskCache
+
 set_seed(12)
 
+QUANTIZATION_MODES = ("auto", "4bit", "none")
+
 
 def remove_data_types(sql_definition):
     # Regex to find the column definitions and retain only the column names
@@ -71,6 +85,39 @@ def keep_after_last_occurrence(input_str: str) -> str:
     return input_str[last_index + len(search_str) :]
 
 
+def load_questions(questions_file):
+    """
+    Reads the questions of a JSON file, numbering them in file order.
+
+    Args:
+        questions_file (str): Path to the JSON file containing questions.
+
+    Returns:
+        list: Question dictionaries with "id", "db_id" and "question" keys.
+    """
+    # read the questions from the json file
+    with open(questions_file, "r") as file:
+        json_questions = json.load(file)
+
+    # add an id to each question in jsson_questions
+    for i, question in enumerate(json_questions):
+        question["id"] = i
+
+    # extract id, db_id, and question from the json file
+    questions = []
+    for question in json_questions:
+        questions.append(
+            {
+                "id": question["id"],
+                "db_id": question[
+                    "db_id"
+                ],  # "db_id" is the key for the database id in the json file
+                "question": question["question"],
+            }
+        )
+    return questions
+
+
 class Text2SQL:
     """
     Converts natural language questions into SQL queries using an LLM.
@@ -79,7 +126,7 @@ class Text2SQL:
         * Initialization of the LLM and tokenizer
         * Loading of questions and grammars
         * Generation of SQL answers
-        * Output management (JSON, TXT)
+        * Output management (JSONL, JSON, TXT)
     """
 
     def __init__(
@@ -89,6 +136,23 @@ class Text2SQL:
         grammar_directory=None,
         db_directory=None,
         prompt_template=None,
+        batch_size=1,
+        max_new_tokens=None,
+        schema_catalog=None,
+        sync_every=1,
+        query_limits=None,
+        validation_mode="execute",
+        immutable=False,
+        sqlite_access=None,
+        prefix_cache=True,
+        schedule="db_id",
+        schema_pruner=None,
+        sql_grammar=None,
+        grammar_provider=None,
+        jump_forward=False,
+        stop_at_statement_end=True,
+        sql_validator=None,
+        quantization="auto",
     ):
         """
         Initializes the Text2SQL object.
@@ -99,37 +163,127 @@ class Text2SQL:
             grammar_directory (str, optional): Path to grammar files (if used).
             db_directory (str, optional): Path to SQLite database files (if used).
             prompt_template (str, optional): Template for formatting question prompts.
+            batch_size (int, optional): Number of questions generated together in one padded batch.
+            max_new_tokens (int, optional): Fixed generation budget per attempt. By default it is
+                derived from the tokenized prompt length.
+            schema_catalog (SchemaCatalog, optional): Schema cache, shared process-wide by default.
+            sync_every (int, optional): Number of answers between flushes of the JSONL output to disk.
+            query_limits (QueryLimits, optional): Execution budget of every generated query.
+            validation_mode (str, optional): "execute" runs generated queries, "explain" only
+                prepares them.
+            immutable (bool, optional): Whether databases are opened with immutable=1.
+            sqlite_access (SQLiteAccess, optional): Database access layer, shared process-wide
+                by default.
+            prefix_cache (bool, optional): Whether the KV states of the prompt prefix shared by
+                the questions over a database are cached and reused.
+            schedule (str, optional): Order in which questions are processed, one of
+                SCHEDULING_POLICIES.
+            schema_pruner (SchemaPruner, optional): Reduces the schema in the prompt (and the
+                embedded grammar) to the tables relevant to each question.
+            sql_grammar (SQLCFG, optional): Grammar generator used to build the embedded
+                grammar of a pruned schema.
+            grammar_provider (GrammarProvider, optional): Builds the embedded grammar of a
+                database on its first question, instead of reading pre-built grammar files.
+            jump_forward (bool, optional): Whether tokens forced by the grammar are appended
+                without a forward pass of their own (see GenerationEngine.decode_jump_forward).
+            stop_at_statement_end (bool, optional): Whether generation stops once the query is
+                complete: at the accept state of the grammar, or at the end of the first
+                complete statement when unconstrained.
+            sql_validator (SQLValidator, optional): Checks generated queries against the
+                schema before they are run, rejecting invalid ones without opening the database.
+            quantization (str, optional): One of QUANTIZATION_MODES: "4bit" loads the model
+                quantized with bitsandbytes, "none" in full precision, and "auto" quantizes
+                only when CUDA is available.
         """
-        bnb_config = BitsAndBytesConfig(
-            load_in_4bit=True,
-            bnb_4bit_use_double_quant=True,
-            bnb_4bit_quant_type="nf4",
-            bnb_4bit_compute_dtype=torch.bfloat16,
-        )
-        print("Loading Quantization model")
-
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode: {quantization}")
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         print(f"Using device: {self.device}")
         print(torch.cuda.is_available())
 
         self.tokenizer = AutoTokenizer.from_pretrained(model_id)
         self.tokenizer.pad_token = self.tokenizer.eos_token
+        # decoder-only models need left padding for batched generation
+        self.tokenizer.padding_side = "left"
 
-        self.llm = AutoModelForCausalLM.from_pretrained(
-            model_id, quantization_config=bnb_config, device_map="auto"
-        )
-        #self.llm = AutoModelForCausalLM.from_pretrained(model_id).to(self.device)
+        # bitsandbytes 4-bit kernels need a GPU, on the CPU the model is loaded in full precision
+        if quantization == "4bit" or (
+            quantization == "auto" and torch.cuda.is_available()
+        ):
+            bnb_config = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_use_double_quant=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.bfloat16,
+            )
+            print("Loading Quantization model")
+            self.llm = AutoModelForCausalLM.from_pretrained(
+                model_id, quantization_config=bnb_config, device_map="auto"
+            )
+        else:
+            print("Loading full precision model")
+            self.llm = AutoModelForCausalLM.from_pretrained(model_id).to(self.device)
 
         # if model_id contains "instruct" set Instruction to True
         self.instruct = False
         if "instruct" in model_id.lower():
             self.instruct = True
+
+        # allowed-token masks of grammar states are shared by all generations
+        self.mask_cache = TokenMaskCache()
+        # the generation engine is built once and reused for every attempt
+        self.engine = GenerationEngine(
+            self.llm,
+            self.tokenizer,
+            instruct=self.instruct,
+            system_prompt="Your role is a natural language to SQL translator who is an expert in writing SQL queries in SQLite dialect. For the given schema, output the SQL query you need to answer the problem.",
+            jump_forward=jump_forward and grammar_directory is not None,
+            mask_cache=self.mask_cache,
+            stop_at_statement_end=stop_at_statement_end,
+        )
+        self.max_new_tokens = max_new_tokens
+        # compiled grammar constraints are reused across questions and attempts
+        self.grammar_cache = GrammarCache()
+        # new tokens per prompt token, equivalent to the former max_length = len(prompt) / 2.8
+        self.new_tokens_ratio = 0.35
         self.questions = []
         self.grammar_directory = grammar_directory
         self.json_output = predicted_path + "/output.json"
+        self.jsonl_output = predicted_path + "/output.jsonl"
         self.txt_output = predicted_path + "/output.txt"
         self.prompt_template = prompt_template
         self.db_directory = db_directory
+        self.batch_size = batch_size
+        self.schema_catalog = schema_catalog or get_schema_catalog()
+        self.sync_every = sync_every
+        self.query_limits = query_limits or QueryLimits()
+        self.validation_mode = validation_mode
+        self.immutable = immutable
+        self.sqlite_access = sqlite_access or get_sqlite_access()
+        self.prefix_cache = prefix_cache
+        self.scheduler = QuestionScheduler(schedule)
+        self.schema_pruner = schema_pruner
+        self.sql_grammar = sql_grammar
+        self.grammar_provider = grammar_provider
+        self.sql_validator = sql_validator
+        self.pruning_stats = {
+            "questions": 0,
+            "tables": 0,
+            "full_tables": 0,
+            "ddl_tokens": 0,
+            "full_ddl_tokens": 0,
+            "grammar_bytes": 0,
+            "full_grammar_bytes": 0,
+        }
+        # DDL token counts of the full schemas, keyed by database ID
+        self.full_ddl_tokens = {}
+        # grammars of pruned schemas, keyed by database ID and kept tables
+        self.pruned_grammars = {}
+        # sizes of the full embedded grammars, keyed by database ID
+        self.full_grammar_bytes = {}
+        # generated tokens versus tokens of the cleaned answers
+        self.generated_tokens = 0
+        self.kept_tokens = 0
 
         # Ensure the predicted_path exists
         os.makedirs(os.path.dirname(self.json_output), exist_ok=True)
@@ -143,25 +297,7 @@ class Text2SQL:
             questions_file (str): Path to the JSON file containing questions.
         """
         print("Reading questions from ", questions_file)
-        # read the questions from the json file
-        with open(questions_file, "r") as file:
-            json_questions = json.load(file)
-
-        # add an id to each question in jsson_questions
-        for i, question in enumerate(json_questions):
-            question["id"] = i
-
-        # extract id, db_id, and question from the json file
-        for question in json_questions:
-            self.questions.append(
-                {
-                    "id": question["id"],
-                    "db_id": question[
-                        "db_id"
-                    ],  # "db_id" is the key for the database id in the json file
-                    "question": question["question"],
-                }
-            )
+        self.questions.extend(load_questions(questions_file))
 
     def get_embedded_grammar(self, db_id):
         """
@@ -173,6 +309,9 @@ class Text2SQL:
         Returns:
             str: The embedded grammar as a string, or None if not found.
         """
+        if self.grammar_provider:
+            return self.grammar_provider.get(db_id)
+        grammar = None
         if self.grammar_directory:
             grammar_path = os.path.join(self.grammar_directory, f"{db_id}.ebnf")
 
@@ -196,255 +335,306 @@ class Text2SQL:
                     grammar = file.read()
         return grammar
 
-    def get_ddl_statements_with_retries(
-        self, database_path, max_retries=15, max_directories=15
-    ):
-        def get_ddl_statements(database_path):
-            """
-            Retrieves DDL statements for all tables in an SQLite database.
-
-            Args:
-                database_path (str): Path to the SQLite database file.
-
-            Returns:
-                str: Concatenated DDL statements for all tables.
-            """
-            # Connect to the SQLite database
-            conn = sqlite3.connect(database_path)
-            cursor = conn.cursor()
-
-            # Query the sqlite_master table to get the names and DDL statements for all tables
-            cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table';")
-            tables = cursor.fetchall()
-
-            # Close the connection
-            conn.close()
-
-            # Join all the DDL statements into a single string
-            ddl_statements = ""
-            for table in tables:
-                ddl_statements += table[1] + "\n"
-
-            return ddl_statements
-
-        retries = 0
-        base_path, db_name = os.path.split(database_path)
-
-        while retries < max_retries:
-            try:
-                ddl_statements = get_ddl_statements(database_path)
-                return ddl_statements
-            except sqlite3.OperationalError as e:
-                if "disk I/O error" in str(e):
-                    retries += 1
-                    time.sleep(1)
-                    continue
-                else:
-                    return f"OperationalError: {e}"
-            except sqlite3.DatabaseError as e:
-                if "database disk image is malformed" in str(e):
-                    retries += 1
-                    time.sleep(1)
-                    continue
-                else:
-                    return f"DatabaseError: {e}"
-
-        for i in range(2, max_directories + 1):
-            new_base_path = f"{base_path}{i}"
-            new_db_path = os.path.join(new_base_path, db_name)
-            retries = 0
-            while retries < max_retries:
-                try:
-                    ddl_statements = get_ddl_statements(new_db_path)
-                    return ddl_statements
-                except sqlite3.OperationalError as e:
-                    if "disk I/O error" in str(e):
-                        retries += 1
-                        print("Retrying", retries, "error:", str(e))
-                        time.sleep(1)
-                        continue
-                    else:
-                        return f"OperationalError: {e}"
-                except sqlite3.DatabaseError as e:
-                    if "database disk image is malformed" in str(e):
-                        retries += 1
-                        print("Retrying", retries, "error:", str(e))
-                        time.sleep(1)
-                        continue
-                    else:
-                        return f"DatabaseError: {e}"
+    def get_schema_with_retries(self, database_path):
+        """
+        Retrieves the schema of an SQLite database from the schema catalog.
 
-        return f"Failed after trying {max_directories} directories"
+        Transient errors are retried on the database mirrors by the SQLite access layer.
 
-    def execute_sql_query_with_retries(
-        self, query: str, db_path: str, max_retries=15, max_directories=15
-    ):
-        def execute_sql_query(query: str, db_path: str):
-            try:
-                # Connect to the SQLite database
-                conn = sqlite3.connect(db_path)
-                cursor = conn.cursor()
-
-                # Execute the SQL query
-                cursor.execute(query)
-
-                # Commit the changes
-                conn.commit()
-
-                # Close the connection
-                conn.close()
-
-                return None
-            except sqlite3.Error as e:
-                return str(e)
-
-        retries = 0
-        base_path, db_name = os.path.split(db_path)
-
-        while retries < max_retries:
-            error = execute_sql_query(query, db_path)
-            if error is None:
-                return None
-            elif (
-                "disk I/O error" in error
-                or "database disk image is malformed" in error
-                or "unable to open database file" in error
-            ):
-                retries += 1
-                print("Retrying", retries, "error:", error)
-                time.sleep(1)
-                continue
-            else:
-                return error
-
-        for i in range(2, max_directories + 1):
-            new_base_path = f"{base_path}{i}"
-            new_db_path = os.path.join(new_base_path, db_name)
-            retries = 0
-            while retries < max_retries:
-                error = execute_sql_query(query, new_db_path)
-                if error is None:
-                    return None
-                elif (
-                    "disk I/O error" in error
-                    or "database disk image is malformed" in error
-                    or "unable to open database file" in error
-                ):
-                    retries += 1
-                    time.sleep(1)
-                    continue
-                else:
-                    return error
+        Args:
+            database_path (str): Path to the SQLite database file.
+
+        Returns:
+            Schema: The schema of the database, or an error message.
+        """
+        try:
+            return self.sqlite_access.run(
+                database_path,
+                lambda conn, path: self.schema_catalog.get(path, conn),
+                self.immutable,
+            )
+        except MirrorsExhausted as e:
+            return str(e)
+        except sqlite3.OperationalError as e:
+            return f"OperationalError: {e}"
+        except sqlite3.DatabaseError as e:
+            return f"DatabaseError: {e}"
+
+    def get_ddl_statements_with_retries(self, database_path):
+        """
+        Retrieves DDL statements for all tables in an SQLite database from the schema catalog.
+
+        Args:
+            database_path (str): Path to the SQLite database file.
 
-        # Return None if the last attempt still gives disk error or database malformed error
-        return None
+        Returns:
+            str: Concatenated DDL statements for all tables, or an error message.
+        """
+        schema = self.get_schema_with_retries(database_path)
+        return schema if isinstance(schema, str) else schema.ddl
 
-    def get_answers(self):
+    def execute_sql_query_with_retries(self, query: str, db_path: str):
         """
-        Generates SQL answers for each question and saves them in JSON format.
+        Validates a generated query on a read-only connection, retrying on disk errors.
+
+        Depending on the validation mode, the query is executed within the execution budget
+        or only prepared with EXPLAIN. Nothing is ever written to the database. Transient
+        errors are retried on the database mirrors by the SQLite access layer.
+
+        A query exceeding its budget is not retried; its timeout message is returned like
+        any other error so that the repair prompt asks for a cheaper query.
+
+        Args:
+            query (str): The SQL query.
+            db_path (str): Path to the SQLite database file.
+
+        Returns:
+            str: The error message, or None if the query succeeded.
         """
-        print("NL2SQL")
-        if self.instruct:
-            print("Instruction mode enabled")
-        # Create a dictionary to store the answers
-        answers_list = []
+        try:
+            # Run (or only prepare) the SQL query within the budget
+            self.sqlite_access.run(
+                db_path,
+                lambda conn, path: validate_query(
+                    conn, query, self.query_limits, self.validation_mode
+                ),
+                self.immutable,
+            )
+            return None
+        except MirrorsExhausted:
+            # the database is unreadable on every mirror, which is not an error of the query
+            return None
+        except QueryTimeout as e:
+            return str(e)
+        except sqlite3.Error as e:
+            return str(e)
+
+    def check_answer(self, query, db_path, schema):
+        """
+        Checks a generated query, statically against the schema first if a validator is set.
 
-        # iterate over the questions dictionary
-        for question in tqdm(
-            self.questions, desc=f"Answering {len(self.questions)} questions"
-        ):
-            outputs_history = []
-            # get the answer for each question
-            question_id = question["id"]
-            question_db = question["db_id"]
-            user_question = question["question"]
+        A query rejected by the validator is not run: the issues found take the place of the
+        SQLite error message, and name the misplaced clause or the unknown table or column
+        together with the closest names of the schema for the repair prompt.
+
+        Args:
+            query (str): The SQL query.
+            db_path (str): Path to the SQLite database file.
+            schema (Schema): The schema of the database from the schema catalog, or the error
+                message that replaced it.
+
+        Returns:
+            str: The error message, or None if the query succeeded.
+        """
+        if self.sql_validator is not None and not isinstance(schema, str):
+            issues = self.sql_validator.validate(query, schema)
+            if issues:
+                return "; ".join(str(issue) for issue in issues)
+        return self.execute_sql_query_with_retries(query, db_path)
+
+    def get_grammar_constraint(self, db_id, schema=None):
+        """
+        Retrieves the compiled grammar constraint used to decode answers for a specific database.
+
+        Args:
+            db_id (str): Identifier for the database.
+            schema (dict, optional): Pruned schema (table names mapped to column names). With
+                embedded grammars, the grammar of this schema is generated instead of loading
+                the grammar of the full database.
+
+        Returns:
+            IncrementalGrammarConstraint: The grammar constraint, or None if no grammar is used.
+        """
+        # if grammar_directory is a directory get_embedded_grammar if grammar_directory is a file get_base_grammar
+        if not self.grammar_directory:
+            return None
+        grammar_path = Path(self.grammar_directory)
+        if grammar_path.is_dir() and schema is not None and self.sql_grammar:
+            # pruned grammars are cached in memory only, keyed by their text
+            grammar_str = self.get_pruned_grammar(db_id, schema)
+            return self.grammar_cache.get(grammar_str, self.tokenizer)
+        if grammar_path.is_dir():
+            grammar_str = self.get_embedded_grammar(db_id)
+            grammar_file = os.path.join(self.grammar_directory, f"{db_id}.ebnf")
+        elif grammar_path.is_file():
+            grammar_str = self.get_base_grammar()
+            grammar_file = self.grammar_directory
+        if grammar_str is None:
+            print(f"No grammar for {db_id}, decoding without constraint")
+            return None
+        # the precompiled artifact next to the grammar file is used instead of recompiling
+        return self.grammar_cache.get(
+            grammar_str, self.tokenizer, compiled_grammar_path(grammar_file)
+        )
+
+    def get_prompt_prefix(self, db_id, schema, tables=None):
+        """
+        Builds the part of the prompt shared by every question (and repair) over a database.
+
+        The prefix is the prompt template rendered with the schema, up to the question. Its KV
+        states are cached by the generation engine under the database ID and template.
+
+        Args:
+            db_id (str): The database identifier.
+            schema (str): The DDL statements of the database.
+            tables (tuple, optional): The tables kept by schema pruning.
+
+        Returns:
+            tuple: The (key, prefix) pair, or None if the prefix cache is disabled or there is
+                no shared prefix.
+        """
+        if not self.prefix_cache:
+            return None
+        prefix = ""
+        if self.prompt_template:
+            prefix = self.prompt_template.format(
+                question=PREFIX_MARKER, schema=schema
+            ).split(PREFIX_MARKER)[0]
+        # in instruction mode the system prompt is shared even without a template
+        if not prefix and not self.instruct:
+            return None
+        return (db_id, self.prompt_template, tables), prefix
+
+    def generate(self, prompts, db_ids, prefixes=None, schemas=None):
+        """
+        Generates one answer per prompt in a single padded batch.
+
+        Every sequence gets its own grammar constraint state, so questions over different
+        databases (and therefore different embedded grammars) can share a batch.
+
+        Args:
+            prompts (list): The prompts to complete.
+            db_ids (list): The database identifier of each prompt.
+            prefixes (list, optional): The cached prompt prefix of each prompt, see
+                get_prompt_prefix.
+            schemas (list, optional): The pruned schema of each prompt, or None to decode with
+                the grammar of the full database.
+
+        Returns:
+            list: One (answer, full_answer) tuple per prompt. full_answer is None outside instruction mode.
+        """
+        # derive the generation budget from the real prompt length instead of len(prompt) / 2.8
+        max_new_tokens = self.max_new_tokens or max(
+            1,
+            max(
+                int(self.engine.count_tokens(prompt) * self.new_tokens_ratio)
+                for prompt in prompts
+            ),
+        )
+        print(f"max_new_tokens: {max_new_tokens}")
 
+        logits_processor = None
+        row_constraints = None
+        if self.grammar_directory:
+            # questions over the same database share one constraint; each row keeps its own parsing state
+            schemas = schemas or [None] * len(prompts)
+            keys = [
+                (db_id, tuple(schema) if schema is not None else None)
+                for db_id, schema in zip(db_ids, schemas)
+            ]
+            constraints = {}
+            for key, schema in zip(keys, schemas):
+                if key not in constraints:
+                    constraints[key] = self.get_grammar_constraint(key[0], schema)
+            row_constraints = [constraints[key] for key in keys]
+            logits_processor = [
+                BatchGrammarLogitsProcessor(row_constraints, self.mask_cache)
+            ]
+
+        completions = self.engine.generate(
+            prompts, max_new_tokens, logits_processor, prefixes, row_constraints
+        )
+
+        # get output
+        outputs = []
+        for prompt, completion in zip(prompts, completions):
+            if self.instruct:
+                outputs.append((completion, prompt + " " + completion))
+            else:
+                outputs.append((prompt + completion, None))
+        return outputs
+
+    def answer_batch(self, questions):
+        """
+        Answers a batch of questions, generating first attempts together and repair attempts together.
+
+        Args:
+            questions (list): Question dictionaries with "id", "db_id" and "question" keys.
+
+        Returns:
+            list: One answer dictionary per question, in the same order as the questions.
+        """
+        states = []
+        for question in questions:
             db_path = os.path.join(
-                self.db_directory, question_db, f"{question_db}.sqlite"
+                self.db_directory, question["db_id"], f"{question['db_id']}.sqlite"
             )
-            schema = self.get_ddl_statements_with_retries(db_path)
+            schema = self.get_schema_with_retries(db_path)
+            pruned = None
+            if isinstance(schema, str):
+                # the error message takes the place of the schema, as before
+                ddl = schema
+            elif self.schema_pruner:
+                pruned = self.schema_pruner.prune(question["question"], schema)
+                ddl = pruned.ddl
+                self.record_pruning(question["db_id"], schema, pruned)
+            else:
+                ddl = schema.ddl
 
-            prompt = user_question
+            prompt = question["question"]
             if self.prompt_template:
                 prompt = self.prompt_template.format(
-                    question=user_question, schema=schema
+                    question=question["question"], schema=ddl
                 )
+            states.append(
+                {
+                    "question": question,
+                    "db_path": db_path,
+                    # repair prompts start with the first prompt, so they share its prefix
+                    "prefix": self.get_prompt_prefix(
+                        question["db_id"],
+                        ddl,
+                        tuple(pruned.tables) if pruned is not None else None,
+                    ),
+                    "schema": pruned.tables if pruned is not None else None,
+                    "catalog_schema": schema,
+                    "last_prompt": prompt,
+                    "outputs_history": [],
+                    "answer": None,
+                }
+            )
 
-            attempts = 2
-            last_prompt = prompt
-
-            while attempts > 0:
-                print(f"Question: {user_question}")
-                print(f"Attempt: {3-attempts}")
-                print(f"Prompt: {last_prompt}")
-                print(f"length: {int(len(last_prompt)/2.8)}")
-
-                pipe = pipeline(
-                    "text-generation",
-                    model=self.llm,
-                    tokenizer=self.tokenizer,
-                    device_map="auto",
-                    max_length=int(len(last_prompt) / 2.8),
-                    batch_size=2,
-                )
-                messages = [last_prompt]
-
-                if self.instruct:
-                    messages = [
-                        {
-                            "role": "system",
-                            "content": "Your role is a natural language to SQL translator who is an expert in writing SQL queries in SQLite dialect. For the given schema, output the SQL query you need to answer the problem.",
-                        },
-                        {"role": "user", "content": last_prompt},
-                    ]
-
-                # if grammar_directory is a directory get_embedded_grammar if grammar_directory is a file get_base_grammar
-                if self.grammar_directory:
-                    grammar_path = Path(self.grammar_directory)
-                    if grammar_path.is_dir():
-                        grammar_str = self.get_embedded_grammar(question["db_id"])
-                    elif grammar_path.is_file():
-                        grammar_str = self.get_base_grammar()
-                    grammar = IncrementalGrammarConstraint(
-                        grammar_str, "root", self.tokenizer
-                    )
-                    grammar_processor = GrammarConstrainedLogitsProcessor(grammar)
-
-                    generation = pipe(
-                        messages,
-                        do_sample=False,
-                        logits_processor=[grammar_processor],
-                        truncation=True,
-                        temperature=None,
-                        top_p=None,
-                    )
-                else:
-                    generation = pipe(
-                        messages,
-                        do_sample=False,
-                        truncation=True,
-                        temperature=None,
-                        top_p=None,
-                    )
-
-                # get output
+        attempts = 2
+        pending = states
+        for attempt in range(1, attempts + 1):
+            generations = self.generate(
+                [state["last_prompt"] for state in pending],
+                [state["question"]["db_id"] for state in pending],
+                [state["prefix"] for state in pending],
+                [state["schema"] for state in pending],
+            )
 
-                if self.instruct:
-                    answer = generation[0]["generated_text"][-1]["content"]
-                    full_answer = (
-                        generation[0]["generated_text"][-2]["content"]
-                        + " "
-                        + generation[0]["generated_text"][-1]["content"]
+            decode_stats = self.engine.last_decode_stats
+            repairs = []
+            for state, (answer, full_answer), stats in zip(
+                pending, generations, decode_stats
+            ):
+                print(f"Question: {state['question']['question']}")
+                print(f"Attempt: {attempt}")
+                print(f"Prompt: {state['last_prompt']}")
+                if stats["forward_passes"] is not None:
+                    print(
+                        f"Forward passes saved: {stats['tokens'] - stats['forward_passes']} "
+                        f"({stats['forward_passes']} passes for {stats['tokens']} tokens)"
                     )
-                    outputs_history.append(full_answer)
-                else:
-                    answer = generation[0][0]["generated_text"]
 
-                    outputs_history.append(answer)
+                state["outputs_history"].append(
+                    full_answer if self.instruct else answer
+                )
 
                 cleaned_answer = keep_after_select(answer)
 
-                if attempts == 1:
+                if attempt > 1:
                     if self.instruct:
                         cleaned_answer = keep_after_last_occurrence(full_answer)
                     else:
@@ -457,26 +647,21 @@ class Text2SQL:
                 )
 
                 print(f"Answer: {cleaned_answer}")
+                self.record_tokens(cleaned_answer, stats)
 
-                error = self.execute_sql_query_with_retries(cleaned_answer, db_path)
+                error = self.check_answer(
+                    cleaned_answer, state["db_path"], state["catalog_schema"]
+                )
 
                 print(f"Error: {error}")
-                if error is None:
-                    # store the answer in the dictionary
-                    answers_list.append(
-                        {
-                            "id": question_id,
-                            "db_id": question_db,
-                            "question": user_question,
-                            "attempts": 4 - attempts,
-                            "outputs_history": outputs_history,
-                            "answer": cleaned_answer,
-                        }
-                    )
-                    break
-                if attempts == 2:
-                    if self.instruct:
-                        last_prompt = f"""{full_answer}
+                # store the latest answer, the last attempt keeps it even if it fails
+                state["answer"] = cleaned_answer
+                state["attempts"] = attempt
+                if error is None or attempt == attempts:
+                    continue
+
+                if self.instruct:
+                    state["last_prompt"] = f"""{full_answer}
         Encountered an error: {error}. 
         To address this, please generate an alternative SQL query response that avoids this specific error. 
         Follow the instructions mentioned above to remediate the error. 
@@ -486,9 +671,9 @@ class Text2SQL:
 
         Ensure the revised SQL query aligns precisely with the requirements outlined in the initial question.
         Modified SQLite query:"""
-                    else:
-                        # Prepare the new prompt for the next iteration
-                        last_prompt = f"""{answer}
+                else:
+                    # Prepare the new prompt for the next iteration
+                    state["last_prompt"] = f"""{answer}
             Encountered an error: {error}. 
             To address this, please generate an alternative SQL query response that avoids this specific error. 
             Follow the instructions mentioned above to remediate the error. 
@@ -498,49 +683,239 @@ class Text2SQL:
 
             Ensure the revised SQL query aligns precisely with the requirements outlined in the initial question.
             Modified SQLite query:"""
-                    attempts -= 1
-
-            if attempts == 0:
-                answers_list.append(
-                    {
-                        "id": question_id,
-                        "db_id": question_db,
-                        "question": user_question,
-                        "attempts": 3 - attempts,
-                        "outputs_history": outputs_history,
-                        "answer": cleaned_answer,
-                    }
-                )
+                repairs.append(state)
+
+            pending = repairs
+            if not pending:
+                break
+
+        return [
+            {
+                "id": state["question"]["id"],
+                "db_id": state["question"]["db_id"],
+                "question": state["question"]["question"],
+                "attempts": state["attempts"],
+                "outputs_history": state["outputs_history"],
+                "answer": state["answer"],
+            }
+            for state in states
+        ]
+
+    def get_answers(self, resume=False):
+        """
+        Generates SQL answers for the questions in batches and streams them in JSONL format.
+
+        Questions are processed in the order of the scheduler (grouped by database by default)
+        and answered batch_size at a time: the first attempts of a batch are generated together,
+        then the repair attempts of the questions whose query failed. Every answer is appended
+        as one line to the JSONL output; the JSON output is written once at the end, in question
+        id order.
+
+        Args:
+            resume (bool, optional): Whether to keep the answers of an interrupted run and only
+                answer the question ids missing from the JSONL output.
+        """
+        print("NL2SQL")
+        if self.instruct:
+            print("Instruction mode enabled")
 
-            # save the answers_dict to a json file after each answer
-            with open(self.json_output, "w") as file:
-                json.dump(answers_list, file, indent=2)
+        questions = self.scheduler.order(self.questions)
+        if resume and os.path.exists(self.jsonl_output):
+            answered = {answer["id"] for answer in read_predictions(self.jsonl_output)}
+            questions = [
+                question for question in questions if question["id"] not in answered
+            ]
+            print(
+                f"Resuming: skipping {len(self.questions) - len(questions)} answered questions"
+            )
+
+        with PredictionWriter(
+            self.jsonl_output, self.sync_every, resume=resume
+        ) as writer, tqdm(
+            total=len(questions), desc=f"Answering {len(questions)} questions"
+        ) as progress:
+            for start in range(0, len(questions), self.batch_size):
+                batch = questions[start : start + self.batch_size]
+                for answer in self.answer_batch(batch):
+                    writer.write(answer)
+                progress.update(len(batch))
+        print("Predictions streamed to ", self.jsonl_output)
+
+        write_predictions(ordered_predictions(self.jsonl_output), self.json_output)
         print("Predictions saved to ", self.json_output)
+        self.report_cache_stats()
+        if self.engine.jump_forward:
+            print(f"Jump-forward decoding: {self.engine.jump_forward_stats()}")
+        print(f"Tokens: {self.token_stats()}")
+        if self.sql_validator is not None:
+            print(f"Static validation: {self.sql_validator.stats()}")
+        if self.schema_pruner:
+            self.report_pruning()
+
+    def record_tokens(self, cleaned_answer, stats):
+        """
+        Records and prints the tokens generated for an attempt versus the tokens of its answer.
+
+        Args:
+            cleaned_answer (str): The answer kept from the generated text.
+            stats (dict): The decode statistics of the attempt, from the generation engine.
+        """
+        kept = len(
+            self.tokenizer(cleaned_answer, add_special_tokens=False)["input_ids"]
+        )
+        # the answer may start in the prompt, only generated tokens can be kept
+        kept = min(kept, stats["tokens"])
+        self.generated_tokens += stats["tokens"]
+        self.kept_tokens += kept
+        stop = (
+            "query complete" if stats["stopped"] else "token limit or end of sequence"
+        )
+        print(f"Tokens generated: {stats['tokens']}, kept: {kept} (stopped at {stop})")
+
+    def token_stats(self):
+        """
+        Reports the tokens generated over all attempts versus the tokens kept in the answers.
+
+        Returns:
+            dict: Generated tokens, kept tokens and the fraction of generated tokens kept.
+        """
+        return {
+            "generated": self.generated_tokens,
+            "kept": self.kept_tokens,
+            "kept_ratio": (
+                self.kept_tokens / self.generated_tokens
+                if self.generated_tokens
+                else 0.0
+            ),
+        }
+
+    def prunes_grammars(self):
+        """
+        Checks whether the embedded grammars are generated for the pruned schemas.
+
+        Returns:
+            bool: True if pruned schemas get their own embedded grammar.
+        """
+        return bool(
+            self.grammar_directory
+            and self.sql_grammar
+            and Path(self.grammar_directory).is_dir()
+        )
+
+    def get_pruned_grammar(self, db_id, schema):
+        """
+        Generates (once) the embedded grammar of a pruned schema.
+
+        Args:
+            db_id (str): The database identifier.
+            schema (dict): Pruned schema (table names mapped to column names).
+
+        Returns:
+            str: The grammar text.
+        """
+        key = (db_id, tuple(schema))
+        if key not in self.pruned_grammars:
+            self.pruned_grammars[key] = self.sql_grammar.replace_placeholders(schema)
+        return self.pruned_grammars[key]
+
+    def record_pruning(self, db_id, schema, pruned):
+        """
+        Counts the tables, DDL tokens and grammar bytes of a full schema and of its pruned
+        version, once per question.
+
+        Args:
+            db_id (str): The database identifier.
+            schema (Schema): The full schema.
+            pruned (Schema): The pruned schema.
+        """
+        if db_id not in self.full_ddl_tokens:
+            self.full_ddl_tokens[db_id] = len(self.tokenizer(schema.ddl)["input_ids"])
+        stats = self.pruning_stats
+        stats["questions"] += 1
+        stats["tables"] += len(pruned.tables)
+        stats["full_tables"] += len(schema.tables)
+        stats["ddl_tokens"] += len(self.tokenizer(pruned.ddl)["input_ids"])
+        stats["full_ddl_tokens"] += self.full_ddl_tokens[db_id]
+        if self.prunes_grammars():
+            if db_id not in self.full_grammar_bytes:
+                self.full_grammar_bytes[db_id] = len(
+                    self.get_embedded_grammar(db_id) or ""
+                )
+            stats["grammar_bytes"] += len(self.get_pruned_grammar(db_id, pruned.tables))
+            stats["full_grammar_bytes"] += self.full_grammar_bytes[db_id]
+
+    def report_pruning(self):
+        """
+        Prints the tables, DDL tokens and grammar bytes saved by schema pruning.
+        """
+        stats = self.pruning_stats
+        print(f"Schema pruning: {stats}")
+        if stats["full_ddl_tokens"]:
+            saved = 1 - stats["ddl_tokens"] / stats["full_ddl_tokens"]
+            print(
+                f"Schema pruning kept {stats['tables']}/{stats['full_tables']} tables and "
+                f"saved {stats['full_ddl_tokens'] - stats['ddl_tokens']} DDL tokens ({saved:.1%})"
+            )
+        if stats["full_grammar_bytes"]:
+            saved = 1 - stats["grammar_bytes"] / stats["full_grammar_bytes"]
+            print(f"Schema pruning reduced the grammar size by {saved:.1%}")
+
+    def cache_stats(self):
+        """
+        Collects the counters of every cache layer used while answering.
+
+        Returns:
+            dict: Cache layer names mapped to their counters.
+        """
+        stats = {
+            "schema_catalog": self.schema_catalog.stats(),
+            "sqlite_access": self.sqlite_access.stats(),
+        }
+        if self.grammar_directory:
+            stats["grammar_cache"] = self.grammar_cache.stats()
+            stats["token_masks"] = self.mask_cache.stats()
+        if self.grammar_provider:
+            stats["grammar_provider"] = self.grammar_provider.stats()
+        if self.prefix_cache:
+            stats["prefix_cache"] = self.engine.prefix_stats()
+        return stats
+
+    def report_cache_stats(self):
+        """
+        Prints the counters and the hit rate of every cache layer.
+        """
+        stats = self.cache_stats()
+        for layer, layer_stats in stats.items():
+            print(f"{layer}: {layer_stats}")
+        hit_rates = {
+            layer: layer_stats.get("hit_rate", layer_stats.get("pool_hit_rate"))
+            for layer, layer_stats in stats.items()
+        }
+        print(
+            "Cache hit rates: "
+            + ", ".join(f"{layer} {rate:.1%}" for layer, rate in hit_rates.items())
+        )
 
     def convert_json_to_txt(self):
         """
-        Converts the JSON output file to a TXT file with only SQL answers.
+        Converts the JSONL output stream to a TXT file with only SQL answers, ordered by question id.
         """
-        # read the answers from the json file
-        with open(self.json_output, "r") as file:
-            answers = json.load(file)
+        # read the answers from the jsonl stream
+        answers = ordered_predictions(self.jsonl_output)
 
         # write the answers to the txt file
-        with open(self.txt_output, "w") as file:
-            for answer in answers:
-                file.write(
-                    answer["answer"].replace("\n", " ").replace("\r", " ") + "\n"
-                )
+        write_answers(answers, self.txt_output)
         print(f"Answers written to {self.txt_output}")
 
-    def predict(self, question_file):
+    def predict(self, question_file, resume=False):
         """
         Executes the prediction pipeline: reads questions, gets answers, saves output.
 
         Args:
             question_file (str): Path to the JSON file containing questions.
+            resume (bool, optional): Whether to skip the questions already answered by an interrupted run.
         """
         # read the questions from the json file
         self.read_questions(question_file)
         # get the answers for the questions
-        self.get_answers()
+        self.get_answers(resume)
@@ -0,0 +1,237 @@
+import asyncio
+import itertools
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Text2SQLService:
+    """
+    Long-running asyncio front-end answering questions with one loaded Text2SQL object.
+
+    This class handles:
+        * Queuing requests in a bounded queue: when it is full, new requests wait (and the
+          connections sending them are no longer read) until the model catches up.
+        * Coalescing the requests that arrive within a short window into one batch, answered
+          with Text2SQL.answer_batch, while the next batch is collected.
+        * Sharing one answer between identical concurrent requests (same db_id and question).
+        * Serving JSON Lines over TCP: each request line {"db_id": ..., "question": ...,
+          "id": ...} gets one response line, the answer record with the id of the request.
+          Responses are sent as soon as they are ready, so they may come out of order.
+
+    The model, schema catalog, grammar caches and prefix cache of the Text2SQL object are kept
+    across requests. Batches are answered one at a time in a worker thread, so the event loop
+    keeps accepting requests during generation.
+
+    Args:
+        text2sql (Text2SQL): The loaded Text2SQL object.
+        max_batch_size (int, optional): Maximum number of questions in one batch. It is
+            independent of the batch size of the Text2SQL object, which only applies to
+            questions files.
+        batch_window (float, optional): Seconds to wait for more requests after the first
+            request of a batch.
+        max_queue (int, optional): Maximum number of queued requests.
+    """
+
+    def __init__(self, text2sql, max_batch_size=8, batch_window=0.05, max_queue=256):
+        """
+        Initializes the Text2SQLService object.
+        """
+        self.text2sql = text2sql
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.max_queue = max_queue
+        # the queue is bound to the running event loop, so it is created by start
+        self.queue = None
+        self.batch_task = None
+        self.in_flight = {}
+        self.ids = itertools.count()
+        # the model answers one batch at a time
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.requests = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.answered = 0
+
+    async def start(self):
+        """
+        Creates the request queue and starts the batching loop in the running event loop.
+        """
+        self.queue = asyncio.Queue(self.max_queue)
+        self.batch_task = asyncio.create_task(self.run_batches())
+
+    async def stop(self):
+        """
+        Stops the batching loop, cancelling the requests still queued.
+        """
+        self.batch_task.cancel()
+        try:
+            await self.batch_task
+        except asyncio.CancelledError:
+            pass
+        for future in self.in_flight.values():
+            future.cancel()
+        self.in_flight.clear()
+        self.executor.shutdown(wait=True)
+
+    async def submit(self, db_id, question):
+        """
+        Queues a question, waiting while the queue is full.
+
+        Args:
+            db_id (str): The database identifier.
+            question (str): The natural language question.
+
+        Returns:
+            asyncio.Future: The future of the answer record, shared by identical requests.
+        """
+        self.requests += 1
+        key = (db_id, question)
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return future
+
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            await self.queue.put(
+                {"id": next(self.ids), "db_id": db_id, "question": question}
+            )
+        except asyncio.CancelledError:
+            del self.in_flight[key]
+            future.cancel()
+            raise
+        return future
+
+    async def answer(self, db_id, question):
+        """
+        Answers a question.
+
+        Args:
+            db_id (str): The database identifier.
+            question (str): The natural language question.
+
+        Returns:
+            dict: The answer record, as written to the JSONL output by Text2SQL.
+        """
+        future = await self.submit(db_id, question)
+        # shield, so that a cancelled caller does not cancel the answer of identical requests
+        return dict(await asyncio.shield(future))
+
+    async def run_batches(self):
+        """
+        Collects queued questions into batches and answers them, until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            batch = self.text2sql.scheduler.order(batch)
+            # the futures stay in flight during generation, so identical requests join them
+            keys = [(question["db_id"], question["question"]) for question in batch]
+            futures = [self.in_flight[key] for key in keys]
+            try:
+                answers = await loop.run_in_executor(
+                    self.executor, self.text2sql.answer_batch, batch
+                )
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for future, answer in zip(futures, answers):
+                    if not future.done():
+                        future.set_result(answer)
+                self.answered += len(batch)
+            for key in keys:
+                del self.in_flight[key]
+            self.batches += 1
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answers the JSON Lines requests of one connection until the client closes it.
+
+        A request {"stats": true} is answered with the service and cache counters.
+
+        Args:
+            reader (asyncio.StreamReader): The connection reader.
+            writer (asyncio.StreamWriter): The connection writer.
+        """
+        lock = asyncio.Lock()
+        responses = set()
+
+        async def send(response):
+            async with lock:
+                writer.write((json.dumps(response) + "\n").encode("utf-8"))
+                await writer.drain()
+
+        async def respond(request_id, future):
+            try:
+                response = dict(await asyncio.shield(future), id=request_id)
+            except Exception as e:
+                response = {"id": request_id, "error": str(e)}
+            await send(response)
+
+        while line := await reader.readline():
+            try:
+                request = json.loads(line)
+                if request.get("stats"):
+                    await send(self.stats())
+                    continue
+                db_id, question = request["db_id"], request["question"]
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                await send({"error": f"Invalid request: {e}"})
+                continue
+            # waits while the queue is full, so the connection is not read meanwhile
+            future = await self.submit(db_id, question)
+            response = asyncio.create_task(respond(request.get("id"), future))
+            responses.add(response)
+            response.add_done_callback(responses.discard)
+
+        await asyncio.gather(*responses)
+        writer.close()
+        await writer.wait_closed()
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        """
+        Starts the service and serves JSON Lines requests over TCP until cancelled.
+
+        Args:
+            host (str, optional): The interface to listen on.
+            port (int, optional): The TCP port.
+        """
+        await self.start()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f"Serving Text2SQL on {host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.stop()
+
+    def stats(self):
+        """
+        Reports the service counters and the counters of the Text2SQL cache layers.
+
+        Returns:
+            dict: Requests, coalesced requests, batches, answered questions, mean batch size,
+                queued requests and the cache counters.
+        """
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "answered": self.answered,
+            "mean_batch_size": self.answered / self.batches if self.batches else 0.0,
+            "queued": self.queue.qsize() if self.queue else 0,
+            "caches": self.text2sql.cache_stats(),
+        }
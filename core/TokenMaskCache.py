@@ -0,0 +1,170 @@
+import copy
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+
+def state_key(parsing_state):
+    """
+    Builds a hashable key identifying a grammar parsing state.
+
+    Two parsing states with the same stacks and the same partially decoded UTF-8 character
+    accept the same tokens.
+
+    Args:
+        parsing_state (AcceptState): The parsing state of a grammar constraint.
+
+    Returns:
+        tuple: The frozen stacks and the partial UTF-8 state.
+    """
+    return frozenset(parsing_state.stacks), parsing_state.partial_utf8
+
+
+def initial_state(constraint):
+    """
+    Returns a fresh parsing state at the start of the grammar of a constraint.
+
+    Args:
+        constraint (IncrementalGrammarConstraint): The grammar constraint.
+
+    Returns:
+        AcceptState: The initial parsing state.
+    """
+    return copy.deepcopy(constraint.string_recognizer.get_initial_parsing_state())
+
+
+class TokenMaskCache:
+    """
+    Memoizes the allowed-token masks of grammar parsing states as packed bitsets.
+
+    Decoding often returns to the same parsing states (inside a string literal, between
+    keywords, after a comma), so the mask of a state is computed once by the constraint and
+    then reused. Masks are stored with one bit per token (16 KB for a 128k vocabulary),
+    together with the number of allowed tokens and the allowed token if it is the only one.
+    The masks of a batch are unpacked and applied to the logits in one vectorized operation.
+
+    Masks are kept per constraint (released with it) and evicted per constraint in LRU order.
+
+    Args:
+        max_size (int, optional): Maximum number of masks kept per grammar constraint.
+    """
+
+    def __init__(self, max_size=4096):
+        """
+        Initializes the TokenMaskCache object.
+        """
+        self.max_size = max_size
+        # constraint -> OrderedDict of state key -> (packed mask, allowed count, forced token)
+        self.masks = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def entry(self, constraint, parsing_state):
+        """
+        Retrieves the packed mask of a parsing state, computing it on a miss.
+
+        Args:
+            constraint (IncrementalGrammarConstraint): The grammar constraint.
+            parsing_state (AcceptState): The parsing state.
+
+        Returns:
+            tuple: The packed mask (uint8 array), the number of allowed tokens, and the
+                allowed token id if it is the only one (None otherwise).
+        """
+        masks = self.masks.get(constraint)
+        if masks is None:
+            masks = self.masks[constraint] = OrderedDict()
+        key = state_key(parsing_state)
+        entry = masks.get(key)
+        if entry is not None:
+            self.hits += 1
+            masks.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        acceptance = constraint.filter_vocab(parsing_state, torch.device("cpu"))
+        acceptance = acceptance.numpy()
+        allowed = np.flatnonzero(acceptance)
+        entry = (
+            np.packbits(acceptance),
+            len(allowed),
+            int(allowed[0]) if len(allowed) == 1 else None,
+        )
+        masks[key] = entry
+        if len(masks) > self.max_size:
+            masks.popitem(last=False)
+        return entry
+
+    def forced_token(self, constraint, parsing_state):
+        """
+        Returns the only token a parsing state allows, if there is exactly one.
+
+        Args:
+            constraint (IncrementalGrammarConstraint): The grammar constraint.
+            parsing_state (AcceptState): The parsing state.
+
+        Returns:
+            int: The forced token id, or None if zero or several tokens are allowed.
+        """
+        return self.entry(constraint, parsing_state)[2]
+
+    def batch_mask(self, row_constraints, states, vocab_size, device):
+        """
+        Builds the allowed-token mask of every row of a batch.
+
+        Args:
+            row_constraints (list): The grammar constraint of every row, or None for an
+                unconstrained row.
+            states (list): The parsing state of every row (ignored for unconstrained rows).
+            vocab_size (int): Size of the model vocabulary. Tokens beyond the vocabulary of
+                the tokenizer are never allowed in constrained rows.
+            device (torch.device): Device of the mask.
+
+        Returns:
+            torch.BoolTensor: The (rows, vocab_size) mask, True where a token is allowed.
+        """
+        width = (vocab_size + 7) // 8
+        packed = np.full((len(row_constraints), width), 0xFF, dtype=np.uint8)
+        for row, (constraint, parsing_state) in enumerate(zip(row_constraints, states)):
+            if constraint is None:
+                continue
+            row_mask = self.entry(constraint, parsing_state)[0]
+            packed[row, : len(row_mask)] = row_mask
+            packed[row, len(row_mask) :] = 0
+        bits = np.unpackbits(packed, axis=1, count=vocab_size)
+        return torch.from_numpy(bits).to(device).bool()
+
+    def apply(self, scores, row_constraints, states):
+        """
+        Masks the logits of a batch with the allowed tokens of every row.
+
+        Args:
+            scores (torch.FloatTensor): The (rows, vocab_size) next-token logits.
+            row_constraints (list): The grammar constraint of every row, or None.
+            states (list): The parsing state of every row.
+
+        Returns:
+            torch.FloatTensor: The logits, -inf where a token is not allowed.
+        """
+        if all(constraint is None for constraint in row_constraints):
+            return scores
+        mask = self.batch_mask(row_constraints, states, scores.shape[-1], scores.device)
+        return scores.masked_fill(~mask, float("-inf"))
+
+    def stats(self):
+        """
+        Reports the cache counters.
+
+        Returns:
+            dict: Hits, misses (masks computed by the constraints), hit rate and number of
+                cached masks.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": sum(len(masks) for masks in self.masks.values()),
+        }
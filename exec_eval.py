@@ -1,4 +1,5 @@
-from core.SQLiteExec import SQLiteExec
+from core.SQLiteAccess import ROUTING_POLICIES
+from core.SQLiteExec import VALIDATION_MODES, QueryLimits, SQLiteExec
 import argparse
 
 if __name__ == "__main__":
@@ -13,10 +14,67 @@ if __name__ == "__main__":
     parser.add_argument(
         "--ids", type=str, help="The path to the database IDs file", required=True
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes (defaults to the number of CPUs)",
+        default=None,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        help="Wall-clock limit per query in seconds (no limit by default)",
+        default=None,
+        required=False,
+    )
+    parser.add_argument(
+        "--max_steps",
+        type=int,
+        help="SQLite VM step limit per query",
+        default=None,
+        required=False,
+    )
+    parser.add_argument(
+        "--max_rows",
+        type=int,
+        help="Limit on the rows fetched per query",
+        default=None,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--mode",
+        choices=VALIDATION_MODES,
+        help="Run every query (execute) or only prepare it with EXPLAIN (explain)",
+        default="execute",
+        required=False,
+    )
+    parser.add_argument(
+        "--immutable",
+        action="store_true",
+        help="Open the databases with immutable=1, skipping file locks",
+    )
+    parser.add_argument(
+        "--routing",
+        choices=ROUTING_POLICIES,
+        help="How database reads are spread across the mirror directories",
+        default="failover",
+        required=False,
+    )
 
     args = parser.parse_args()
 
-    executor = SQLiteExec(args.db)
+    limits = QueryLimits(args.timeout, args.max_steps, args.max_rows)
+    executor = SQLiteExec(
+        args.db,
+        args.workers,
+        limits=limits,
+        mode=args.mode,
+        immutable=args.immutable,
+        routing=args.routing,
+    )
     queries, db_ids = executor.read_queries_and_ids(args.sql, args.ids)
     results = executor.execute_queries(queries, db_ids)
 
@@ -26,3 +84,4 @@ if __name__ == "__main__":
     print(f"Total queries: {len(results)}")
     print(f"% of executable queries: {accuracy * 100:.2f}%")
     print(f"Proportion of executable queries: {successful_queries}/{len(results)}")
+    print(f"Queries stopped by timeout: {executor.outcomes.count('timeout')}")
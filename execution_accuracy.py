@@ -0,0 +1,113 @@
+from core.ExecutionEvaluator import ExecutionEvaluator, load_gold, load_predictions
+from core.SQLiteAccess import ROUTING_POLICIES
+from core.SQLiteExec import QueryLimits
+import argparse
+import os
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Execution accuracy of predicted queries against the gold queries"
+    )
+
+    parser.add_argument(
+        "--db", type=str, help="The path to the databases directory", required=True
+    )
+    parser.add_argument(
+        "--gold",
+        type=str,
+        help="The gold queries: the JSON questions file, or a 'query<TAB>db_id' SQL file",
+        required=True,
+    )
+    parser.add_argument(
+        "--predictions",
+        type=str,
+        nargs="+",
+        help="Prediction files (output.txt, output.json or output.jsonl), each optionally "
+        "named as NAME=PATH; by default a run is named after the directory of its file",
+        required=True,
+    )
+    parser.add_argument(
+        "--cache",
+        type=str,
+        help="The JSON file caching the gold results (defaults to <gold>.results.json)",
+        default=None,
+        required=False,
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Write the breakdown as a CSV file in the format of evaluation/results.csv",
+        default=None,
+        required=False,
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes (defaults to the number of CPUs)",
+        default=None,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        help="Wall-clock limit per query in seconds (no limit by default)",
+        default=None,
+        required=False,
+    )
+    parser.add_argument(
+        "--max_steps",
+        type=int,
+        help="SQLite VM step limit per query",
+        default=None,
+        required=False,
+    )
+    parser.add_argument(
+        "--immutable",
+        action="store_true",
+        help="Open the databases with immutable=1, skipping file locks",
+    )
+    parser.add_argument(
+        "--routing",
+        choices=ROUTING_POLICIES,
+        help="How database reads are spread across the mirror directories",
+        default="failover",
+        required=False,
+    )
+
+    args = parser.parse_args()
+
+    runs = {}
+    for prediction in args.predictions:
+        name, separator, path = prediction.rpartition("=")
+        if not separator:
+            name = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        runs[name] = load_predictions(path)
+
+    evaluator = ExecutionEvaluator(
+        args.db,
+        cache_path=args.cache or f"{os.path.splitext(args.gold)[0]}.results.json",
+        workers=args.workers,
+        limits=QueryLimits(args.timeout, args.max_steps),
+        immutable=args.immutable,
+        routing=args.routing,
+    )
+    gold = load_gold(args.gold)
+    evaluation = evaluator.evaluate(gold, runs)
+    breakdowns = {
+        name: evaluator.breakdown(questions) for name, questions in evaluation.items()
+    }
+
+    print("\n\n\n****************** RESULTS ******************\n")
+    for name, metrics in breakdowns.items():
+        print(name)
+        for metric, values in metrics.items():
+            print(
+                f"  {metric}: "
+                + ", ".join(f"{column} {value}" for column, value in values.items())
+            )
+    print(f"Evaluator stats: {evaluator.stats()}")
+
+    if args.output:
+        evaluator.write_results(breakdowns, args.output)
+        print(f"Results written to {args.output}")
@@ -1,8 +1,116 @@
 import argparse
+import asyncio
+import functools
 from pathlib import Path
 
-from core.Text2SQL import Text2SQL
-from core.SQLCFG import SQLCFG
+from transformers import AutoTokenizer
+
+from core.Text2SQL import QUANTIZATION_MODES, Text2SQL
+from core.GrammarProvider import GrammarProvider
+from core.QuestionScheduler import SCHEDULING_POLICIES
+from core.SchemaPruner import SchemaPruner
+from core.SQLValidator import SQLValidator
+from core.ShardedInference import ShardedInference
+from core.Text2SQLService import Text2SQLService
+from core.SQLCFG import COLUMN_MODES, SQLCFG
+from core.SQLiteAccess import ROUTING_POLICIES, SQLiteAccess
+from core.SQLiteExec import VALIDATION_MODES, QueryLimits
+
+
+def build_grammars(args, sqlite_access, prepare_grammars=True):
+    """
+    Creates the grammar generator and provider described by the command line arguments.
+
+    Args:
+        args (argparse.Namespace): The command line arguments.
+        sqlite_access (SQLiteAccess): Database access layer of the process.
+        prepare_grammars (bool, optional): Whether the embedded grammars are generated now,
+            unless they are built lazily.
+
+    Returns:
+        tuple: The grammar path passed to Text2SQL, the SQLCFG generator (or None) and the
+            GrammarProvider (or None).
+    """
+    grammar_path = None
+    # create a SQLGrammar object if grammar_directory is provided
+    sql_grammar = None
+    grammar_provider = None
+    if args.grammar_directory:
+        print("Creating SQLGrammar object")
+        # create args.grammar_directory if it it does not exist
+        if not Path(args.grammar_directory).exists():
+            Path(args.grammar_directory).mkdir(parents=True, exist_ok=True)
+
+        if Path(args.grammar_directory).is_dir():
+            sql_grammar = SQLCFG(
+                args.grammar_template_path,
+                args.db_path,
+                args.grammar_directory,
+                sqlite_access=sqlite_access,
+                column_mode=args.grammar_column_mode,
+            )
+            if args.lazy_grammars:
+                # grammars (and their precompiled artifacts) are built on first use
+                grammar_provider = GrammarProvider(sql_grammar)
+            elif prepare_grammars:
+                # write the grammar to the embedded grammar file
+                tokenizer = None
+                if args.precompile_grammars:
+                    tokenizer = AutoTokenizer.from_pretrained(args.model_id)
+                sql_grammar.process_databases(tokenizer, args.grammar_workers)
+            grammar_path = args.grammar_directory
+    else:
+        if args.grammar_template_path:
+            grammar_path = args.grammar_template_path
+    return grammar_path, sql_grammar, grammar_provider
+
+
+def build_text2sql(args, prepare_grammars=True):
+    """
+    Creates the Text2SQL object described by the command line arguments.
+
+    Module-level, so that worker processes of the sharded driver can build their own.
+
+    Args:
+        args (argparse.Namespace): The command line arguments.
+        prepare_grammars (bool, optional): Whether the embedded grammars are generated first.
+
+    Returns:
+        Text2SQL: The configured Text2SQL object.
+    """
+    # schema extraction and query validation share the same mirror routing
+    sqlite_access = SQLiteAccess(routing=args.mirror_routing)
+    grammar_path, sql_grammar, grammar_provider = build_grammars(
+        args, sqlite_access, prepare_grammars
+    )
+
+    # create a LLMResponse object
+    return Text2SQL(
+        args.model_id,
+        args.predicted_path,
+        grammar_path,
+        args.db_path,
+        args.prompt_template,
+        args.batch_size,
+        args.max_new_tokens,
+        sync_every=args.sync_every,
+        query_limits=QueryLimits(
+            args.query_timeout, args.query_max_steps, args.query_max_rows
+        ),
+        validation_mode=args.validation_mode,
+        immutable=args.immutable,
+        sqlite_access=sqlite_access,
+        prefix_cache=not args.no_prefix_cache,
+        schedule=args.schedule,
+        schema_pruner=SchemaPruner() if args.prune_schema else None,
+        sql_grammar=sql_grammar,
+        grammar_provider=grammar_provider,
+        jump_forward=args.jump_forward,
+        stop_at_statement_end=not args.no_early_stop,
+        sql_validator=SQLValidator() if args.static_validation else None,
+        quantization=args.quantization,
+    )
+
 
 if __name__ == "__main__":
     # parse the arguments: databases folder path, questions json file path, and the output file path, and if use_embedded_grammar is set
@@ -53,39 +161,222 @@ if __name__ == "__main__":
         type=str,
         help="Output directory for the predictions ",
     )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        help="Number of questions generated together in one batch",
+        default=1,
+        required=False,
+    )
+    parser.add_argument(
+        "--max_new_tokens",
+        type=int,
+        help="Fixed number of generated tokens per attempt (derived from the prompt length by default)",
+        default=None,
+        required=False,
+    )
+
+    parser.add_argument(
+        "--sync_every",
+        type=int,
+        help="Number of answers between flushes of the JSONL predictions to disk",
+        default=1,
+        required=False,
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip the questions already answered in the predicted_path output",
+    )
+    parser.add_argument(
+        "--precompile_grammars",
+        action="store_true",
+        help="Write precompiled grammar artifacts next to the embedded grammars",
+    )
+    parser.add_argument(
+        "--query_timeout",
+        type=float,
+        help="Wall-clock limit in seconds when executing a generated query (no limit by default)",
+        default=None,
+        required=False,
+    )
+    parser.add_argument(
+        "--query_max_steps",
+        type=int,
+        help="SQLite VM step limit when executing a generated query",
+        default=None,
+        required=False,
+    )
+    parser.add_argument(
+        "--query_max_rows",
+        type=int,
+        help="Limit on the rows fetched when executing a generated query",
+        default=None,
+        required=False,
+    )
+    parser.add_argument(
+        "--validation_mode",
+        choices=VALIDATION_MODES,
+        help="Run generated queries (execute) or only prepare them with EXPLAIN (explain)",
+        default="execute",
+        required=False,
+    )
+    parser.add_argument(
+        "--immutable",
+        action="store_true",
+        help="Open the databases with immutable=1, skipping file locks",
+    )
+    parser.add_argument(
+        "--mirror_routing",
+        choices=ROUTING_POLICIES,
+        help="How database reads are spread across the mirror directories",
+        default="failover",
+        required=False,
+    )
+    parser.add_argument(
+        "--no_prefix_cache",
+        action="store_true",
+        help="Prefill every prompt in full instead of reusing the cached schema prefix",
+    )
+    parser.add_argument(
+        "--schedule",
+        choices=SCHEDULING_POLICIES,
+        help="Order in which questions are processed (answers are saved in id order)",
+        default="db_id",
+        required=False,
+    )
+    parser.add_argument(
+        "--prune_schema",
+        action="store_true",
+        help="Keep only the tables relevant to each question in the prompt and grammar",
+    )
+    parser.add_argument(
+        "--static_validation",
+        action="store_true",
+        help="Check generated queries against the schema before running them on SQLite",
+    )
+    parser.add_argument(
+        "--grammar_column_mode",
+        choices=COLUMN_MODES,
+        help="One column alternation for all tables (flat) or per-table table.column rules (qualified)",
+        default="flat",
+        required=False,
+    )
+    parser.add_argument(
+        "--grammar_workers",
+        type=int,
+        help="Number of threads generating the embedded grammars (number of CPUs by default)",
+        default=None,
+        required=False,
+    )
+    parser.add_argument(
+        "--lazy_grammars",
+        action="store_true",
+        help="Build the embedded grammar of a database when its first question is answered",
+    )
+    parser.add_argument(
+        "--jump_forward",
+        action="store_true",
+        help="Append the tokens forced by the grammar without a forward pass of their own",
+    )
+    parser.add_argument(
+        "--no_early_stop",
+        action="store_true",
+        help="Generate up to the token limit instead of stopping once the query is complete",
+    )
+    parser.add_argument(
+        "--quantization",
+        choices=QUANTIZATION_MODES,
+        help="Load the model in 4-bit (4bit), in full precision (none), or in 4-bit only when CUDA is available (auto)",
+        default="auto",
+        required=False,
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker processes, each with its own model replica",
+        default=1,
+        required=False,
+    )
+    parser.add_argument(
+        "--devices",
+        type=str,
+        help="Comma-separated CUDA device indices, one worker per device (e.g. 0,1,2,3)",
+        default=None,
+        required=False,
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Answer JSON Lines requests over TCP instead of a questions file",
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        help="Interface the service listens on",
+        default="127.0.0.1",
+        required=False,
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        help="TCP port of the service",
+        default=8765,
+        required=False,
+    )
+    parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        help="Maximum number of requests the service answers together in one batch",
+        default=8,
+        required=False,
+    )
+    parser.add_argument(
+        "--batch_window",
+        type=float,
+        help="Seconds the service waits for more requests to fill a batch",
+        default=0.05,
+        required=False,
+    )
+    parser.add_argument(
+        "--max_queue",
+        type=int,
+        help="Maximum number of requests queued by the service before senders wait",
+        default=256,
+        required=False,
+    )
 
     args = parser.parse_args()
 
     print(args)
 
-    grammar_path = None
-    # create a SQLGrammar object if grammar_directory is provided
-    if args.grammar_directory:
-        print("Creating SQLGrammar object")
-        # create args.grammar_directory if it it does not exist
-        if not Path(args.grammar_directory).exists():
-            Path(args.grammar_directory).mkdir(parents=True, exist_ok=True)
-
-        if Path(args.grammar_directory).is_dir():
-            sql_grammar = SQLCFG(
-                args.grammar_template_path, args.db_path, args.grammar_directory
-            )
-            # write the grammar to the embedded grammar file
-            sql_grammar.process_databases()
-            grammar_path = args.grammar_directory
+    if args.serve:
+        # the model and caches are loaded once and kept for all requests
+        service = Text2SQLService(
+            build_text2sql(args),
+            max_batch_size=args.max_batch_size,
+            batch_window=args.batch_window,
+            max_queue=args.max_queue,
+        )
+        asyncio.run(service.serve(args.host, args.port))
+    elif args.workers > 1 or args.devices:
+        # the grammars are generated once here, not by every worker
+        build_grammars(args, SQLiteAccess(routing=args.mirror_routing))
+        devices = (
+            [int(device) for device in args.devices.split(",")]
+            if args.devices
+            else None
+        )
+        driver = ShardedInference(
+            functools.partial(build_text2sql, args, prepare_grammars=False),
+            workers=args.workers,
+            devices=devices,
+            sync_every=args.sync_every,
+        )
+        driver.predict(args.questions_file, args.predicted_path, args.resume)
     else:
-        if args.grammar_template_path:
-            grammar_path = args.grammar_template_path
-
-    # create a LLMResponse object
-    llm_response = Text2SQL(
-        args.model_id,
-        args.predicted_path,
-        grammar_path,
-        args.db_path,
-        args.prompt_template,
-    )
-    # read the questions from the json file
-    llm_response.predict(args.questions_file)
-    # convert the JSON file to a TXT file
-    llm_response.convert_json_to_txt()
\ No newline at end of file
+        llm_response = build_text2sql(args)
+        # read the questions from the json file
+        llm_response.predict(args.questions_file, args.resume)
+        # convert the JSON file to a TXT file
+        llm_response.convert_json_to_txt()
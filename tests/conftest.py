@@ -0,0 +1,132 @@
+import json
+import os
+import random
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# command line scripts, not test modules
+collect_ignore = ["test_databases.py", "SQLCFG_test.py"]
+
+TABLES = {
+    "concert_singer": {
+        "singer": ["Singer_ID", "Name", "Country", "Age"],
+        "concert": ["concert_ID", "concert_Name", "Stadium_ID", "Year"],
+        "stadium": ["Stadium_ID", "Name", "Capacity"],
+    },
+    "club_1": {
+        "club": ["Club_ID", "Name", "Country", "Manager"],
+        "player": ["Player_ID", "Name", "Club_ID"],
+    },
+}
+
+PROMPT_TEMPLATE = "Schema: {schema} Question: {question} Solution:"
+
+
+def create_database(path, tables, rows=20):
+    """
+    Creates an SQLite database with text columns filled with repeating values.
+
+    Args:
+        path (str): Path to the database file.
+        tables (dict): Table names mapped to column names.
+        rows (int, optional): Number of rows of every table.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path)
+    for table, columns in tables.items():
+        connection.execute(
+            f"CREATE TABLE {table} ("
+            + ", ".join(f"`{column}` text" for column in columns)
+            + ")"
+        )
+        for i in range(rows):
+            connection.execute(
+                f"INSERT INTO {table} VALUES ({', '.join('?' * len(columns))})",
+                [f"{column}{i % 5}" for column in columns],
+            )
+    connection.commit()
+    connection.close()
+
+
+@pytest.fixture(scope="session")
+def db_path(tmp_path_factory):
+    """
+    Database root directory holding <db_id>/<db_id>.sqlite for every database of TABLES.
+    """
+    root = tmp_path_factory.mktemp("database")
+    for db_id, tables in TABLES.items():
+        create_database(str(root / db_id / f"{db_id}.sqlite"), tables)
+    return str(root)
+
+
+@pytest.fixture(scope="session")
+def questions_file(tmp_path_factory):
+    """
+    Questions file over the databases of TABLES, with their gold queries.
+    """
+    questions = []
+    for i in range(6):
+        db_id = "concert_singer" if i % 2 == 0 else "club_1"
+        query = (
+            "SELECT count(*) FROM singer"
+            if db_id == "concert_singer"
+            else "SELECT Name FROM club"
+        )
+        questions.append(
+            {"db_id": db_id, "question": f"How many rows {i}?", "query": query}
+        )
+    path = tmp_path_factory.mktemp("questions") / "questions.json"
+    path.write_text(json.dumps(questions))
+    return str(path)
+
+
+@pytest.fixture(scope="session")
+def tiny_model(tmp_path_factory):
+    """
+    Randomly initialized two-layer Llama model with a small byte-level BPE tokenizer.
+    """
+    tokenizers = pytest.importorskip("tokenizers")
+    import torch
+    from transformers import GPT2TokenizerFast, LlamaConfig, LlamaForCausalLM
+
+    directory = tmp_path_factory.mktemp("tiny_model")
+    words = (
+        "SELECT FROM WHERE GROUP BY ORDER LIMIT COUNT Name Country singer club "
+        "concert stadium Schema Question Solution CREATE TABLE text"
+    ).split()
+    generator = random.Random(0)
+    corpus = [
+        " ".join(generator.choice(words) for _ in range(12)) + " ; , ( ) * = ' 1 2"
+        for _ in range(500)
+    ]
+    bpe = tokenizers.ByteLevelBPETokenizer()
+    bpe.train_from_iterator(
+        corpus, vocab_size=600, special_tokens=["<|endoftext|>"], show_progress=False
+    )
+    bpe.save_model(str(directory))
+    tokenizer = GPT2TokenizerFast(
+        vocab_file=str(directory / "vocab.json"),
+        merges_file=str(directory / "merges.txt"),
+        eos_token="<|endoftext|>",
+        bos_token="<|endoftext|>",
+        unk_token="<|endoftext|>",
+    )
+    config = LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=2048,
+        eos_token_id=tokenizer.eos_token_id,
+        bos_token_id=tokenizer.bos_token_id,
+    )
+    torch.manual_seed(0)
+    LlamaForCausalLM(config).save_pretrained(str(directory))
+    tokenizer.save_pretrained(str(directory))
+    return str(directory)
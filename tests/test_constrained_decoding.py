@@ -0,0 +1,121 @@
+import pytest
+
+from core.ConstrainedDecoding import BatchGrammarLogitsProcessor
+from core.GenerationEngine import GenerationEngine
+from core.TokenMaskCache import TokenMaskCache
+
+GRAMMARS = [
+    """
+root ::= "SELECT " column " FROM " table ";"
+column ::= "Name" | "Country" | "count(*)" | "Age"
+table ::= "singer" | "concert" | "stadium"
+""",
+    """
+root ::= "SELECT " column " FROM club" where? ";"
+column ::= "Name" | "Country" | "Manager"
+where ::= " WHERE " column " = '" [a-z]+ "'"
+""",
+]
+PROMPTS = [
+    "Schema: singer Question: How many singers? Solution:",
+    "Schema: club Question: Which clubs are in France? Solution:",
+]
+MAX_NEW_TOKENS = 24
+
+
+@pytest.fixture(scope="module")
+def model_and_tokenizer(tiny_model):
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(tiny_model)
+    tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    return AutoModelForCausalLM.from_pretrained(tiny_model), tokenizer
+
+
+def constraint(grammar, tokenizer):
+    from transformers_cfg.grammar_utils import IncrementalGrammarConstraint
+
+    return IncrementalGrammarConstraint(grammar, "root", tokenizer)
+
+
+def plain_greedy(model, tokenizer, prompt, grammar):
+    """
+    Decodes a prompt greedily with the grammar processor of transformers_cfg, one step at a
+    time and without any mask caching.
+    """
+    from transformers_cfg.generation.logits_process import (
+        GrammarConstrainedLogitsProcessor,
+    )
+
+    inputs = tokenizer([prompt], return_tensors="pt")
+    outputs = model.generate(
+        **inputs,
+        max_new_tokens=MAX_NEW_TOKENS,
+        do_sample=False,
+        logits_processor=[
+            GrammarConstrainedLogitsProcessor(constraint(grammar, tokenizer))
+        ],
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    return tokenizer.decode(
+        outputs[0, inputs["input_ids"].shape[1] :], skip_special_tokens=True
+    )
+
+
+@pytest.fixture(scope="module")
+def expected(model_and_tokenizer):
+    model, tokenizer = model_and_tokenizer
+    return [
+        plain_greedy(model, tokenizer, prompt, grammar)
+        for prompt, grammar in zip(PROMPTS, GRAMMARS)
+    ]
+
+
+def test_cached_masks_match_plain_constrained_decoding(model_and_tokenizer, expected):
+    model, tokenizer = model_and_tokenizer
+    mask_cache = TokenMaskCache()
+    engine = GenerationEngine(model, tokenizer, mask_cache=mask_cache)
+    row_constraints = [constraint(grammar, tokenizer) for grammar in GRAMMARS]
+
+    # decoded twice, the second time from the masks cached by the first
+    for _ in range(2):
+        completions = [
+            engine.generate(
+                [prompt],
+                MAX_NEW_TOKENS,
+                [BatchGrammarLogitsProcessor([row_constraint], mask_cache)],
+            )[0]
+            for prompt, row_constraint in zip(PROMPTS, row_constraints)
+        ]
+        assert completions == expected
+    assert mask_cache.stats()["hits"] > mask_cache.stats()["misses"]
+
+
+def test_jump_forward_matches_plain_constrained_decoding(model_and_tokenizer, expected):
+    model, tokenizer = model_and_tokenizer
+    engine = GenerationEngine(model, tokenizer, jump_forward=True)
+
+    for prompt, grammar, completion in zip(PROMPTS, GRAMMARS, expected):
+        row_constraints = [constraint(grammar, tokenizer)]
+        assert engine.generate(
+            [prompt], MAX_NEW_TOKENS, None, None, row_constraints
+        ) == [completion]
+    stats = engine.jump_forward_stats()
+    assert stats["saved_passes"] > 0
+
+
+def test_jump_forward_batch_matches_step_by_step_batch(model_and_tokenizer):
+    model, tokenizer = model_and_tokenizer
+    row_constraints = [constraint(grammar, tokenizer) for grammar in GRAMMARS]
+
+    stepwise = GenerationEngine(model, tokenizer).generate(
+        PROMPTS,
+        MAX_NEW_TOKENS,
+        [BatchGrammarLogitsProcessor(row_constraints)],
+    )
+    # rows jump by different amounts, so their chunks are padded differently
+    jumped = GenerationEngine(model, tokenizer, jump_forward=True).generate(
+        PROMPTS, MAX_NEW_TOKENS, None, None, row_constraints
+    )
+    assert jumped == stepwise
@@ -1,67 +1,46 @@
 import os
 import sqlite3
 import argparse
-import time
 
-def test_database(db_path):
-    try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' LIMIT 1;")
-        cursor.fetchall()
-        conn.close()
-        return "OK"
-    except sqlite3.OperationalError as e:
-        if "disk I/O error" in str(e):
-            return "disk I/O error"
-        else:
-            return f"OperationalError: {e}"
-    except sqlite3.DatabaseError as e:
-        if "database disk image is malformed" in str(e):
-            return "database disk image is malformed"
-        else:
-            return f"DatabaseError: {e}"
+from core.SQLiteAccess import MirrorsExhausted, SQLiteAccess
 
-def test_database_with_retries(db_path, max_retries=5, max_directories=10):
-    retries = 0
-    base_path, db_name = os.path.split(db_path)  # Split into base path and db_name
+def test_database(connection):
+    cursor = connection.cursor()
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' LIMIT 1;")
+    cursor.fetchall()
+    cursor.close()
+    return "OK"
 
-    while retries < max_retries:
-        status = test_database(db_path)
-        if status == "OK":
-            return status, retries + 1, base_path
-        elif status in ["disk I/O error", "database disk image is malformed"]:
-            retries += 1
-            time.sleep(1)  # Adding a delay before retrying
-            continue
-        else:
-            return status, retries + 1, base_path
+def test_database_with_retries(db_path, access):
+    attempts = 0
+    last_directory = os.path.dirname(db_path)
 
-    for i in range(2, max_directories + 1):
-        new_base_path = f"{base_path}{i}"
-        new_db_path = os.path.join(new_base_path, db_name)
-        retries = 0
-        while retries < max_retries:
-            status = test_database(new_db_path)
-            if status == "OK":
-                return status, retries + 1, new_base_path
-            elif status in ["disk I/O error", "database disk image is malformed"]:
-                retries += 1
-                time.sleep(1)  # Adding a delay before retrying
-                continue
-            else:
-                return status, retries + 1, new_base_path
+    def check(connection, path):
+        nonlocal attempts, last_directory
+        attempts += 1
+        last_directory = os.path.dirname(path)
+        return test_database(connection)
 
-    return f"Failed after trying {max_directories} directories", retries + 1, new_base_path
+    try:
+        status = access.run(db_path, check)
+    except MirrorsExhausted as e:
+        status = str(e)
+    except sqlite3.OperationalError as e:
+        status = f"OperationalError: {e}"
+    except sqlite3.DatabaseError as e:
+        status = f"DatabaseError: {e}"
+    return status, attempts, last_directory
 
 def main(directory):
+    access = SQLiteAccess(max_retries=5, max_mirrors=10)
     for root, dirs, files in os.walk(directory):
         for dir_name in dirs:
             db_id = dir_name
             db_file = os.path.join(root, dir_name, f"{db_id}.sqlite")
             if os.path.isfile(db_file):
-                status, attempts, last_directory = test_database_with_retries(db_file)
+                status, attempts, last_directory = test_database_with_retries(db_file, access)
                 print(f"Database ID: {db_id}, Attempts: {attempts}, Last Directory: {last_directory}, Status: {status}")
+    print(f"SQLite access: {access.stats()}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Test SQLite databases in a directory.")
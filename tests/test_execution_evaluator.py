@@ -0,0 +1,122 @@
+import json
+import os
+import random
+import sqlite3
+
+import pytest
+
+from conftest import TABLES, create_database
+from core.ExecutionEvaluator import ExecutionEvaluator, ResultHash
+from core.SQLiteExec import QueryLimits
+
+DB_ID = "concert_singer"
+COUNT_QUERY = "SELECT count(*) FROM singer"
+# 20 ** 4 rows, far beyond a budget of a few thousand VM steps
+HEAVY_QUERY = "SELECT count(*) FROM singer AS a, singer AS b, singer AS c, singer AS d"
+
+
+@pytest.fixture
+def db_root(tmp_path):
+    root = tmp_path / "database"
+    create_database(str(root / DB_ID / f"{DB_ID}.sqlite"), TABLES[DB_ID])
+    return str(root)
+
+
+def digest(*chunks):
+    result = ResultHash()
+    for rows in chunks:
+        result.update(rows)
+    return result.digest()
+
+
+def gold_entry(query):
+    return {"query": query, "db_id": DB_ID, "hardness": "easy"}
+
+
+def test_result_hash_ignores_row_order():
+    rows = [(i, f"name{i % 3}", i / 2) for i in range(50)]
+    shuffled = list(rows)
+    random.Random(0).shuffle(shuffled)
+    assert digest(rows) == digest(shuffled)
+    # fetched in several chunks
+    assert digest(rows) == digest(shuffled[:7], shuffled[7:30], shuffled[30:])
+    # integral floats are the integers SQLite may return instead
+    assert digest([(1, "a")]) == digest([(1.0, "a")])
+
+
+def test_result_hash_compares_multisets():
+    assert digest([(1,), (1,), (2,)]) != digest([(1,), (2,), (2,)])
+    assert digest([(1,), (2,)]) != digest([(1,), (2,), (2,)])
+    assert digest([(1, 2)]) != digest([(2, 1)])
+    assert digest([]) != digest([(None,)])
+
+
+def test_gold_cache_is_reused_until_the_database_changes(db_root, tmp_path):
+    cache_path = str(tmp_path / "gold.results.json")
+    gold = [gold_entry(COUNT_QUERY), gold_entry(COUNT_QUERY + " ;")]
+
+    first = ExecutionEvaluator(db_root, cache_path=cache_path, workers=1)
+    before = first.gold_results(gold)
+    # reformatted copies of a query share one entry
+    assert first.stats()["gold_cache_misses"] == 1
+    assert first.stats()["executed_queries"] == 1
+
+    second = ExecutionEvaluator(db_root, cache_path=cache_path, workers=1)
+    assert second.gold_results(gold) == before
+    assert second.stats()["gold_cache_hits"] == 2
+    assert second.stats()["executed_queries"] == 0
+
+    db_path = os.path.join(db_root, DB_ID, f"{DB_ID}.sqlite")
+    connection = sqlite3.connect(db_path)
+    connection.execute("INSERT INTO singer (Name) VALUES ('new')")
+    connection.commit()
+    connection.close()
+    stat = os.stat(db_path)
+    # the modification time changes even on coarse-grained file systems
+    os.utime(db_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    third = ExecutionEvaluator(db_root, cache_path=cache_path, workers=1)
+    after = third.gold_results(gold)
+    assert third.stats()["gold_cache_misses"] == 1
+    assert after[0]["outcome"] == "ok"
+    assert after[0]["digest"] != before[0]["digest"]
+
+
+def test_timeouts_are_not_cached(db_root, tmp_path):
+    cache_path = str(tmp_path / "gold.results.json")
+    gold = [gold_entry(HEAVY_QUERY), gold_entry(COUNT_QUERY)]
+
+    limited = ExecutionEvaluator(
+        db_root,
+        cache_path=cache_path,
+        workers=1,
+        limits=QueryLimits(max_steps=5000, check_every=100),
+    )
+    results = limited.gold_results(gold)
+    assert [result["outcome"] for result in results] == ["timeout", "ok"]
+    with open(cache_path) as file:
+        cached = json.load(file)
+    assert list(cached) == [limited.cache_key(DB_ID, COUNT_QUERY)]
+
+    # the next run retries the query that timed out, with its own budget
+    unlimited = ExecutionEvaluator(db_root, cache_path=cache_path, workers=1)
+    results = unlimited.gold_results(gold)
+    assert [result["outcome"] for result in results] == ["ok", "ok"]
+    assert unlimited.stats()["gold_cache_misses"] == 1
+    assert unlimited.stats()["gold_cache_hits"] == 1
+
+
+def test_predictions_are_compared_by_result(db_root):
+    gold = [gold_entry("SELECT Name, Age FROM singer")] * 3
+    runs = {
+        "run": [
+            {"answer": "SELECT Name, Age FROM singer ORDER BY Age DESC", "attempts": 1},
+            {"answer": "SELECT DISTINCT Name, Age FROM singer", "attempts": 1},
+            {"answer": "SELECT Nmae FROM singer", "attempts": 2},
+        ]
+    }
+    evaluator = ExecutionEvaluator(db_root, workers=1)
+    questions = evaluator.evaluate(gold, runs)["run"]
+    assert [question["correct"] for question in questions] == [True, False, False]
+    assert [question["executable"] for question in questions] == [True, True, False]
+    assert evaluator.breakdown(questions)["Attempts"] == {"All": 4}
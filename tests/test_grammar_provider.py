@@ -0,0 +1,73 @@
+import json
+import multiprocessing
+import os
+
+from conftest import TABLES, create_database
+from core.GrammarProvider import GrammarProvider
+from core.SQLCFG import MANIFEST_NAME, SQLCFG
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE = os.path.join(ROOT, "grammars", "template.ebnf")
+DB_IDS = ["concert_singer", "club_1", "concert_singer_2"]
+
+
+def create_databases(tmp_path):
+    """
+    Creates the databases of DB_IDS and an empty grammar directory.
+
+    Returns:
+        tuple: The database root and the grammar directory.
+    """
+    db_root = tmp_path / "database"
+    for db_id in DB_IDS:
+        tables = TABLES[db_id.removesuffix("_2")]
+        create_database(str(db_root / db_id / f"{db_id}.sqlite"), tables)
+    grammar_directory = tmp_path / "grammars"
+    grammar_directory.mkdir()
+    return str(db_root), str(grammar_directory)
+
+
+def read_manifest(grammar_directory):
+    with open(os.path.join(grammar_directory, MANIFEST_NAME)) as file:
+        return json.load(file)
+
+
+def test_providers_sharing_a_directory_keep_each_others_entries(tmp_path):
+    db_root, grammar_directory = create_databases(tmp_path)
+    first, second = (
+        GrammarProvider(SQLCFG(TEMPLATE, db_root, grammar_directory)) for _ in range(2)
+    )
+
+    # as in two workers of the sharded driver, interleaving their first questions
+    assert first.get(DB_IDS[0])
+    assert second.get(DB_IDS[1])
+    assert first.get(DB_IDS[2])
+    assert sorted(read_manifest(grammar_directory)) == sorted(DB_IDS)
+
+    # a grammar built by another process is reused from disk
+    assert second.get(DB_IDS[0])
+    assert second.stats()["disk_hits"] == 1
+
+
+def update_entries(db_root, grammar_directory, worker, count):
+    sql_grammar = SQLCFG(TEMPLATE, db_root, grammar_directory)
+    for i in range(count):
+        sql_grammar.update_manifest({f"db_{worker}_{i}": {"worker": worker}})
+
+
+def test_concurrent_manifest_updates_are_merged(tmp_path):
+    db_root, grammar_directory = create_databases(tmp_path)
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=update_entries, args=(db_root, grammar_directory, worker, 25)
+        )
+        for worker in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    assert len(read_manifest(grammar_directory)) == 4 * 25
@@ -0,0 +1,77 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+
+from core.PredictionWriter import (
+    PredictionWriter,
+    ordered_predictions,
+    read_predictions,
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RECORDS = [{"id": i, "answer": f"SELECT {i} FROM singer"} for i in range(5)]
+
+
+def write_killed(path, records, partial):
+    """
+    Writes records in a child process, which is killed with SIGKILL after flushing the first
+    `partial` characters of one more record.
+    """
+    script = textwrap.dedent(f"""
+        import json, os, signal, sys
+        sys.path.insert(0, {ROOT!r})
+        from core.PredictionWriter import PredictionWriter
+        writer = PredictionWriter({str(path)!r})
+        for record in {records!r}:
+            writer.write(record)
+        writer.file.write(json.dumps({{"id": 99, "answer": "SELECT"}})[:{partial}])
+        writer.file.flush()
+        os.kill(os.getpid(), signal.SIGKILL)
+        """)
+    process = subprocess.run([sys.executable, "-c", script])
+    assert process.returncode == -signal.SIGKILL
+
+
+def test_truncated_last_line_is_ignored_and_dropped_on_resume(tmp_path):
+    path = tmp_path / "output.jsonl"
+    write_killed(path, RECORDS[:3], partial=12)
+    assert not path.read_bytes().endswith(b"\n")
+    assert read_predictions(path) == RECORDS[:3]
+
+    with PredictionWriter(str(path), resume=True) as writer:
+        for record in RECORDS[3:]:
+            writer.write(record)
+
+    uninterrupted = tmp_path / "uninterrupted.jsonl"
+    with PredictionWriter(str(uninterrupted)) as writer:
+        for record in RECORDS:
+            writer.write(record)
+    assert path.read_bytes() == uninterrupted.read_bytes()
+
+
+def test_fresh_run_truncates_existing_output(tmp_path):
+    path = tmp_path / "output.jsonl"
+    with PredictionWriter(str(path)) as writer:
+        writer.write(RECORDS[0])
+    with PredictionWriter(str(path)) as writer:
+        writer.write(RECORDS[1])
+    assert read_predictions(path) == [RECORDS[1]]
+
+
+def test_ordered_predictions_keep_last_record_per_id(tmp_path):
+    path = tmp_path / "output.jsonl"
+    lines = [
+        {"id": 2, "answer": "first"},
+        {"id": 0, "answer": "zero"},
+        {"id": 2, "answer": "second"},
+        {"id": 1, "answer": "one"},
+    ]
+    path.write_text("".join(json.dumps(line) + "\n" for line in lines))
+    assert ordered_predictions(str(path)) == [
+        {"id": 0, "answer": "zero"},
+        {"id": 1, "answer": "one"},
+        {"id": 2, "answer": "second"},
+    ]
@@ -0,0 +1,36 @@
+from conftest import PROMPT_TEMPLATE
+from core.Text2SQL import Text2SQL
+
+OUTPUTS = ("output.jsonl", "output.json", "output.txt")
+
+
+def run(tiny_model, predicted_path, db_path, questions_file, resume=False):
+    text2sql = Text2SQL(
+        tiny_model,
+        str(predicted_path),
+        None,
+        db_path,
+        PROMPT_TEMPLATE,
+        max_new_tokens=8,
+        quantization="none",
+    )
+    text2sql.predict(questions_file, resume)
+    text2sql.convert_json_to_txt()
+
+
+def test_resumed_run_matches_uninterrupted_run(
+    tmp_path, tiny_model, db_path, questions_file
+):
+    uninterrupted = tmp_path / "uninterrupted"
+    uninterrupted.mkdir()
+    run(tiny_model, uninterrupted, db_path, questions_file)
+
+    # a run killed while writing its fourth answer
+    interrupted = tmp_path / "interrupted"
+    interrupted.mkdir()
+    lines = (uninterrupted / "output.jsonl").read_bytes().splitlines(keepends=True)
+    (interrupted / "output.jsonl").write_bytes(b"".join(lines[:3]) + lines[3][:20])
+    run(tiny_model, interrupted, db_path, questions_file, resume=True)
+
+    for name in OUTPUTS:
+        assert (interrupted / name).read_bytes() == (uninterrupted / name).read_bytes()
@@ -0,0 +1,50 @@
+import functools
+import json
+
+from conftest import PROMPT_TEMPLATE
+from core.ShardedInference import ShardedInference, shard_questions
+from core.Text2SQL import Text2SQL
+
+
+def build_text2sql(tiny_model, predicted_path, db_path):
+    return functools.partial(
+        Text2SQL,
+        tiny_model,
+        predicted_path,
+        None,
+        db_path,
+        PROMPT_TEMPLATE,
+        max_new_tokens=8,
+        quantization="none",
+    )
+
+
+def test_shards_keep_databases_together():
+    questions = [
+        {"id": i, "db_id": db_id, "question": "q"}
+        for i, db_id in enumerate(["a", "b", "a", "c", "b", "a"])
+    ]
+    shards = shard_questions(questions, 2)
+    assert sorted(q["id"] for shard in shards for q in shard) == list(range(6))
+    assert max(len(shard) for shard in shards) <= 3
+
+
+def test_cpu_shards_match_single_process(tmp_path, tiny_model, db_path, questions_file):
+    single_path = tmp_path / "single"
+    single_path.mkdir()
+    single = build_text2sql(tiny_model, str(single_path), db_path)()
+    single.predict(questions_file)
+    single.convert_json_to_txt()
+
+    sharded_path = tmp_path / "sharded"
+    driver = ShardedInference(
+        build_text2sql(tiny_model, str(sharded_path), db_path), workers=2
+    )
+    driver.predict(questions_file, str(sharded_path))
+
+    records = json.loads((sharded_path / "output.json").read_text())
+    assert [record["id"] for record in records] == list(range(6))
+    assert (sharded_path / "output.txt").read_text() == (
+        single_path / "output.txt"
+    ).read_text()
+    assert records == json.loads((single_path / "output.json").read_text())
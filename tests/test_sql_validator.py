@@ -0,0 +1,103 @@
+import sqlite3
+
+import pytest
+
+from conftest import TABLES, create_database
+from core.SchemaCatalog import load_schema
+from core.SQLValidator import SQLValidator
+
+VALID = [
+    "SELECT Name FROM singer",
+    "SELECT T1.Name, T2.concert_Name FROM singer AS T1 JOIN concert AS T2 "
+    "ON T1.Singer_ID = T2.concert_ID",
+    # aliases reused in the parts of a compound SELECT
+    "SELECT T2.Country FROM concert AS T1 JOIN singer AS T2 ON T1.concert_ID = "
+    "T2.Singer_ID UNION SELECT T2.Capacity FROM concert AS T1 JOIN stadium AS T2 "
+    "ON T1.Stadium_ID = T2.Stadium_ID",
+    "SELECT T1.Name FROM singer AS T1 EXCEPT SELECT T1.Name FROM stadium AS T1",
+    # aliases reused by subqueries
+    "SELECT T1.Country FROM singer AS T1 WHERE T1.Singer_ID IN "
+    "(SELECT T1.concert_ID FROM concert AS T1)",
+    "SELECT T2.Name FROM stadium AS T2 WHERE T2.Stadium_ID IN "
+    "(SELECT T2.Stadium_ID FROM concert AS T2)",
+    # correlated subqueries
+    "SELECT T1.Name FROM stadium AS T1 WHERE EXISTS "
+    "(SELECT 1 FROM concert AS T2 WHERE T2.Stadium_ID = T1.Stadium_ID)",
+    "SELECT (SELECT count(*) FROM concert AS T2 WHERE T2.Stadium_ID = T1.Stadium_ID) "
+    "FROM stadium AS T1",
+    "SELECT Name FROM stadium WHERE Capacity > (SELECT avg(Capacity) FROM stadium)",
+    # subqueries in FROM
+    "SELECT T.Name FROM (SELECT Name FROM singer) AS T",
+    # common table expressions
+    "WITH c AS (SELECT Stadium_ID, count(*) AS n FROM concert GROUP BY Stadium_ID) "
+    "SELECT T1.Name, c.n FROM stadium AS T1 JOIN c ON c.Stadium_ID = T1.Stadium_ID",
+    "WITH T1 AS (SELECT Name FROM singer) SELECT T1.Name FROM T1",
+    # column aliases in ORDER BY
+    "SELECT Country, count(*) AS total FROM singer GROUP BY Country ORDER BY total DESC",
+    "SELECT Name AS n FROM singer ORDER BY n",
+    # LIMIT offset, count
+    "SELECT Name FROM singer ORDER BY Age LIMIT 1, 2",
+    "SELECT Name FROM singer LIMIT 2 OFFSET 1",
+    "SELECT Name FROM singer WHERE Name IS NOT DISTINCT FROM 'x'",
+    "SELECT count(*) FROM singer;",
+    # unquoted identifiers with non-ASCII letters
+    "SELECT prénom FROM café",
+    "SELECT c.prénom, count(*) FROM café AS c WHERE c.âge > 1 GROUP BY c.prénom",
+]
+
+INVALID = [
+    "SELECT Nmae FROM singer",
+    "SELECT Name FROM singers",
+    "SELECT T3.Name FROM singer AS T1",
+    "SELECT singer.Name FROM singer AS T1",
+    "SELECT T1.Capacity FROM singer AS T1 JOIN stadium AS T2",
+    # an alias of one part is not visible in another part
+    "SELECT T1.Name FROM singer AS T1 UNION SELECT T1.Name FROM stadium AS T2",
+    # inner aliases are not visible outside their subquery
+    "SELECT T2.Name FROM singer AS T1 WHERE T1.Singer_ID IN "
+    "(SELECT T2.Stadium_ID FROM concert AS T2)",
+    "SELECT T1.Name FROM (SELECT Name FROM singer AS T1) AS T",
+    # a reused alias names the table of its own subquery
+    "SELECT T1.Name FROM singer AS T1 WHERE T1.Singer_ID IN "
+    "(SELECT T1.Capacity FROM concert AS T1)",
+    "SELECT Name FROM stadium WHERE Stadium_ID IN (SELECT Stadium_ID FROM concert AS T1 "
+    "WHERE T1.Capacity > 10)",
+    "SELECT Name FROM singer JOIN stadium",
+    "SELECT Name FROM singer WHERE",
+    "SELECT Name FROM singer WHERE Age > 1 WHERE Age < 5",
+    "SELECT Name FROM singer ORDER BY Age GROUP BY Country",
+    "SELECT Name, FROM singer",
+    "SELECT Name FROM singer WHERE Name = 'x",
+    "SELECT count(*) FROM (SELECT Name FROM singer",
+    "SELECT Name FROM singer; SELECT 1",
+    "SELECT Name FROM singer WHERE Age > ALL (SELECT Age FROM singer)",
+    "SELECT prenom FROM café",
+    "SELECT c.âge FROM café AS ç",
+]
+
+
+@pytest.fixture(scope="module")
+def connection(tmp_path_factory):
+    path = tmp_path_factory.mktemp("validator") / "concert_singer.sqlite"
+    create_database(str(path), dict(TABLES["concert_singer"], café=["prénom", "âge"]))
+    connection = sqlite3.connect(str(path))
+    yield connection
+    connection.close()
+
+
+def sqlite_rejects(connection, query):
+    try:
+        connection.execute(query).fetchall()
+    except (sqlite3.Error, sqlite3.Warning):
+        return True
+    return False
+
+
+@pytest.mark.parametrize("query", VALID + INVALID)
+def test_validator_agrees_with_sqlite(connection, query):
+    schema = load_schema(None, connection)
+    issues = SQLValidator().validate(query, schema)
+    assert bool(issues) == sqlite_rejects(connection, query), [
+        str(issue) for issue in issues
+    ]
+    assert bool(issues) == (query in INVALID)
@@ -0,0 +1,130 @@
+import json
+import os
+
+import pytest
+
+from conftest import TABLES, create_database
+from core.SQLCFG import MANIFEST_NAME, SQLCFG, trie_alternation
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATES = {
+    "flat": os.path.join(ROOT, "grammars", "template.ebnf"),
+    "qualified": os.path.join(ROOT, "grammars", "template_qualified.ebnf"),
+}
+
+
+@pytest.fixture(scope="module")
+def tokenizer(tiny_model):
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(tiny_model)
+
+
+def build_grammar(column_mode, db_path, grammar_directory, db_id):
+    """
+    Generates the grammar file of a database and reads it back.
+    """
+    sql_grammar = SQLCFG(
+        TEMPLATES[column_mode],
+        db_path,
+        str(grammar_directory),
+        column_mode=column_mode,
+    )
+    status, _ = sql_grammar.process_database(db_id, None)
+    assert status == "generated"
+    with open(os.path.join(grammar_directory, f"{db_id}.ebnf")) as file:
+        return file.read()
+
+
+def accepts(grammar, tokenizer, query):
+    from transformers_cfg.grammar_utils import IncrementalGrammarConstraint
+
+    constraint = IncrementalGrammarConstraint(grammar, "root", tokenizer)
+    return constraint.string_recognizer._accept_string(query)
+
+
+def test_trie_alternation_factors_common_prefixes():
+    assert (
+        trie_alternation(dict.fromkeys(["Stadium_ID", "Stadium_Name", "Singer_ID"], ""))
+        == '"S" ("inger_ID" | "tadium_" ("ID" | "Name"))'
+    )
+    # a word that is a prefix of another ends the branch optionally
+    assert trie_alternation(dict.fromkeys(["Name", "Names"], "")) == '"Name" ("s")?'
+    assert trie_alternation({"a": "x", "b": ""}) == '("a" x | "b")'
+
+
+def test_placeholders_list_every_table_and_column_once(tmp_path, db_path):
+    sql_grammar = SQLCFG(TEMPLATES["flat"], db_path, str(tmp_path))
+    schema = TABLES["concert_singer"]
+    tables, columns = sql_grammar.get_placeholders(list(schema), schema)
+    assert tables == '"singer" | "concert" | "stadium"'
+    names = [name.strip('"') for name in columns.split(" | ")]
+    assert names == list(
+        dict.fromkeys(name for table in schema.values() for name in table)
+    )
+
+
+def test_tables_with_the_same_columns_share_a_rule(tmp_path, db_path):
+    sql_grammar = SQLCFG(
+        TEMPLATES["qualified"], db_path, str(tmp_path), column_mode="qualified"
+    )
+    schema = {"a": ["x", "y"], "b": ["x", "y"], "c": ["z"]}
+    _, _, qualified, rules = sql_grammar.get_qualified_placeholders(
+        list(schema), schema
+    )
+    assert (
+        qualified == '("a" "." columns-a-0 | "b" "." columns-a-0 | "c" "." columns-c-1)'
+    )
+    assert rules == 'columns-a-0 ::= ("x" | "y")\n\ncolumns-c-1 ::= "z"'
+
+
+@pytest.mark.parametrize("column_mode", ["flat", "qualified"])
+def test_generated_grammars_constrain_columns(
+    tmp_path, db_path, tokenizer, column_mode
+):
+    grammar = build_grammar(column_mode, db_path, tmp_path, "concert_singer")
+    for query in (
+        "SELECT singer.Name FROM singer;",
+        "SELECT Capacity FROM stadium;",
+        "SELECT stadium.Stadium_ID FROM concert;",
+    ):
+        assert accepts(grammar, tokenizer, query), query
+    for query in ("SELECT singer.Nmae FROM singer;", "SELECT Name FROM singers;"):
+        assert not accepts(grammar, tokenizer, query), query
+    # only per-table rules tie a qualified column to its table
+    assert accepts(grammar, tokenizer, "SELECT singer.Capacity FROM singer;") == (
+        column_mode == "flat"
+    )
+
+
+def test_process_databases_merges_the_manifest(tmp_path):
+    db_root = tmp_path / "database"
+    for db_id, tables in TABLES.items():
+        create_database(str(db_root / db_id / f"{db_id}.sqlite"), tables)
+    grammar_directory = str(tmp_path / "grammars")
+    sql_grammar = SQLCFG(TEMPLATES["flat"], str(db_root), grammar_directory)
+    sql_grammar.update_manifest({"removed_db": {"version": None}})
+    assert sorted(sql_grammar.process_databases()["generated"]) == sorted(TABLES)
+    manifest_path = os.path.join(grammar_directory, MANIFEST_NAME)
+    with open(manifest_path) as file:
+        before = json.load(file)
+    assert sorted(before) == sorted(TABLES)
+
+    # a database that fails keeps the entry of the grammar file it still has
+    with open(db_root / "club_1" / "club_1.sqlite", "wb") as file:
+        file.write(b"not a database" * 100)
+    # an entry written by another process during the run is kept
+    process_database = sql_grammar.process_database
+
+    def process_and_update(db_name, entry):
+        SQLCFG(TEMPLATES["flat"], str(db_root), grammar_directory).update_manifest(
+            {"lazy_db": {"version": None}}
+        )
+        return process_database(db_name, entry)
+
+    sql_grammar.process_database = process_and_update
+    summary = sql_grammar.process_databases()
+    assert summary["failed"] == ["club_1"]
+    with open(manifest_path) as file:
+        after = json.load(file)
+    assert after == dict(before, lazy_db={"version": None})
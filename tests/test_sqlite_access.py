@@ -0,0 +1,136 @@
+import os
+import sqlite3
+
+import pytest
+
+from core.SQLiteAccess import MirrorsExhausted, SQLiteAccess
+
+DB_ID = "concert_singer"
+
+
+def create_copy(root, rows=500):
+    """
+    Creates the database of DB_ID under a database root, with a table spanning several pages.
+
+    Returns:
+        str: Path to the database file.
+    """
+    path = os.path.join(root, DB_ID, f"{DB_ID}.sqlite")
+    os.makedirs(os.path.dirname(path))
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE singer (Name text)")
+    connection.executemany("INSERT INTO singer VALUES (?)", [("x" * 100,)] * rows)
+    connection.commit()
+    connection.close()
+    return path
+
+
+def corrupt(path, page_size=4096):
+    """
+    Overwrites a data page of a database, so that reading the table reports a malformed image.
+    """
+    with open(path, "r+b") as file:
+        file.seek(page_size * 2)
+        file.write(b"\xff" * page_size)
+
+
+def count_rows(connection, path):
+    return connection.execute("SELECT count(*) FROM singer").fetchone()[0], path
+
+
+@pytest.fixture
+def roots(tmp_path):
+    """
+    A primary database root and two mirror roots, each holding a healthy copy.
+    """
+    paths = [str(tmp_path / name) for name in ("database", "database2", "database3")]
+    for root in paths:
+        create_copy(root)
+    return paths
+
+
+def test_mirrors_are_database_roots(roots):
+    access = SQLiteAccess()
+    assert access.get_mirror_directories(roots[0]) == roots
+
+
+def test_failover_skips_a_corrupt_mirror(roots):
+    primary, corrupt_mirror, healthy_mirror = roots
+    os.remove(os.path.join(primary, DB_ID, f"{DB_ID}.sqlite"))
+    corrupt(os.path.join(corrupt_mirror, DB_ID, f"{DB_ID}.sqlite"))
+    access = SQLiteAccess(max_retries=2, base_delay=0.0)
+    db_path = os.path.join(primary, DB_ID, f"{DB_ID}.sqlite")
+
+    rows, path = access.run(db_path, count_rows)
+    assert rows == 500
+    assert path == os.path.join(healthy_mirror, DB_ID, f"{DB_ID}.sqlite")
+    stats = access.stats()
+    assert stats["corrupt"] == {
+        os.path.join(DB_ID, f"{DB_ID}.sqlite"): [corrupt_mirror]
+    }
+    assert stats["fallbacks"] == 1
+
+    # the corrupt copy is remembered and not tried again
+    attempts = stats["attempts"]
+    access.run(db_path, count_rows)
+    assert access.stats()["attempts"] - attempts <= access.max_retries + 1
+    assert access.stats()["reads"] == {healthy_mirror: 2}
+
+
+def test_query_errors_are_not_retried_on_mirrors(roots):
+    access = SQLiteAccess()
+    db_path = os.path.join(roots[0], DB_ID, f"{DB_ID}.sqlite")
+    with pytest.raises(sqlite3.OperationalError, match="no such table"):
+        access.run(
+            db_path, lambda connection, path: connection.execute("SELECT x FROM y")
+        )
+    assert access.stats()["attempts"] == 1
+
+
+def test_every_mirror_failing_raises(tmp_path):
+    access = SQLiteAccess(max_retries=1, base_delay=0.0)
+    with pytest.raises(MirrorsExhausted):
+        access.run(str(tmp_path / "database" / DB_ID / f"{DB_ID}.sqlite"), count_rows)
+
+
+def test_round_robin_spreads_reads_across_mirrors(roots):
+    access = SQLiteAccess(routing="round_robin")
+    db_path = os.path.join(roots[0], DB_ID, f"{DB_ID}.sqlite")
+    for _ in range(6):
+        access.run(db_path, count_rows)
+    assert access.stats()["reads"] == {root: 2 for root in roots}
+
+
+def test_least_loaded_routes_around_busy_mirrors(roots):
+    access = SQLiteAccess(routing="least_loaded")
+    db_path = os.path.join(roots[0], DB_ID, f"{DB_ID}.sqlite")
+
+    def nested(connection, path):
+        # while this read is in flight on one mirror, the next goes to an idle one
+        inner_path = access.run(db_path, count_rows)[1]
+        return path, inner_path
+
+    outer_path, inner_path = access.run(db_path, nested)
+    assert os.path.dirname(os.path.dirname(outer_path)) == roots[0]
+    assert os.path.dirname(os.path.dirname(inner_path)) == roots[1]
+    assert len(access.stats()["reads"]) == 2
+
+
+def test_round_robin_skips_corrupt_mirrors(roots):
+    corrupt(os.path.join(roots[1], DB_ID, f"{DB_ID}.sqlite"))
+    access = SQLiteAccess(routing="round_robin", base_delay=0.0)
+    db_path = os.path.join(roots[0], DB_ID, f"{DB_ID}.sqlite")
+    for _ in range(6):
+        access.run(db_path, count_rows)
+    reads = access.stats()["reads"]
+    assert roots[1] not in reads
+    assert set(reads) == {roots[0], roots[2]}
+
+
+def test_paths_with_uri_characters(tmp_path):
+    # "#", "?" and "%" are not read as the fragment, query or escapes of the URI
+    root = str(tmp_path / "data#1?x=%41")
+    create_copy(root, rows=3)
+    access = SQLiteAccess()
+    db_path = os.path.join(root, DB_ID, f"{DB_ID}.sqlite")
+    assert access.run(db_path, count_rows) == (3, db_path)
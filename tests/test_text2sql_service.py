@@ -0,0 +1,71 @@
+import asyncio
+
+from core.QuestionScheduler import QuestionScheduler
+from core.Text2SQLService import Text2SQLService
+
+
+class RecordingText2SQL:
+    """
+    Stands in for a loaded Text2SQL object, recording the batches it answers.
+    """
+
+    def __init__(self, batch_size=1):
+        self.batch_size = batch_size
+        self.scheduler = QuestionScheduler()
+        self.batches = []
+
+    def answer_batch(self, questions):
+        self.batches.append([question["question"] for question in questions])
+        return [
+            {"id": question["id"], "answer": f"SELECT '{question['question']}'"}
+            for question in questions
+        ]
+
+    def cache_stats(self):
+        return {}
+
+
+async def answer_concurrently(service, questions):
+    await service.start()
+    try:
+        return await asyncio.gather(
+            *(service.answer("concert_singer", question) for question in questions)
+        )
+    finally:
+        await service.stop()
+
+
+def test_concurrent_requests_share_one_batch():
+    # the batch size of questions files does not limit the service batches
+    text2sql = RecordingText2SQL(batch_size=1)
+    service = Text2SQLService(text2sql)
+    questions = [f"question {i}" for i in range(5)]
+
+    answers = asyncio.run(answer_concurrently(service, questions))
+
+    assert text2sql.batches == [questions]
+    assert [answer["answer"] for answer in answers] == [
+        f"SELECT '{question}'" for question in questions
+    ]
+    assert service.stats()["mean_batch_size"] == 5
+
+
+def test_batches_are_split_at_max_batch_size():
+    text2sql = RecordingText2SQL()
+    service = Text2SQLService(text2sql, max_batch_size=2)
+    questions = [f"question {i}" for i in range(5)]
+
+    asyncio.run(answer_concurrently(service, questions))
+
+    assert [len(batch) for batch in text2sql.batches] == [2, 2, 1]
+
+
+def test_identical_requests_share_one_answer():
+    text2sql = RecordingText2SQL()
+    service = Text2SQLService(text2sql)
+
+    answers = asyncio.run(answer_concurrently(service, ["same", "same", "other"]))
+
+    assert text2sql.batches == [["same", "other"]]
+    assert answers[0] == answers[1]
+    assert service.stats()["coalesced"] == 1